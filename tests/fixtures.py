@@ -1,3 +1,8 @@
+import base64
+import hashlib
+import os
+import subprocess
+import zipfile
 from collections import Counter
 from unittest.mock import MagicMock
 
@@ -36,43 +41,43 @@ def venv_path(tmpdir):
 
 
 @pytest.fixture(scope='function')
-def mock_api_create(venv_path):
+def mock_api_create(monkeypatch, venv_path):
     from vsh import api
 
-    api.create = MagicMock(return_value=venv_path)
+    monkeypatch.setattr(api, 'create', MagicMock(return_value=venv_path))
     return api.create
 
 
 @pytest.fixture(scope='function')
-def mock_api_enter():
+def mock_api_enter(monkeypatch):
     from vsh import api
 
     process_exit_code = 0
-    api.enter = MagicMock(return_value=process_exit_code)
+    monkeypatch.setattr(api, 'enter', MagicMock(return_value=subprocess.CompletedProcess(args=None, returncode=process_exit_code)))
     return api.enter
 
 
 @pytest.fixture(scope='function')
-def mock_api_remove(venv_path):
+def mock_api_remove(monkeypatch, venv_path):
     from vsh import api
 
-    api.remove = MagicMock(return_value=venv_path)
+    monkeypatch.setattr(api, 'remove', MagicMock(return_value=venv_path))
     return api.remove
 
 
 @pytest.fixture(scope='function')
-def mock_api_show_envs():
+def mock_api_show_envs(monkeypatch):
     from vsh import api
 
-    api.show_envs = MagicMock(return_value=None)
+    monkeypatch.setattr(api, 'show_envs', MagicMock(return_value=None))
     return api.show_envs
 
 
 @pytest.fixture(scope='function')
-def mock_show_version():
+def mock_show_version(monkeypatch):
     from vsh import api
 
-    api.show_version = MagicMock(return_value=None)
+    monkeypatch.setattr(api, 'show_version', MagicMock(return_value=None))
     return api.show_version
 
 
@@ -86,3 +91,39 @@ def mocked_api(mock_api_create, mock_api_enter, mock_api_remove, mock_api_show_e
             'show_envs': mock_api_show_envs,
             'show_version': mock_show_version,
             }
+
+
+@pytest.fixture(scope='function', autouse=True)
+def isolated_cache(monkeypatch, tmpdir):
+    """Keeps vsh caches, such as the environment index, out of the user's home"""
+    cache_home = str(tmpdir.join('.test-cache'))
+    monkeypatch.setenv('XDG_CACHE_HOME', cache_home)
+    return cache_home
+
+
+@pytest.fixture(scope='function')
+def make_wheel():
+    """Returns a function writing a minimal pure python wheel into a folder"""
+
+    def make_wheel(folder, name='vsh_demo', version='1.0', files=None, entry_points=None, requires=None):
+        files = dict(files or {f'{name}.py': 'VALUE = 42\n'})
+        dist_info = f'{name}-{version}.dist-info'
+        files[f'{dist_info}/METADATA'] = f'Metadata-Version: 2.1\nName: {name}\nVersion: {version}\n' + ''.join(
+            f'Requires-Dist: {requirement}\n' for requirement in requires or [])
+        files[f'{dist_info}/WHEEL'] = 'Wheel-Version: 1.0\nGenerator: vsh-tests\nRoot-Is-Purelib: true\nTag: py3-none-any\n'
+        if entry_points:
+            files[f'{dist_info}/entry_points.txt'] = entry_points
+        record = []
+        for filename, content in files.items():
+            data = content.encode('utf-8')
+            digest = base64.urlsafe_b64encode(hashlib.sha256(data).digest()).rstrip(b'=').decode('ascii')
+            record.append(f'{filename},sha256={digest},{len(data)}')
+        record.append(f'{dist_info}/RECORD,,')
+        files[f'{dist_info}/RECORD'] = '\n'.join(record) + '\n'
+        path = os.path.join(folder, f'{name}-{version}-py3-none-any.whl')
+        with zipfile.ZipFile(path, 'w') as archive:
+            for filename, content in files.items():
+                archive.writestr(filename, content)
+        return path
+
+    return make_wheel
@@ -0,0 +1,83 @@
+import asyncio
+import os
+
+import pytest
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("include_pip", [False, True])
+def test_create_enter_remove(tmpdir, include_pip):
+    from vsh import aio
+
+    names = ['test-aio-a', 'test-aio-b']
+    paths = [str(tmpdir.join(name)) for name in names]
+
+    async def lifecycle():
+        created = await asyncio.gather(*[aio.create(path, include_pip=include_pip) for path in paths])
+        valid = await asyncio.gather(*[aio.validate_environment(path) for path in created])
+        results = await asyncio.gather(*[aio.enter(path, 'echo "$VSH"', capture='capture') for path in created])
+        await asyncio.gather(*[aio.remove(path) for path in created])
+        return created, valid, results
+
+    created, valid, results = asyncio.run(lifecycle())
+    assert created == paths
+    assert valid == [True, True]
+    assert [r.stdout.splitlines()[-1] for r in results] == names
+    assert not any(os.path.exists(path) for path in paths)
+
+
+@pytest.mark.unit
+def test_session(tmpdir):
+    from vsh import aio
+    from vsh.api import find_environment_folders
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), shell='/bin/sh')
+    path = str(tmpdir.join('test-aio-session'))
+    assert list(find_environment_folders(session=session)) == []
+
+    async def run():
+        await aio.create(path, include_pip=False, session=session)
+        created = dict(find_environment_folders(session=session))
+        used = session.index(path).get(path).get('last_used')
+        session.index(path).update(path, last_used=0)
+        await aio.enter(path, 'true', capture='capture', session=session)
+        return created, used, await aio.validate_environment(path, session=session)
+
+    created, used, valid = asyncio.run(run())
+    assert created == {'test-aio-session': path}
+    assert used and session.index(path).get(path)['last_used'] >= used
+    assert valid is True
+
+
+@pytest.mark.unit
+def test_enter_timeout(tmpdir):
+    from vsh import aio
+
+    path = str(tmpdir.join('test-aio-timeout'))
+
+    async def run():
+        await aio.create(path, include_pip=False)
+        return await aio.enter(path, 'sleep 30', capture='capture', timeout=0.5)
+
+    result = asyncio.run(run())
+    assert result.timed_out is True
+    assert result.returncode != 0
+
+
+@pytest.mark.unit
+def test_enter_async_callback(tmpdir):
+    from vsh import aio
+
+    path = str(tmpdir.join('test-aio-callback'))
+    lines = []
+
+    async def on_line(stream_name, line):
+        lines.append((stream_name, line))
+
+    async def run():
+        await aio.create(path, include_pip=False)
+        return await aio.enter(path, 'echo one; echo two', capture=on_line)
+
+    asyncio.run(run())
+    assert lines[-2:] == [('stdout', 'one'), ('stdout', 'two')]
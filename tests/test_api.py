@@ -1,3 +1,4 @@
+import contextlib
 import os
 import sys
 from pathlib import Path
@@ -127,12 +128,108 @@ def test_enter(tmpdir, capsys, command, expected_output):
     created_path = create(path=path, overwrite=True)
 
     # Then run the command
-    enter(created_path, command)
+    result = enter(created_path, command, capture='capture')
 
-    # TODO: Make this actually work
     # Validate that the command performed correctly
-    # captured = capsys.readouterr()
-    # assert expected_output in captured.out
+    assert result.returncode == 0
+    assert expected_output in result.stdout
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("capture, timeout, max_output, expected", [
+    # Bounded capture keeps the tail
+    ('capture', None, 8, {'stdout': 'three', 'truncated': True}),
+    # Timeouts kill the command
+    ('capture', 0.5, None, {'timed_out': True}),
+    # Stream to a callback
+    ('callback', None, None, {'lines': [('stdout', 'one'), ('stdout', 'two'), ('stdout', 'three')]}),
+    ])
+def test_enter_capture(tmpdir, capture, timeout, max_output, expected):
+    from vsh.api import create, enter
+
+    path = create(path=str(tmpdir.join('test-enter-capture')), include_pip=False)
+    lines = []
+    if capture == 'callback':
+        capture = lambda *item: lines.append(item)  # noqa
+    command = 'sleep 30' if timeout else 'echo one; echo two; echo three'
+    result = enter(path, command, capture=capture, timeout=timeout, max_output=max_output)
+
+    assert result.timed_out is expected.get('timed_out', False)
+    assert result.truncated is expected.get('truncated', False)
+    if 'stdout' in expected:
+        assert result.stdout == expected['stdout']
+    if 'lines' in expected:
+        assert lines == expected['lines']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("capture", ['inherit', 'capture'])
+def test_enter_timeout_kills_children(tmpdir, capture):
+    import time
+    from vsh.api import create, enter
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), shell='/bin/sh')
+    path = create(path=str(tmpdir.join('test-enter-timeout')), include_pip=False, session=session)
+    marker = tmpdir.join('marker')
+    result = enter(path, f'(sleep 1; touch {marker}) & wait', capture=capture, timeout=0.3, session=session)
+
+    assert result.timed_out is True
+    time.sleep(1.5)
+    assert not marker.exists()
+
+
+@pytest.mark.unit
+@pytest.mark.skipif(sys.platform == 'win32', reason='needs a pty')
+def test_enter_timeout_keeps_terminal(tmpdir):
+    import pty
+    from vsh.api import create
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), shell='/bin/sh')
+    path = create(path=str(tmpdir.join('test-enter-terminal')), include_pip=False, session=session)
+    output = tmpdir.join('output')
+    check = 'import os; print(os.getsid(0), os.getpgrp(), os.tcgetpgrp(0) == os.getpgrp())'
+    script = '; '.join([
+        'import os',
+        'from vsh.api import enter',
+        'from vsh.session import Vsh',
+        f'session = Vsh(workon_home={str(tmpdir)!r}, cache_dir={str(tmpdir.join("cache"))!r}, shell="/bin/sh")',
+        f'enter({path!r}, {f"python -c {check!r} > {output}"!r}, timeout=30, session=session)',
+        'print("back", os.tcgetpgrp(0) == os.getpgrp(), os.getsid(0), os.getpgrp(), flush=True)',
+        ])
+    pid, fd = pty.fork()
+    if pid == 0:
+        os.execv(sys.executable, [sys.executable, '-c', script])
+    lines = b''
+    with contextlib.suppress(OSError):
+        for block in iter(lambda: os.read(fd, 1024), b''):
+            lines += block
+    os.waitpid(pid, 0)
+    os.close(fd)
+
+    back = lines.decode().split('back ')[-1].split()
+    assert back[0] == 'True'
+    sid, pgid, foreground = output.read().split()
+    # Same session and terminal, but a group of its own holding the terminal meanwhile
+    assert sid == back[1] and pgid != back[2] and foreground == 'True'
+
+
+@pytest.mark.unit
+def test_stream(tmpdir):
+    import asyncio
+    from vsh.api import create, stream
+
+    path = create(path=str(tmpdir.join('test-stream')), include_pip=False)
+
+    async def consume():
+        output = stream(path, 'echo out; echo err >&2; exit 4')
+        lines = [item async for item in output]
+        return lines, output.result
+
+    lines, result = asyncio.run(consume())
+    assert sorted(lines) == [('stderr', 'err'), ('stdout', 'out')]
+    assert result.returncode == 4
 
 
 @pytest.mark.unit
@@ -167,6 +264,24 @@ def test_remove(tmpdir, name, error_name, check):
     assert not os.path.exists(path)
 
 
+@pytest.mark.unit
+def test_purge(tmpdir, capsys):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    path = api.create(str(tmpdir.join('test-purge')), include_pip=False, session=session)
+    api.remove(path, reap=False, session=session)
+
+    # Gone from listings at once, deleted by purge
+    assert not os.path.exists(path)
+    assert list(api.find_environment_folders(session=session)) == []
+    assert os.listdir(str(tmpdir.join('.trash')))
+    assert api.purge(session=session) == 1
+    assert not os.path.exists(str(tmpdir.join('.trash')))
+    assert 'Purged' in capsys.readouterr().out
+
+
 @pytest.mark.unit
 def test_show_envs(tmpdir, capsys):
     from vsh.api import create, remove, show_envs
@@ -181,6 +296,219 @@ def test_show_envs(tmpdir, capsys):
     assert name in out
 
 
+@pytest.mark.unit
+@pytest.mark.parametrize("sort, expected", [
+    (None, ['big', 'small']),
+    ('name', ['big', 'small']),
+    ('size', ['big', 'small']),
+    ('age', ['big', 'small']),
+    ])
+def test_show_envs_long(tmpdir, capsys, sort, expected):
+    import json
+    from vsh import api
+    from vsh.session import Vsh
+
+    structure = [
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ]
+    for name in ['small', 'big']:
+        for path in structure:
+            touch(Path(str(tmpdir.join(name))).joinpath(path))
+    Path(str(tmpdir.join('big', 'lib', 'python3.6', 'site-packages', 'foo-1.0.dist-info'))).mkdir()
+    tmpdir.join('big', 'data').write('x' * 2 ** 20)
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    api.enter(str(tmpdir.join('small')), 'true', capture='capture', session=session)
+    capsys.readouterr()
+
+    api.show_envs(sort=sort, as_json=True, session=session)
+    details = {item['name']: item for item in json.loads(capsys.readouterr().out)}
+    if sort:
+        assert list(details) == expected
+    assert details['big']['size'] > details['small']['size']
+    assert details['big']['packages'] == 1
+    assert details['small']['packages'] == 0
+    assert details['big']['version'] == '3.6'
+    assert details['big']['last_used'] is None
+    assert details['small']['last_used'] is not None
+
+    api.show_envs(long=True, sort=sort, session=session)
+    out, _ = capsys.readouterr()
+    assert 'Last used' in out
+    assert 'never' in out
+
+
+@pytest.mark.unit
+def test_environment_details_index(tmpdir, monkeypatch):
+    from vsh import api
+    from vsh.session import Vsh
+
+    path = api.create(str(tmpdir.join('test-details')), include_pip=False)
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    first = api.environment_details(path, session=session)
+    assert first.size > 0
+
+    # Unchanged environments are not measured again, even by a new session
+    measured = []
+    disk_usage = api._disk_usage
+    monkeypatch.setattr(api, '_disk_usage', lambda path: measured.append(path) or disk_usage(path))
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    assert api.environment_details(path, session=session) == first
+    assert measured == []
+
+    # Installing a package changes site-packages
+    site_packages = api._site_packages(path)[0]
+    Path(site_packages, 'foo-1.0.dist-info').mkdir()
+    details = api.environment_details(path, session=session)
+    assert measured == [path]
+    assert details.packages == first.packages + 1
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("options, expected", [
+    # Nothing to do
+    ({}, []),
+    # Unused for over a week
+    ({'max_age': '7d'}, ['older', 'old']),
+    # Least recently used first until under quota
+    ({'quota': '1.5M'}, ['older', 'old']),
+    ({'quota': 2.5 * 2 ** 20}, ['older']),
+    # Protected environments are kept
+    ({'max_age': '7d', 'protect': ['old*']}, []),
+    ({'quota': '1.5M', 'protect': ['older']}, ['old', 'new']),
+    ])
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_gc(tmpdir, capsys, monkeypatch, options, expected, dry_run):
+    import time
+    from vsh import api
+    from vsh.session import Vsh
+
+    structure = [
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ]
+    session = Vsh(workon_home=str(tmpdir.join('envs')), cache_dir=str(tmpdir.join('cache')), environ={})
+    now = time.time()
+    for name, days in [('new', 0), ('old', 10), ('older', 20)]:
+        for path in structure:
+            touch(Path(str(tmpdir.join('envs', name))).joinpath(path))
+        tmpdir.join('envs', name, 'data').write('x' * 2 ** 20)
+        path = str(tmpdir.join('envs', name))
+        session.index(path).update(path, last_used=now - days * 86400)
+
+    # Layers come from the details gc already collected, rather than a scan per remove
+    monkeypatch.setattr(api, '_dependents', lambda path, session=None: pytest.fail(f'rescanned for {path}'))
+    removed = api.gc(dry_run=dry_run, session=session, **options)
+    assert [item.name for item in removed] == expected
+    remaining = sorted(name for name, _ in api.find_environment_folders(session=session))
+    assert remaining == sorted({'new', 'old', 'older'} - (set() if dry_run else set(expected)))
+    out, _ = capsys.readouterr()
+    assert ('Would reclaim' if dry_run else 'Reclaimed') in out
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("value, expected", [
+    (60, 60),
+    (1.5, 1.5),
+    ('60', 60),
+    ('1.5', 1.5),
+    ('90m', 5400),
+    ('1.5h', 5400),
+    ('2d', 2 * 86400),
+    ('1w', 7 * 86400),
+    ('soon', ValueError),
+    ])
+def test_parse_duration(value, expected):
+    from vsh.api import _parse_duration
+
+    if isinstance(expected, type):
+        with pytest.raises(expected):
+            _parse_duration(value)
+    else:
+        assert _parse_duration(value) == expected
+
+
+@pytest.mark.unit
+def test_dedupe(tmpdir, capsys):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    first = api.create(str(tmpdir.join('first')), session=session)
+    api.create(str(tmpdir.join('second')), link='hardlink', session=session)
+    report = api.dedupe(session=session)
+
+    # The second stored its files when created, so the first now links to them
+    assert report.linked > 0
+    assert report.reclaimed > 0
+    assert report.errors == []
+    assert api.dedupe(session=session).linked == 0
+    assert os.path.isdir(str(tmpdir.join('.vsh-store')))
+    pip = next(Path(folder, 'pip', '__init__.py') for folder in api._site_packages(first) if Path(folder, 'pip').exists())
+    assert os.stat(pip).st_nlink == 3
+    assert 'Linked' in capsys.readouterr().out
+
+
+@pytest.mark.unit
+def test_layered_environment(tmpdir, capsys):
+    import subprocess
+    from vsh import api
+    from vsh.errors import BaseInUseError, BaseMismatchError, InvalidEnvironmentError
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    base = api.create(str(tmpdir.join('base')), include_pip=False, session=session)
+    version = api.inspect_environment(base, session=session).version
+    site_packages = Path(base, 'lib', 'python' + '.'.join(version.split('.')[:2]), 'site-packages')
+    site_packages.mkdir(parents=True, exist_ok=True)
+
+    # Packages installed into the base after layering are seen too
+    thin = api.create(str(tmpdir.join('thin')), include_pip=False, base=base, session=session)
+    site_packages.joinpath('from_base.py').write_text('VALUE = 42\n')
+    python = os.path.join(thin, 'bin', 'python')
+    out = subprocess.run([python, '-c', 'import from_base; print(from_base.VALUE)'], stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert out.strip() == '42'
+    assert api.inspect_environment(thin, session=session).base == base
+    assert api.environment_details(thin, session=session).base == base
+    api.show_envs(session=session)
+    assert 'base: ' in capsys.readouterr().out
+
+    # Bases with dependents are kept
+    with pytest.raises(BaseInUseError):
+        api.remove(base, session=session)
+    assert [item.name for item in api.gc(max_age=0, protect=['thin'], session=session)] == []
+
+    # A missing base invalidates the layer
+    os.rename(base, str(tmpdir.join('moved')))
+    assert api.inspect_environment(thin, session=session).valid is False
+    os.rename(str(tmpdir.join('moved')), base)
+    api.remove(thin, reap=False, session=session)
+
+    # Even when the layer was inspected before pyvenv.cfg named its base
+    late = api.create(str(tmpdir.join('late')), include_pip=False, session=session)
+    Path(late, 'lib', 'python' + '.'.join(version.split('.')[:2]), 'site-packages').mkdir(parents=True, exist_ok=True)
+    assert api.inspect_environment(late, session=session).base is None
+    api._layer(late, base, session=session)
+    with pytest.raises(BaseInUseError):
+        api.remove(base, session=session)
+    api.remove(late, reap=False, session=session)
+    api.remove(base, reap=False, session=session)
+
+    with pytest.raises(InvalidEnvironmentError):
+        api.create(str(tmpdir.join('orphan')), base=str(tmpdir.join('missing')), session=session)
+
+    # Bases must use the same python
+    for path in ['bin/activate.fish', 'bin/python', 'include/foo', 'lib/python2.7/site-packages/bar']:
+        touch(Path(str(tmpdir.join('legacy'))).joinpath(path))
+    with pytest.raises(BaseMismatchError):
+        api.create(str(tmpdir.join('mismatch')), include_pip=False, base=str(tmpdir.join('legacy')), session=session)
+    assert not os.path.exists(str(tmpdir.join('mismatch')))
+
+
 @pytest.mark.unit
 def test_show_version(tmpdir, capsys):
     from vsh.api import show_version
@@ -219,3 +547,392 @@ def test_validate_environment(tmpdir, structure, check, expected):
     for path in structure:
         touch(tmp_venv.joinpath(path))
     assert expected == api.validate_environment(tmp_venv, check=check)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("pattern, expected", [
+    # Glob
+    ('svc-*', ['svc-a', 'svc-b']),
+    # Regular expression
+    ('svc-[ab]|tool', ['svc-a', 'svc-b', 'tool']),
+    # Comma separated names
+    ('svc-a,tool', ['svc-a', 'tool']),
+    # Nothing
+    ('missing', []),
+    ])
+def test_find_environments(tmpdir, pattern, expected):
+    from vsh import api
+
+    structure = [
+        'pyvenv.cfg',
+        'bin/activate',
+        'bin/activate.fish',
+        'bin/python',
+        'bin/python3.6',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ]
+    for name in ['svc-a', 'svc-b', 'tool']:
+        for path in structure:
+            touch(Path(str(tmpdir.join(name))).joinpath(path))
+    found = sorted(name for name, path in api.find_environments(pattern, path=str(tmpdir)))
+    assert found == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("collect", [False, True])
+def test_enter_many(tmpdir, capsys, collect):
+    from vsh.api import create, enter_many
+
+    paths = [create(path=str(tmpdir.join(name)), include_pip=False) for name in ['test-many-a', 'test-many-b']]
+    results = enter_many(paths, 'echo "$VSH"; exit 3', workers=2, collect=collect)
+
+    assert [r.path for r in results] == paths
+    assert all(r.returncode == 3 for r in results)
+    assert all(r.duration >= 0 for r in results)
+    out, err = capsys.readouterr()
+    for path in paths:
+        assert os.path.basename(path) in out
+    if collect:
+        assert [r.stdout.splitlines()[-1] for r in results] == ['test-many-a', 'test-many-b']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("python, suffix", [
+    ('3.11', 'py311'),
+    ('python3.9', 'py39'),
+    ('/usr/bin/python3', 'py3'),
+    ('pypy3', 'pypy3'),
+    ])
+def test_matrix_paths(tmpdir, python, suffix):
+    from vsh.api import matrix_paths
+
+    path = str(tmpdir.join('test-matrix'))
+    assert matrix_paths(path, [python]) == [f'{path}-{suffix}']
+
+
+@pytest.mark.unit
+def test_create_matrix(tmpdir):
+    from vsh import api, errors
+
+    path = str(tmpdir.join('test-matrix'))
+    version = '.'.join(map(str, sys.version_info[0:2]))
+    paths = api.create_matrix(path, [version, sys.executable], include_pip=False)
+    assert paths == list(dict.fromkeys(api.matrix_paths(path, [version, sys.executable])))
+    assert all(api.validate_environment(p) for p in paths)
+
+    with pytest.raises(errors.InterpreterNotFound):
+        api.create_matrix(path, [version, '0.1'])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("structure, config, expected", [
+    # Version is read from pyvenv.cfg
+    ([
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.7/site-packages/bar',
+        ],
+        'home = /usr/bin\nversion = 3.7.4\n',
+        (True, '3.7.4', None)),
+    # Version falls back to the lib folder
+    ([
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ],
+        None,
+        (True, '3.6', None)),
+    # Missing activation scripts
+    ([
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ],
+        None,
+        (False, '3.6', 'activation scripts')),
+    # Missing site-packages
+    ([
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        ],
+        'version = 3.7.4\n',
+        (False, '3.7.4', 'site-packages')),
+    ])
+def test_inspect_environment(tmpdir, structure, config, expected):
+    from vsh import api
+    from vsh.session import Vsh
+
+    tmp_venv = Path(str(tmpdir.join('test-inspect-environment')))
+    for path in structure:
+        touch(tmp_venv.joinpath(path))
+    if config is not None:
+        tmp_venv.joinpath('pyvenv.cfg').write_text(config)
+
+    status = api.inspect_environment(tmp_venv, session=Vsh())
+    valid, version, reason = expected
+    assert status.valid is valid
+    assert status.version == version
+    if reason:
+        assert reason in status.reason
+    else:
+        assert status.reason is None
+
+
+@pytest.mark.unit
+def test_inspect_environment_cache(tmpdir):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh()
+    path = api.create(str(tmpdir.join('test-inspect-cache')), include_pip=False)
+    first = api.inspect_environment(path, session=session)
+    assert first.valid is True
+    assert api.inspect_environment(path, session=session) is first
+
+    os.rename(os.path.join(path, 'bin'), os.path.join(path, 'moved'))
+    assert api.inspect_environment(path, session=session).valid is False
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("max_depth, ignore, expected", [
+    # Defaults skip node_modules
+    (None, None, ['deep', 'top']),
+    # Only the top level
+    (1, None, ['top']),
+    # Nothing ignored
+    (None, [], ['deep', 'hidden', 'top']),
+    # Ignore patterns
+    (None, ['n*', 'nested'], ['top']),
+    ])
+def test_find_environment_folders(tmpdir, max_depth, ignore, expected):
+    from vsh import api
+    from vsh.session import Vsh
+
+    structure = [
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ]
+    for name in ['top', 'nested/more/deep', 'node_modules/hidden']:
+        for path in structure:
+            touch(Path(str(tmpdir.join(name))).joinpath(path))
+    session = Vsh(workon_home=str(tmpdir))
+    found = api.find_environment_folders(max_depth=max_depth, ignore=ignore, workers=2, session=session)
+    assert sorted(name for name, path in found) == expected
+
+
+@pytest.mark.unit
+def test_multiple_roots(tmpdir):
+    from vsh import api
+    from vsh.session import Vsh
+
+    structure = [
+        'bin/activate.fish',
+        'bin/python',
+        'include/foo',
+        'lib/python3.6/site-packages/bar',
+        ]
+    for name in ['ssd/shared', 'nfs/shared', 'nfs/remote']:
+        for path in structure:
+            touch(Path(str(tmpdir.join(name))).joinpath(path))
+    for name in ['ssd/.trash', 'nfs/.vsh-store', 'nfs/node_modules']:
+        tmpdir.join(name).ensure(dir=True)
+    session = Vsh(roots=[str(tmpdir.join('ssd')), str(tmpdir.join('nfs'))])
+
+    found = sorted(api.find_environment_folders(session=session))
+    assert found == sorted([
+        ('shared', str(tmpdir.join('ssd', 'shared'))),
+        ('shared', str(tmpdir.join('nfs', 'shared'))),
+        ('remote', str(tmpdir.join('nfs', 'remote'))),
+        ])
+    assert sorted(api.find_existing_venv_names(session=session)) == ['remote', 'shared']
+    assert api.resolve_environment('shared', session=session) == str(tmpdir.join('ssd', 'shared'))
+    assert api.resolve_environment('remote', session=session) == str(tmpdir.join('nfs', 'remote'))
+    assert api.resolve_environment('new', session=session) == str(tmpdir.join('ssd', 'new'))
+
+
+@pytest.mark.unit
+def test_iter_concurrently_timeout(capsys):
+    import time
+    from vsh import api
+
+    def slow():
+        time.sleep(5)
+        yield 'slow'
+
+    sources = {'fast': lambda: iter(['a', 'b']), 'slow': slow}
+    start = time.monotonic()
+    assert list(api._iter_concurrently(sources, timeout=0.2)) == [('fast', 'a'), ('fast', 'b')]
+    assert time.monotonic() - start < 2
+    out, err = capsys.readouterr()
+    assert 'slow' in err
+
+
+@pytest.mark.unit
+def test_sync(tmpdir, make_wheel, monkeypatch, capsys):
+    from vsh import api, dists
+    from vsh.errors import UnpinnedRequirementError, WheelsMissingError
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    os.makedirs(session.wheelhouse)
+    for name, version in [('alpha', '1.0'), ('alpha', '2.0'), ('beta', '1.0'), ('gamma', '1.0')]:
+        make_wheel(session.wheelhouse, name=name, version=version)
+    tmpdir.join('before.lock').write('alpha==1.0\nbeta==1.0\n')
+    tmpdir.join('after.lock').write('alpha==2.0\ngamma==1.0\n')
+    path = api.create(str(tmpdir.join('env')), include_pip=False, lock=str(tmpdir.join('before.lock')), session=session)
+
+    assert api.sync(path, str(tmpdir.join('after.lock')), dry_run=True, session=session) == api.SyncDelta(['gamma'], ['alpha'], ['beta'])
+    assert '- beta' in capsys.readouterr().out
+    assert api.sync(path, str(tmpdir.join('after.lock')), session=session) == api.SyncDelta(['gamma'], ['alpha'], ['beta'])
+    installed = dists.installed(api._site_packages(path))
+    assert {name: distribution.version for name, distribution in installed.items()} == {'alpha': '2.0', 'gamma': '1.0'}
+    assert not any(Path(folder, 'beta.py').exists() for folder in api._site_packages(path))
+
+    # Nothing changed: the marker answers without reading site-packages
+    monkeypatch.setattr(dists, 'installed', None)
+    assert api.sync(path, str(tmpdir.join('after.lock')), session=session) == api.SyncDelta([], [], [])
+    monkeypatch.undo()
+
+    # Installing drops the marker
+    api.install(path, lock=str(tmpdir.join('before.lock')), session=session)
+    assert api.sync(path, str(tmpdir.join('after.lock')), session=session) == api.SyncDelta([], ['alpha'], ['beta'])
+
+    # Offline from the session, a missing wheel fails before anything is removed
+    tmpdir.join('missing.lock').write('alpha==2.0\ndelta==1.0\n')
+    with pytest.raises(WheelsMissingError):
+        api.sync(path, str(tmpdir.join('missing.lock')), session=session)
+    assert sorted(dists.installed(api._site_packages(path))) == ['alpha', 'gamma']
+
+    tmpdir.join('loose.txt').write('alpha>=1.0\n')
+    with pytest.raises(UnpinnedRequirementError):
+        api.sync(path, str(tmpdir.join('loose.txt')), session=session)
+
+
+@pytest.mark.unit
+def test_freeze_and_diff(tmpdir, make_wheel):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    os.makedirs(session.wheelhouse)
+    for name, version in [('alpha', '1.0'), ('alpha', '2.0'), ('beta', '1.0'), ('gamma', '1.0'), ('Delta', '1.0')]:
+        make_wheel(session.wheelhouse, name=name, version=version)
+    tmpdir.join('a.lock').write('alpha==1.0\nbeta==1.0\nDelta==1.0\n')
+    tmpdir.join('b.lock').write('alpha==2.0\ngamma==1.0\nDelta==1.0\n')
+    a = api.create(str(tmpdir.join('a')), include_pip=False, lock=str(tmpdir.join('a.lock')), session=session)
+    b = api.create(str(tmpdir.join('b')), include_pip=False, lock=str(tmpdir.join('b.lock')), session=session)
+
+    assert api.freeze(a) == ['alpha==1.0', 'beta==1.0', 'Delta==1.0']
+    assert api.freeze_many([b, a], workers=2) == {b: ['alpha==2.0', 'Delta==1.0', 'gamma==1.0'], a: api.freeze(a)}
+
+    assert api.diff(a, a) == api.EnvironmentDiff([], [], [], [])
+    assert api.diff(a, b) == api.EnvironmentDiff(['gamma==1.0'], ['beta==1.0'], [('alpha', '1.0', '2.0')], [])
+
+    # Edited files show as modified
+    site_packages = next(folder for folder in api._site_packages(b) if os.path.exists(os.path.join(folder, 'Delta.py')))
+    with open(os.path.join(site_packages, 'Delta.py'), 'a') as stream:
+        stream.write('EDITED = True\n')
+    assert api.diff(a, b).modified == [('Delta==1.0', ['Delta.py'])]
+
+
+@pytest.mark.unit
+def test_precompile(tmpdir, make_wheel, capsys):
+    import importlib.util
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True, precompile='unchecked-hash')
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse)
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\n')
+    path = api.create(str(tmpdir.join('env')), include_pip=False, lock=str(tmpdir.join('requirements.lock')), verbose=1, session=session)
+    source = next(Path(folder, 'vsh_demo.py') for folder in api._site_packages(path) if Path(folder, 'vsh_demo.py').exists())
+    assert os.path.exists(importlib.util.cache_from_source(str(source)))
+    assert 'Precompiled' in capsys.readouterr().out
+
+    os.unlink(importlib.util.cache_from_source(str(source)))
+    compiled = api.precompile(path, session=session)
+    assert compiled.ok and compiled.mode == 'checked-hash'
+    assert os.path.exists(importlib.util.cache_from_source(str(source)))
+
+    # Without installs, the builder compiles
+    api.create(str(tmpdir.join('bare')), include_pip=False, precompile='timestamp', verbose=1, session=session)
+    assert '(timestamp)' in capsys.readouterr().out
+
+
+@pytest.mark.unit
+def test_bytecode_policy(tmpdir, make_wheel):
+    import importlib.util
+    import subprocess
+    from vsh import api, bytecode
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse)
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\n')
+    path = api.create(str(tmpdir.join('env')), include_pip=False, lock=str(tmpdir.join('requirements.lock')), bytecode_policy='prefix', session=session)
+    source = next(Path(folder, 'vsh_demo.py') for folder in api._site_packages(path) if Path(folder, 'vsh_demo.py').exists())
+    prefix = bytecode.cache_prefix(path, session.cache_dir)
+
+    # Bytecode was compiled into the local cache, not beside the source
+    assert not source.with_name('__pycache__').exists()
+    assert any(name.endswith('.pyc') for _, _, names in os.walk(prefix) for name in names)
+    env = api._update_environment(path, session=session)
+    assert env['PYTHONPYCACHEPREFIX'] == prefix
+    python = os.path.join(path, 'bin', 'python')
+    subprocess.run([python, '-c', 'import vsh_demo'], env=env, check=True)
+    assert not source.with_name('__pycache__').exists()
+
+    # Leaving prefix drops the cache
+    assert api.set_bytecode_policy(path, 'none', session=session) is None
+    assert not os.path.exists(prefix)
+    env = api._update_environment(path, session=session)
+    assert env['PYTHONDONTWRITEBYTECODE'] == '1' and 'PYTHONPYCACHEPREFIX' not in env
+
+    compiled = api.set_bytecode_policy(path, 'unchecked', session=session)
+    assert compiled.mode == 'unchecked-hash'
+    assert os.path.exists(importlib.util.cache_from_source(str(source)))
+
+    # Removing a prefix environment moves its cache to the trash
+    api.set_bytecode_policy(path, 'prefix', session=session)
+    assert os.path.isdir(prefix)
+    api.remove(path, reap=False, session=session)
+    assert not os.path.exists(prefix)
+    assert os.path.isdir(os.path.join(bytecode.cache_root(session.cache_dir), '.trash'))
+
+
+@pytest.mark.unit
+def test_diagnose_startup(tmpdir, capsys):
+    import json
+    from vsh import api, doctor
+    from vsh.errors import InvalidEnvironmentError
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    path = api.create(str(tmpdir.join('env')), include_pip=False, session=session)
+    site_packages = os.path.join(path, 'lib', f'python{sys.version_info[0]}.{sys.version_info[1]}', 'site-packages')
+    os.makedirs(site_packages, exist_ok=True)
+    Path(site_packages, 'slow.pth').write_text('import time; time.sleep(0.02)\n')
+    Path(site_packages, 'sitecustomize.py').write_text('import json\n')
+
+    report = api.diagnose_startup(path, runs=2, session=session)
+    assert report.runs == 2 and report.wall >= 0.02
+    assert [line.line for line in report.pth_lines if line.seconds >= doctor.PTH_THRESHOLD] == ['import time; time.sleep(0.02)']
+    assert report.customize['sitecustomize']['path'] == os.path.join(site_packages, 'sitecustomize.py')
+    assert 'sitecustomize' in [module.name for module in report.modules]
+
+    api.show_startup(report, as_json=True)
+    data = json.loads(capsys.readouterr().out)
+    assert data['pth_lines'][0]['expensive'] and 'sitecustomize' in data['customize']
+    api.show_startup(report)
+    assert 'slow.pth: import time; time.sleep(0.02)' in capsys.readouterr().out
+
+    with pytest.raises(InvalidEnvironmentError):
+        api.diagnose_startup(str(tmpdir.join('missing')), session=session)
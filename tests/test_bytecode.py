@@ -0,0 +1,62 @@
+import importlib.util
+import struct
+import sys
+
+import pytest
+
+
+def pyc_flags(source):
+    with open(importlib.util.cache_from_source(source), 'rb') as stream:
+        return struct.unpack('<4sI', stream.read(8))[1]
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("mode, flags", [
+    (None, 0b11),
+    ('timestamp', 0b00),
+    ('checked-hash', 0b11),
+    ('unchecked-hash', 0b01),
+    ])
+def test_precompile(tmpdir, mode, flags):
+    from vsh.bytecode import precompile
+
+    source = tmpdir.mkdir('package').join('module.py')
+    source.write('VALUE = 1\n')
+    compiled = precompile(sys.executable, [str(tmpdir), str(tmpdir.join('missing'))], mode=mode, workers=2)
+    assert compiled.ok
+    assert compiled.mode == (mode or 'checked-hash')
+    assert pyc_flags(str(source)) == flags
+
+
+@pytest.mark.unit
+def test_precompile_errors(tmpdir):
+    from vsh.bytecode import precompile
+
+    tmpdir.join('broken.py').write('print "python 2"\n')
+    assert not precompile(sys.executable, [str(tmpdir)]).ok
+    with pytest.raises(ValueError):
+        precompile(sys.executable, [str(tmpdir)], mode='sometimes')
+
+
+@pytest.mark.unit
+def test_policy(tmpdir):
+    from vsh import bytecode
+
+    tmpdir.join('pyvenv.cfg').write('home = /usr/bin\nversion = 3.11.7\n')
+    assert bytecode.read_policy(str(tmpdir)) is None
+    assert bytecode.policy_environ(str(tmpdir), str(tmpdir.join('cache'))) == {}
+
+    bytecode.write_policy(str(tmpdir), 'prefix')
+    bytecode.write_policy(str(tmpdir), 'none')
+    assert tmpdir.join('pyvenv.cfg').read() == 'home = /usr/bin\nversion = 3.11.7\nvsh-bytecode = none\n'
+    assert bytecode.policy_environ(str(tmpdir), str(tmpdir.join('cache'))) == {'PYTHONDONTWRITEBYTECODE': '1'}
+
+    prefix = bytecode.policy_environ(str(tmpdir), str(tmpdir.join('cache')), policy='prefix')['PYTHONPYCACHEPREFIX']
+    assert prefix == bytecode.cache_prefix(str(tmpdir), str(tmpdir.join('cache')))
+    assert prefix.startswith(str(tmpdir.join('cache', 'pycache')))
+    assert bytecode.cache_prefix(str(tmpdir.join('other')), str(tmpdir.join('cache'))) != prefix
+
+    bytecode.write_policy(str(tmpdir))
+    assert bytecode.read_policy(str(tmpdir)) is None
+    with pytest.raises(ValueError):
+        bytecode.write_policy(str(tmpdir), 'sometimes')
@@ -1,4 +1,3 @@
-import os
 import shlex
 from unittest.mock import MagicMock
 
@@ -14,14 +13,25 @@ import pytest
     ('vsh --version', {'show_version': 1}, 0),
     ('vsh --no-pip test-vsh-cli env', {'create': 1, 'enter': 1}, 0),
     ('vsh --ls', {'show_envs': 1}, 0),
+    ('vsh --ls --long --sort size', {'show_envs': 1}, 0),
+    ('vsh --gc', {}, 2),
+    ('vsh --gc --quota lots', {}, 2),
+    ('vsh --gc -d --max-age 30d', {}, 0),
+    ('vsh --purge', {}, 0),
+    ('vsh --dedupe -d', {}, 0),
+    ('vsh --wheelhouse build', {}, 1),
+    ('vsh --diff only-one', {}, 1),
+    ('vsh --freeze --each nothing-matches', {}, 0),
+    ('vsh --doctor startup', {}, 1),
     ('vsh', {}, 1),
     ('vsh -C tmp-venv', {'create': 1}, 0),
+    ('vsh -C --lock requirements.lock tmp-venv', {'create': 1}, 0),
     ])
-def test_vsh_cli(tmpdir, mocked_api, command, expected, click_runner, exit_code):
+def test_vsh_cli(tmpdir, monkeypatch, mocked_api, command, expected, click_runner, exit_code):
     """Tests `vsh` command-line interface"""
     from vsh.cli.vsh import vsh
 
-    os.environ['WORKON_HOME'] = str(tmpdir)
+    monkeypatch.setenv('WORKON_HOME', str(tmpdir))
 
     command = shlex.split(command)[1:]
 
@@ -33,12 +43,12 @@ def test_vsh_cli(tmpdir, mocked_api, command, expected, click_runner, exit_code)
 
 
 @pytest.mark.unit
-def test_vsh_cli_multi_command(tmpdir, click_runner, mocked_api, venv_path):
+def test_vsh_cli_multi_command(tmpdir, monkeypatch, click_runner, mocked_api, venv_path):
     """Tests `vsh` command-line interface with multiple lines"""
     from vsh import api
     from vsh.cli.vsh import vsh
 
-    os.environ['WORKON_HOME'] = str(tmpdir)
+    monkeypatch.setenv('WORKON_HOME', str(tmpdir))
 
     commands = [
         ('vsh test-vsh-cli echo "hi"', False),
@@ -48,7 +58,7 @@ def test_vsh_cli_multi_command(tmpdir, click_runner, mocked_api, venv_path):
     for command, exists in commands:
         command = shlex.split(command)[1:]
 
-        api.validate_environment = MagicMock(return_value=exists)
+        monkeypatch.setattr(api, 'validate_environment', MagicMock(return_value=exists))
 
         result = click_runner.invoke(vsh, command)
         assert result.exit_code == 0
@@ -57,3 +67,28 @@ def test_vsh_cli_multi_command(tmpdir, click_runner, mocked_api, venv_path):
 
     called = {k: v.call_count for k, v in mocked_api.items() if v.call_count != 0}
     assert called == expected
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize('command', [
+    'vsh -p 3.9,3.10 test-vsh-cli -- pytest',
+    'vsh test-vsh-cli -p 3.9,3.10 -- pytest',
+    'vsh test-vsh-cli --python=3.9,3.10 pytest',
+    ])
+def test_vsh_cli_matrix(tmpdir, monkeypatch, click_runner, mocked_api, command):
+    """Tests versions given before or after the venv name start matrix mode"""
+    from vsh import api
+    from vsh.cli.vsh import vsh
+
+    monkeypatch.setenv('WORKON_HOME', str(tmpdir))
+    create_matrix = MagicMock(side_effect=lambda path, pythons, **kwargs: api.matrix_paths(path, pythons))
+    enter_many = MagicMock(return_value=[])
+    monkeypatch.setattr(api, 'create_matrix', create_matrix)
+    monkeypatch.setattr(api, 'enter_many', enter_many)
+    monkeypatch.setattr(api, 'show_results', MagicMock())
+
+    result = click_runner.invoke(vsh, shlex.split(command)[1:])
+    assert result.exit_code == 0
+    assert create_matrix.call_args[0][1] == ['3.9', '3.10']
+    assert list(enter_many.call_args[0][1]) == ['pytest']
+    assert mocked_api['enter'].call_count == 0
@@ -0,0 +1,52 @@
+import os
+
+import pytest
+
+
+def make_dist_info(folder, name, version, metadata=None):
+    dist_info = os.path.join(folder, f'{name.replace("-", "_")}-{version}.dist-info')
+    os.makedirs(dist_info)
+    if metadata is not None:
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as stream:
+            stream.write(metadata)
+    return dist_info
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("name, expected", [
+    ('Django', 'django'),
+    ('zope.interface', 'zope_interface'),
+    ('typing-extensions', 'typing_extensions'),
+    ('ruamel__yaml', 'ruamel_yaml'),
+    ])
+def test_normalize(name, expected):
+    from vsh.dists import normalize
+
+    assert normalize(name) == expected
+
+
+@pytest.mark.unit
+def test_installed(tmpdir):
+    from vsh.dists import Distribution, installed, read_metadata
+
+    first = str(tmpdir.mkdir('first'))
+    second = str(tmpdir.mkdir('second'))
+    typing = make_dist_info(first, 'typing-extensions', '4.8.0',
+                            'Metadata-Version: 2.1\nName: typing_extensions\nVersion: 4.8.0\nSummary: Backported\n  and more\n\nName: ignored\n')
+    make_dist_info(first, 'bare', '1.0')
+    make_dist_info(second, 'typing-extensions', '4.0.0', 'Name: typing_extensions\nVersion: 4.0.0\n')
+    os.makedirs(os.path.join(first, 'old.egg-info'))
+
+    assert read_metadata(typing) == {'Metadata-Version': '2.1', 'Name': 'typing_extensions', 'Version': '4.8.0', 'Summary': 'Backported'}
+    assert installed([first, second, str(tmpdir.join('missing'))]) == {
+        'typing_extensions': Distribution('typing_extensions', '4.8.0', typing),
+        'bare': Distribution('bare', '1.0', os.path.join(first, 'bare-1.0.dist-info')),
+        }
+
+
+@pytest.mark.unit
+def test_parse_entry_points():
+    from vsh.dists import EntryPoint, parse_entry_points
+
+    text = '[console_scripts]\n# comment\ntool = pkg.cli:main [extra]\n\n[pytest11]\nplugin=pkg.plugin\nempty =\n'
+    assert parse_entry_points(text) == [EntryPoint('console_scripts', 'tool', 'pkg.cli:main [extra]'), EntryPoint('pytest11', 'plugin', 'pkg.plugin')]
@@ -0,0 +1,15 @@
+import pytest
+
+
+@pytest.mark.unit
+def test_parse_importtime():
+    from vsh.doctor import parse_importtime
+
+    text = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |   _io',
+        'import time:       485 |       1369 | _frozen_importlib_external',
+        'import time:        80 |         80 |     posixpath',
+        'Traceback (most recent call last):',
+        ])
+    assert parse_importtime(text) == [('_io', 120, 120, 1), ('_frozen_importlib_external', 485, 1369, 0), ('posixpath', 80, 80, 2)]
@@ -0,0 +1,93 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("change, alive", [
+    ({}, True),
+    # Owner exited
+    ({'pid': 'dead'}, False),
+    # Pid reused by another process
+    ({'start_time': 1}, False),
+    # Host rebooted
+    ({'boot_id': 'another-boot'}, False),
+    # Owners on other hosts are left alone
+    ({'pid': 'dead', 'host': 'elsewhere'}, True),
+    ])
+def test_owner_alive(tmpdir, change, alive):
+    from vsh import ephemeral
+
+    path = str(tmpdir.join('env'))
+    os.makedirs(path)
+    owner = ephemeral.claim(path, str(tmpdir.join('cache')))
+    assert owner['pid'] == os.getpid()
+    if change.get('pid') == 'dead':
+        change = dict(change, pid=dead_pid())
+    if 'boot_id' in change and not owner['boot_id']:
+        pytest.skip('no boot id on this platform')
+    if 'start_time' in change and not owner['start_time']:
+        pytest.skip('no process start times on this platform')
+    assert ephemeral.owner_alive(dict(owner, **change)) is alive
+
+
+@pytest.mark.unit
+def test_reap_orphans(tmpdir):
+    from vsh import ephemeral
+
+    cache_dir = str(tmpdir.join('cache'))
+    paths = {name: str(tmpdir.join('envs', name)) for name in ['orphan', 'owned', 'reused', 'released', 'gone']}
+    for name, path in paths.items():
+        os.makedirs(os.path.join(path, 'bin'))
+        ephemeral.claim(path, cache_dir, pid=os.getpid() if name == 'owned' else dead_pid())
+    # Recreated by someone else, released or removed without vsh
+    os.unlink(os.path.join(paths['reused'], ephemeral.OWNER))
+    ephemeral.release(paths['released'], cache_dir)
+    os.rename(paths['gone'], str(tmpdir.join('elsewhere')))
+
+    assert ephemeral.find_orphans(cache_dir) == [paths['orphan']]
+    assert len(os.listdir(os.path.join(cache_dir, 'ephemeral'))) == 2
+    assert ephemeral.reap_orphans(cache_dir) == [paths['orphan']]
+    assert sorted(os.listdir(str(tmpdir.join('envs')))) == ['owned', 'released', 'reused']
+    assert ephemeral.find_orphans(cache_dir) == []
+
+
+@pytest.mark.unit
+def test_reap_orphans_later(tmpdir):
+    from vsh import ephemeral
+
+    cache_dir = str(tmpdir.join('cache'))
+    assert ephemeral.reap_orphans_later(cache_dir) is None
+    path = str(tmpdir.join('env'))
+    os.makedirs(path)
+    ephemeral.claim(path, cache_dir, pid=dead_pid())
+
+    process = ephemeral.reap_orphans_later(cache_dir)
+    assert process.wait(timeout=60) == 0
+    assert not os.path.exists(path)
+    # Rate limited
+    ephemeral.claim(str(tmpdir.mkdir('next')), cache_dir, pid=dead_pid())
+    assert ephemeral.reap_orphans_later(cache_dir) is None
+    assert ephemeral.reap_orphans_later(cache_dir, interval=0).wait(timeout=60) == 0
+    assert not os.path.exists(str(tmpdir.join('next')))
+
+
+@pytest.mark.unit
+def test_create_ephemeral(tmpdir):
+    from vsh import api, ephemeral
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    path = api.create(str(tmpdir.join('test-ephemeral')), include_pip=False, ephemeral=True, session=session)
+    assert os.path.exists(os.path.join(path, ephemeral.OWNER))
+    assert os.listdir(str(tmpdir.join('cache', 'ephemeral')))
+    api.remove(path, reap=False, session=session)
+    assert os.listdir(str(tmpdir.join('cache', 'ephemeral'))) == []
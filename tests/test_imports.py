@@ -0,0 +1,121 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Imports modules, counting the stats of the path finders; their listdirs already happened when site looked for sitecustomize
+PROBE = '''
+import json, sys
+from importlib import _bootstrap_external, import_module
+counts = {'stat': 0}
+path_stat = _bootstrap_external._path_stat
+
+def counting_stat(path):
+    counts['stat'] += 1
+    return path_stat(path)
+
+_bootstrap_external._path_stat = counting_stat
+files = {name: getattr(import_module(name), '__file__', None) for name in sys.argv[1:]}
+_bootstrap_external._path_stat = path_stat
+finders = [type(finder).__name__ if not isinstance(finder, type) else finder.__name__ for finder in sys.meta_path]
+indexed = 'IndexFinder' in finders
+print(json.dumps({'files': files, 'indexed': indexed, 'counts': counts, 'finders': finders}))
+'''
+
+
+def make_environment(tmpdir, session):
+    from vsh import api
+
+    path = api.create(str(tmpdir.join('env')), include_pip=False, session=session)
+    site_packages = os.path.join(path, 'lib', f'python{sys.version_info[0]}.{sys.version_info[1]}', 'site-packages')
+    os.makedirs(site_packages, exist_ok=True)
+    return path, site_packages
+
+
+def probe(path, session, modules, cwd=None):
+    from vsh import api
+
+    python = os.path.join(path, 'bin', 'python')
+    env = api._update_environment(path, session=session)
+    result = subprocess.run([python, '-c', PROBE] + modules, env=env, cwd=cwd, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return json.loads(result.stdout)
+
+
+def write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as stream:
+        stream.write(content)
+
+
+@pytest.mark.unit
+def test_module_index(tmpdir, make_wheel):
+    from vsh import api, imports
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    path, site_packages = make_environment(tmpdir, session)
+    extra = str(tmpdir.join('extra'))
+    write(os.path.join(site_packages, 'alpha', '__init__.py'))
+    write(os.path.join(site_packages, 'beta.py'))
+    write(os.path.join(site_packages, 'nsp', 'one.py'))
+    write(os.path.join(extra, 'nsp', 'two.py'))
+    write(os.path.join(site_packages, 'shadow.py'))
+    write(os.path.join(site_packages, 'extra.pth'), f'{extra}\n')
+    local = str(tmpdir.join('local'))
+    write(os.path.join(local, 'shadow.py'))
+    modules = ['alpha', 'beta', 'nsp.one', 'nsp.two', 'shadow']
+
+    plain = probe(path, session, modules, cwd=local)
+    assert not plain['indexed']
+    assert api.set_module_index(path, session=session) >= 4
+    assert imports.enabled(path)
+    indexed = probe(path, session, modules, cwd=local)
+    assert indexed['indexed']
+    assert indexed['files'] == plain['files']
+    assert indexed['files']['shadow'] == os.path.join(local, 'shadow.py')
+    assert indexed['files']['nsp.two'] == os.path.join(extra, 'nsp', 'two.py')
+    # Builtin and frozen modules are still found first
+    assert indexed['finders'].index('IndexFinder') == indexed['finders'].index('PathFinder') - 1
+    assert indexed['finders'].index('IndexFinder') > indexed['finders'].index('BuiltinImporter')
+
+    # Installing behind vsh's back turns the index off until it is rebuilt
+    write(os.path.join(site_packages, 'gamma.py'))
+    assert not probe(path, session, ['gamma'])['indexed']
+    api.set_module_index(path, session=session)
+    assert probe(path, session, ['gamma'])['indexed']
+
+    # Installs through vsh rebuild it
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse)
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\n')
+    api.install(path, lock=str(tmpdir.join('requirements.lock')), session=session)
+    assert probe(path, session, ['vsh_demo'])['indexed']
+
+    assert api.set_module_index(path, enabled=False, session=session) == 0
+    assert not imports.enabled(path) and not os.path.exists(os.path.join(site_packages, imports.PTH))
+    assert probe(path, session, modules, cwd=local)['files'] == plain['files']
+
+
+@pytest.mark.stress
+@pytest.mark.parametrize("packages, folders", [(300, 20)])
+def test_module_index_benchmark(tmpdir, packages, folders):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')))
+    path, site_packages = make_environment(tmpdir, session)
+    # Editable installs and layered bases each add an entry to sys.path
+    entries = [site_packages] + [str(tmpdir.join('src', f'folder{index}')) for index in range(folders - 1)]
+    for index in range(packages):
+        write(os.path.join(entries[index % folders], f'pkg{index}', '__init__.py'))
+    write(os.path.join(site_packages, 'editables.pth'), '\n'.join(entries[1:]) + '\n')
+    modules = [f'pkg{index}' for index in range(packages)]
+
+    plain = probe(path, session, modules)
+    api.set_module_index(path, session=session)
+    indexed = probe(path, session, modules)
+    assert indexed['indexed'] and indexed['files'] == plain['files']
+    print(f'stats without index: {plain["counts"]["stat"]}, with index: {indexed["counts"]["stat"]}')
+    assert indexed['counts']['stat'] < plain['counts']['stat']
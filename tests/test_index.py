@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+
+@pytest.mark.unit
+def test_index_update(tmpdir):
+    from vsh.index import EnvironmentIndex
+
+    root = str(tmpdir.join('envs'))
+    index = EnvironmentIndex(root, str(tmpdir.join('cache')))
+    assert index.get('/envs/a') == {}
+
+    index.update('/envs/a', size=1)
+    index.update('/envs/a', last_used=2.0)
+    assert index.get('/envs/a') == {'size': 1, 'last_used': 2.0}
+
+    # Another process' index merges rather than clobbers
+    other = EnvironmentIndex(root, str(tmpdir.join('cache')))
+    other.update_many({'/envs/b': {'size': 3}})
+    index.update('/envs/a', size=4)
+    assert sorted(other.entries()) == ['/envs/a', '/envs/b']
+    assert other.get('/envs/a') == {'size': 4, 'last_used': 2.0}
+
+    index.discard('/envs/a')
+    assert sorted(other.entries()) == ['/envs/b']
+    assert [name for name in os.listdir(os.path.dirname(index.path)) if name.startswith('.index-')] == []
+
+
+@pytest.mark.unit
+def test_index_append(tmpdir, monkeypatch):
+    from vsh import index as module
+    from vsh.index import EnvironmentIndex
+
+    root = str(tmpdir.join('envs'))
+    index = EnvironmentIndex(root, str(tmpdir.join('cache')))
+    index.update('/envs/a', size=1)
+    with open(index.path) as stream:
+        saved = stream.read()
+
+    # Appends leave the index file alone and are merged on read, by any process
+    index.append('/envs/a', last_used=2.0)
+    index.append('/envs/b', last_used=3.0)
+    with open(index.path) as stream:
+        assert stream.read() == saved
+    other = EnvironmentIndex(root, str(tmpdir.join('cache')))
+    assert other.entries() == {'/envs/a': {'size': 1, 'last_used': 2.0}, '/envs/b': {'last_used': 3.0}}
+    with open(index.log_path, 'a') as stream:
+        stream.write('{"torn')
+    assert other.get('/envs/a') == {'size': 1, 'last_used': 2.0}
+
+    # Updates fold the log into the index
+    other.update('/envs/b', size=5)
+    assert not os.path.exists(index.log_path)
+    with open(index.path) as stream:
+        assert json.load(stream) == {'/envs/a': {'size': 1, 'last_used': 2.0}, '/envs/b': {'size': 5, 'last_used': 3.0}}
+    index.discard('/envs/b')
+    assert index.entries() == {'/envs/a': {'size': 1, 'last_used': 2.0}}
+
+    # So does a log grown too long
+    monkeypatch.setattr(module, 'LOG_LIMIT', 100)
+    for step in range(5):
+        index.append('/envs/a', last_used=float(step))
+    assert not os.path.exists(index.log_path) or os.path.getsize(index.log_path) <= 100
+    assert other.get('/envs/a') == {'size': 1, 'last_used': 4.0}
+
+
+@pytest.mark.unit
+def test_index_corrupt(tmpdir):
+    from vsh.index import EnvironmentIndex
+
+    index = EnvironmentIndex(str(tmpdir), str(tmpdir.join('cache')))
+    os.makedirs(os.path.dirname(index.path))
+    with open(index.path, 'w') as stream:
+        stream.write('{not json')
+    assert index.entries() == {}
+    index.update('/envs/a', size=1)
+    with open(index.path) as stream:
+        assert json.load(stream) == {'/envs/a': {'size': 1}}
@@ -0,0 +1,163 @@
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+
+def make_environment(path, version='3.11.7'):
+    os.makedirs(os.path.join(path, 'bin'))
+    with open(os.path.join(path, 'pyvenv.cfg'), 'w') as stream:
+        stream.write(f'home = /usr/bin\ninclude-system-site-packages = false\nversion = {version}\n')
+    return path
+
+
+@pytest.mark.unit
+def test_read_lock(tmpdir):
+    from vsh.installer import Pin, read_lock
+
+    tmpdir.join('requirements.lock').write('\n'.join([
+        '# generated',
+        '--index-url https://example.com/simple',
+        'Six==1.17.0 \\',
+        '    --hash=sha256:aaaa \\',
+        '    --hash=sha256:bbbb',
+        '    # via -r requirements.in',
+        'attrs[tests]==23.1.0',
+        'colorama==0.4.6 ; sys_platform == "win32"',
+        'numpy>=1.20',
+        ]))
+    pins, lines = read_lock(str(tmpdir.join('requirements.lock')))
+    assert [pin[:3] for pin in pins] == [('six', '1.17.0', ('sha256:aaaa', 'sha256:bbbb')), ('attrs', '23.1.0', ())]
+    assert isinstance(pins[0], Pin)
+    assert lines == ['--index-url https://example.com/simple', 'colorama==0.4.6 ; sys_platform == "win32"', 'numpy>=1.20']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("tag, found", [
+    ('py3-none-any', True),
+    ('py2.py3-none-any', True),
+    ('py311-none-any', True),
+    ('py312-none-any', False),
+    ('cp311-cp311-linux_x86_64', True),
+    ('cp38-abi3-linux_x86_64', True),
+    ('cp311-cp311-win_amd64', False),
+    ('cp310-cp310-linux_x86_64', False),
+    ])
+def test_plan(tmpdir, make_wheel, tag, found):
+    from vsh.installer import Pin, plan, supported_tags
+
+    assert ('cp311', 'cp311', 'linux_x86_64') in supported_tags('3.11.7', platforms=['linux_x86_64'])
+    wheel = make_wheel(str(tmpdir))
+    tagged = str(tmpdir.join(f'vsh_demo-1.0-{tag}.whl'))
+    os.rename(wheel, tagged)
+    pin = Pin('vsh_demo', '1.0', (), 'vsh_demo==1.0')
+    wheels, leftover = plan([pin], str(tmpdir), '3.11.7')
+    if sys.platform != 'linux' or os.uname().machine != 'x86_64':
+        found = found and 'linux' not in tag
+    assert wheels == ([(pin, tagged)] if found else [])
+    assert leftover == ([] if found else [pin])
+
+
+@pytest.mark.unit
+def test_install(tmpdir, make_wheel):
+    from vsh.installer import Pin, install
+
+    path = make_environment(str(tmpdir.join('env')))
+    files = {
+        'demo/__init__.py': 'def main():\n    return 0\n',
+        'vsh_demo-1.0.data/scripts/demo-tool': '#!python\nprint("tool")\n',
+        'vsh_demo-1.0.data/data/share/demo.txt': 'shared\n',
+        }
+    wheel = make_wheel(str(tmpdir), files=files, entry_points='[console_scripts]\ndemo = demo:main\n')
+    pin = Pin('vsh_demo', '1.0', (), 'vsh_demo==1.0')
+    assert install([(pin, wheel)], path) == ['vsh_demo']
+
+    site_packages = os.path.join(path, 'lib', 'python3.11', 'site-packages')
+    python = os.path.join(path, 'bin', 'python')
+    assert os.path.exists(os.path.join(site_packages, 'demo', '__init__.py'))
+    assert open(os.path.join(path, 'share', 'demo.txt')).read() == 'shared\n'
+    tool = os.path.join(path, 'bin', 'demo-tool')
+    assert open(tool).read() == f'#!{python}\nprint("tool")\n'
+    assert os.access(tool, os.X_OK)
+    launcher = open(os.path.join(path, 'bin', 'demo')).read()
+    assert launcher.startswith(f'#!{python}\n')
+    assert 'from demo import main' in launcher and 'sys.exit(main())' in launcher
+
+    dist_info = os.path.join(site_packages, 'vsh_demo-1.0.dist-info')
+    assert open(os.path.join(dist_info, 'INSTALLER')).read() == 'vsh\n'
+    record = open(os.path.join(dist_info, 'RECORD')).read().splitlines()
+    assert 'vsh_demo-1.0.dist-info/RECORD,,' in record
+    assert any(row.startswith('../../../bin/demo,sha256=') for row in record)
+    assert any(row.startswith('demo/__init__.py,sha256=') for row in record)
+
+    # The same version is skipped
+    assert install([(pin, wheel)], path) == []
+
+    # Another version replaces the first
+    os.makedirs(str(tmpdir.join('v2')))
+    upgrade = make_wheel(str(tmpdir.join('v2')), version='2.0')
+    assert install([(Pin('vsh_demo', '2.0', (), 'vsh_demo==2.0'), upgrade)], path) == ['vsh_demo']
+    assert not os.path.exists(dist_info)
+    assert not os.path.exists(os.path.join(site_packages, 'demo'))
+    assert not os.path.exists(os.path.join(path, 'bin', 'demo'))
+    assert os.path.exists(os.path.join(site_packages, 'vsh_demo.py'))
+
+
+@pytest.mark.unit
+def test_install_checks(tmpdir, make_wheel):
+    from vsh.errors import HashMismatchError, InvalidWheelError
+    from vsh.installer import Pin, install
+
+    path = make_environment(str(tmpdir.join('env')))
+    wheel = make_wheel(str(tmpdir))
+    digest = hashlib.sha256(open(wheel, 'rb').read()).hexdigest()
+    assert install([(Pin('vsh_demo', '1.0', ('sha256:0000', f'sha256:{digest}'), ''), wheel)], path) == ['vsh_demo']
+
+    shutil.rmtree(path)
+    make_environment(path)
+    with pytest.raises(HashMismatchError):
+        install([(Pin('vsh_demo', '1.0', ('sha256:0000', ), ''), wheel)], path)
+
+    os.makedirs(str(tmpdir.join('evil')))
+    evil = make_wheel(str(tmpdir.join('evil')), name='evil', files={'../../../outside.py': ''})
+    with pytest.raises(InvalidWheelError):
+        install([(Pin('evil', '1.0', (), ''), evil)], path)
+    assert not os.path.exists(str(tmpdir.join('outside.py')))
+
+    # A file not matching RECORD leaves the installed version and the other wheels alone
+    assert install([(Pin('vsh_demo', '1.0', (), ''), wheel)], path) == ['vsh_demo']
+    os.makedirs(str(tmpdir.join('v2')))
+    upgrade = make_wheel(str(tmpdir.join('v2')), version='2.0', files={'vsh_demo.py': 'VALUE = 2\n'})
+    with zipfile.ZipFile(upgrade) as archive:
+        members = {name: archive.read(name) for name in archive.namelist()}
+    members['vsh_demo.py'] = b'VALUE = 666\n'
+    with zipfile.ZipFile(upgrade, 'w') as archive:
+        for name, content in members.items():
+            archive.writestr(name, content)
+    other = make_wheel(str(tmpdir.join('v2')), name='vsh_other')
+    with pytest.raises(HashMismatchError):
+        install([(Pin('vsh_other', '1.0', (), ''), other), (Pin('vsh_demo', '2.0', (), ''), upgrade)], path)
+    site_packages = os.path.join(path, 'lib', 'python3.11', 'site-packages')
+    assert sorted(os.listdir(site_packages)) == ['vsh_demo-1.0.dist-info', 'vsh_demo.py']
+    assert open(os.path.join(site_packages, 'vsh_demo.py')).read() == 'VALUE = 42\n'
+    assert [name for name in os.listdir(path) if name.startswith('.')] == []
+
+
+@pytest.mark.unit
+def test_create_with_lock(tmpdir, make_wheel):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir.join('envs')), cache_dir=str(tmpdir.join('cache')), offline=True)
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse, files={'demo/__init__.py': 'def main():\n    print("from demo")\n'}, entry_points='[console_scripts]\ndemo = demo:main\n')
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\n')
+
+    # No pip: the lock is installed without it
+    path = api.create(str(tmpdir.join('envs', 'locked')), include_pip=False, lock=str(tmpdir.join('requirements.lock')), session=session)
+    out = subprocess.run([os.path.join(path, 'bin', 'demo')], stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert out.strip() == 'from demo'
@@ -0,0 +1,48 @@
+import os
+import subprocess
+
+import pytest
+
+OLD_LAUNCHER = '''#!{python}
+# EASY-INSTALL-ENTRY-SCRIPT: 'vsh-demo==1.0','console_scripts','{name}'
+import sys
+from importlib.metadata import distribution
+
+if __name__ == '__main__':
+    entry_point = next(e for e in distribution('{dist}').entry_points if e.name == '{name}')
+    sys.exit(entry_point.load()())
+'''
+
+
+@pytest.mark.unit
+def test_optimize_and_revert(tmpdir, make_wheel):
+    from vsh import api, launchers
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse, files={'demo/__init__.py': 'def main():\n    print("from demo")\n'}, entry_points='[console_scripts]\ndemo = demo:main\n')
+    make_wheel(session.wheelhouse, name='broken', files={'broken.py': ''}, entry_points='[console_scripts]\nbroken = missing:main\n')
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\nbroken==1.0\n')
+    path = api.create(str(tmpdir.join('env')), include_pip=False, lock=str(tmpdir.join('requirements.lock')), session=session)
+    python = os.path.join(path, 'bin', 'python')
+
+    # Installed by vsh: already minimal
+    assert launchers.optimize(path, api._site_packages(path)) == launchers.Optimized([], ['broken', 'demo'], [])
+
+    old = {name: OLD_LAUNCHER.format(python=python, name=name, dist=dist) for name, dist in [('demo', 'vsh_demo'), ('broken', 'broken')]}
+    for name, content in old.items():
+        with open(os.path.join(path, 'bin', name), 'w') as stream:
+            stream.write(content)
+    optimized = api.optimize_launchers(path, session=session)
+    assert optimized == launchers.Optimized(['demo'], [], ['broken'])
+    assert 'importlib.metadata' not in open(os.path.join(path, 'bin', 'demo')).read()
+    assert open(os.path.join(path, 'bin', 'broken')).read() == old['broken']
+    out = subprocess.run([os.path.join(path, 'bin', 'demo')], stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    assert out.strip() == 'from demo'
+
+    assert api.optimize_launchers(path, revert=True, session=session) == ['demo']
+    assert open(os.path.join(path, 'bin', 'demo')).read() == old['demo']
+    assert os.access(os.path.join(path, 'bin', 'demo'), os.X_OK)
+    assert not os.path.exists(os.path.join(path, launchers.BACKUP))
+    assert launchers.revert(path) == []
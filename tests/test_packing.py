@@ -0,0 +1,72 @@
+import os
+import subprocess
+import sys
+import zipfile
+
+import pytest
+
+
+def write(path, content=''):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as stream:
+        stream.write(content)
+
+
+@pytest.mark.unit
+def test_candidates(tmpdir):
+    from vsh.packing import candidates
+
+    site_packages = str(tmpdir)
+    write(os.path.join(site_packages, 'alpha', '__init__.py'))
+    write(os.path.join(site_packages, 'alpha', 'sub', '__init__.py'))
+    write(os.path.join(site_packages, 'alpha', 'py.typed'))
+    write(os.path.join(site_packages, 'beta.py'))
+    write(os.path.join(site_packages, 'data', '__init__.py'))
+    write(os.path.join(site_packages, 'data', 'table.json'))
+    write(os.path.join(site_packages, 'mixed', '__init__.py'))
+    write(os.path.join(site_packages, 'mixed', 'portion', 'module.py'))
+    write(os.path.join(site_packages, 'namespace', 'module.py'))
+    write(os.path.join(site_packages, 'fast.cpython-311-x86_64-linux-gnu.so'))
+    write(os.path.join(site_packages, 'alpha-1.0.dist-info', 'METADATA'))
+    write(os.path.join(site_packages, 'hook.py'))
+    write(os.path.join(site_packages, 'hook.pth'), 'import hook\n')
+    assert candidates(site_packages) == ['alpha', 'beta']
+
+
+@pytest.mark.unit
+def test_pack_and_unpack(tmpdir, make_wheel):
+    from vsh import api, packing
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir), cache_dir=str(tmpdir.join('cache')), offline=True)
+    path = api.create(str(tmpdir.join('env')), include_pip=False, session=session)
+    site_packages = os.path.join(path, 'lib', f'python{sys.version_info[0]}.{sys.version_info[1]}', 'site-packages')
+    write(os.path.join(site_packages, 'alpha', '__init__.py'), 'from .sub import VALUE\n')
+    write(os.path.join(site_packages, 'alpha', 'sub.py'), 'VALUE = 42\n')
+    write(os.path.join(site_packages, 'beta.py'))
+    write(os.path.join(site_packages, 'broken.py'), 'raise ImportError("optional dependency")\n')
+
+    packed = api.pack(path, session=session)
+    assert packed == packing.Packed(['alpha', 'beta'], ['broken'], [])
+    archive = os.path.join(site_packages, packing.ARCHIVE)
+    assert not os.path.exists(os.path.join(site_packages, 'alpha')) and not os.path.exists(os.path.join(site_packages, 'beta.py'))
+    assert {'alpha/sub.py', 'alpha/sub.pyc', 'beta.pyc'} <= set(zipfile.ZipFile(archive).namelist())
+    python = os.path.join(path, 'bin', 'python')
+    env = api._update_environment(path, session=session)
+    out = subprocess.run([python, '-c', 'import alpha; print(alpha.VALUE, alpha.__file__)'], env=env, stdout=subprocess.PIPE, universal_newlines=True,
+                         check=True).stdout
+    value, origin = out.split()
+    assert value == '42' and origin.startswith(os.path.join(archive, 'alpha', '__init__.py'))
+
+    assert api.unpack(path, session=session) == ['alpha', 'beta']
+    assert open(os.path.join(site_packages, 'alpha', 'sub.py')).read() == 'VALUE = 42\n'
+    assert not os.path.exists(archive) and not os.path.exists(os.path.join(site_packages, packing.PTH))
+
+    # Installs unpack first
+    api.pack(path, session=session)
+    os.makedirs(session.wheelhouse)
+    make_wheel(session.wheelhouse)
+    tmpdir.join('requirements.lock').write('vsh_demo==1.0\n')
+    api.install(path, lock=str(tmpdir.join('requirements.lock')), session=session)
+    assert not packing.is_packed(site_packages)
+    assert os.path.exists(os.path.join(site_packages, 'alpha', '__init__.py'))
@@ -0,0 +1,147 @@
+import os
+import sys
+import threading
+
+import pytest
+
+
+@pytest.mark.unit
+def test_session_settings(tmpdir, monkeypatch):
+    from vsh.session import Vsh
+
+    monkeypatch.setenv('WORKON_HOME', str(tmpdir.join('from-environ')))
+    default = Vsh()
+    explicit = Vsh(workon_home=str(tmpdir.join('explicit')), shell='/bin/sh', search_path='/a:/b')
+
+    assert default.workon_home == str(tmpdir.join('from-environ'))
+    assert explicit.workon_home == str(tmpdir.join('explicit'))
+    assert explicit.shell == '/bin/sh'
+    assert explicit.search_path == ('/a', '/b')
+
+    # Explicit settings do not follow the environment
+    monkeypatch.setenv('WORKON_HOME', str(tmpdir.join('changed')))
+    assert default.workon_home == str(tmpdir.join('changed'))
+    assert explicit.workon_home == str(tmpdir.join('explicit'))
+
+    # Wheelhouse follows the cache folder unless set
+    assert Vsh(cache_dir=str(tmpdir)).wheelhouse == str(tmpdir.join('wheelhouse'))
+    monkeypatch.setenv('VSH_WHEELHOUSE', str(tmpdir.join('wheels')))
+    monkeypatch.setenv('VSH_OFFLINE', 'yes')
+    assert default.wheelhouse == str(tmpdir.join('wheels'))
+    assert default.offline is True
+    assert Vsh(offline=False).offline is False
+    assert default.precompile is None
+    monkeypatch.setenv('VSH_PRECOMPILE', '1')
+    assert default.precompile == 'checked-hash'
+    monkeypatch.setenv('VSH_PRECOMPILE', 'unchecked-hash')
+    assert default.precompile == 'unchecked-hash'
+
+    # A given environ is copied; without one, os.environ is read when used
+    environ = {'SHELL': '/bin/sh'}
+    copied = Vsh(environ=environ)
+    environ['SHELL'] = '/bin/zsh'
+    assert copied.shell == '/bin/sh'
+    monkeypatch.setenv('SHELL', '/bin/dash')
+    assert default.shell == '/bin/dash'
+
+
+@pytest.mark.unit
+def test_session_api():
+    import inspect
+
+    from vsh import api
+    from vsh.session import Vsh
+
+    methods = [name for name in vars(Vsh) if name.startswith(tuple('abcdefghijklmnopqrstuvwxyz'))]
+    delegates = methods[methods.index('build_wheelhouse'):]
+    assert delegates == sorted(delegates)
+    with_session = [name for name in api.__all__ if 'session' in inspect.signature(getattr(api, name)).parameters]
+    # precompile is a setting of the session
+    assert set(with_session) - {'get_session', 'precompile'} <= set(delegates)
+    assert {'diff', 'freeze', 'freeze_many'} <= set(delegates)
+
+
+@pytest.mark.unit
+def test_session_interpreter_cache():
+    from vsh.session import Vsh
+
+    calls = []
+
+    def find(python, search_path):
+        calls.append(python)
+        return sys.executable if python == 'found' else None
+
+    session = Vsh(search_path=['/usr/bin'])
+    assert session.interpreter('found', find) == sys.executable
+    assert session.interpreter('found', find) == sys.executable
+    assert session.interpreter('missing', find) is None
+    assert session.interpreter('missing', find) is None
+    assert calls == ['found', 'missing', 'missing']
+
+
+@pytest.mark.unit
+def test_session_environments(tmpdir):
+    from vsh import api
+    from vsh.session import Vsh
+
+    session = Vsh(workon_home=str(tmpdir))
+    assert list(session.find_environment_folders()) == []
+
+    path = session.create(str(tmpdir.join('test-session')), include_pip=False)
+    assert list(session.find_environment_folders()) == [('test-session', path)]
+
+    # Listing is served from the index until a searched folder changes
+    scans = []
+    original = api._scan_environment_folders
+
+    def scan(root, *args, **kwds):
+        scans.append(root)
+        return original(root, *args, **kwds)
+
+    api._scan_environment_folders = scan
+    try:
+        assert list(session.find_environment_folders()) == [('test-session', path)]
+        assert scans == []
+        os.mkdir(str(tmpdir.join('not-an-env')))
+        assert list(session.find_environment_folders()) == [('test-session', path)]
+        assert scans == [str(tmpdir)]
+    finally:
+        api._scan_environment_folders = original
+
+
+@pytest.mark.unit
+def test_session_threads(tmpdir):
+    from vsh.session import Vsh
+
+    sessions = [Vsh(workon_home=str(tmpdir.join(f'home-{index}'))) for index in range(4)]
+    for session in sessions:
+        os.makedirs(session.workon_home)
+    results = {}
+
+    def run(index, session):
+        path = session.create(os.path.join(session.workon_home, f'env-{index}'), include_pip=False)
+        results[index] = [name for name, _ in session.find_environment_folders()], path
+
+    threads = [threading.Thread(target=run, args=(index, session)) for index, session in enumerate(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert {index: names for index, (names, _) in results.items()} == {index: [f'env-{index}'] for index in range(4)}
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("environ, expected", [
+    # Default
+    ({'HOME': '/home/user'}, ('/home/user/.virtualenvs', )),
+    # Colon separated WORKON_HOME
+    ({'WORKON_HOME': '/ssd:/nfs'}, ('/ssd', '/nfs')),
+    # VSH_PATH takes precedence
+    ({'VSH_PATH': '/ssd', 'WORKON_HOME': '/nfs:/ssd'}, ('/ssd', '/nfs')),
+    ])
+def test_session_roots(environ, expected):
+    from vsh.session import Vsh
+
+    session = Vsh(environ=environ)
+    assert session.roots == expected
+    assert session.workon_home == expected[0]
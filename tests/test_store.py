@@ -0,0 +1,115 @@
+import errno
+import os
+import shutil
+
+import pytest
+
+
+def make_env(path, files):
+    for name, content in files.items():
+        filename = os.path.join(path, 'lib', 'python3.6', 'site-packages', name)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        with open(filename, 'w') as stream:
+            stream.write(content)
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("dry_run", [False, True])
+def test_dedupe(tmpdir, dry_run):
+    from vsh import store
+
+    shared = {'pkg/__init__.py': 'x = 1\n' * 1000, 'pkg/data.txt': 'data\n' * 1000}
+    paths = [str(tmpdir.join(name)) for name in ['a', 'b', 'c']]
+    for index, path in enumerate(paths):
+        make_env(path, dict(shared, **{'own.py': f'own = {index}\n' * (1000 + index)}))
+    folder = str(tmpdir.join(store.NAME))
+
+    report = store.dedupe(paths, folder, workers=2, dry_run=dry_run)
+    # Unique sizes are never read
+    assert report.files == 9
+    assert report.hashed == 6
+    assert report.linked == 4
+    assert report.reclaimed >= 4 * len(shared['pkg/data.txt'])
+    assert report.errors == []
+
+    inodes = {os.stat(os.path.join(path, 'lib', 'python3.6', 'site-packages', 'pkg', 'data.txt')).st_ino for path in paths}
+    assert len(inodes) == (3 if dry_run else 1)
+    for path in paths:
+        with open(os.path.join(path, 'lib', 'python3.6', 'site-packages', 'pkg', 'data.txt')) as stream:
+            assert stream.read() == shared['pkg/data.txt']
+    if dry_run:
+        assert not os.path.exists(folder)
+        return
+
+    # Idempotent, and new environments link to what is stored
+    assert store.dedupe(paths, folder).linked == 0
+    make_env(str(tmpdir.join('d')), shared)
+    assert store.dedupe([str(tmpdir.join('d'))], folder).linked == 2
+
+    # Stored copies are kept while linked
+    assert store.prune(folder) == 0
+    for path in paths + [str(tmpdir.join('d'))]:
+        shutil.rmtree(path)
+    assert store.prune(folder) > 0
+    assert list(store._iter_store(folder)) == []
+
+
+@pytest.mark.unit
+def test_dedupe_modes(tmpdir):
+    from vsh import store
+
+    content = {'pkg/tool': 'x' * 5000}
+    paths = [str(tmpdir.join(name)) for name in ['a', 'b']]
+    for path in paths:
+        make_env(path, content)
+    # Different modes are never linked together
+    os.chmod(os.path.join(paths[1], 'lib', 'python3.6', 'site-packages', 'pkg', 'tool'), 0o755)
+    assert store.dedupe(paths, str(tmpdir.join(store.NAME))).linked == 0
+    with pytest.raises(ValueError):
+        store.dedupe(paths, str(tmpdir.join(store.NAME)), mode='symlink')
+
+
+@pytest.mark.unit
+def test_dedupe_reflink(tmpdir, monkeypatch):
+    from vsh import store
+    from vsh.errors import ReflinkUnsupportedError
+
+    paths = [str(tmpdir.join(name)) for name in ['a', 'b', 'c']]
+    for path in paths:
+        make_env(path, {'pkg/data': 'x' * 5000})
+    files = [os.path.join(path, 'lib', 'python3.6', 'site-packages', 'pkg', 'data') for path in paths]
+    folder = str(tmpdir.join(store.NAME))
+
+    # Cloning stands in for FICLONE, which the test filesystem may lack
+    monkeypatch.setattr(store, '_clone', shutil.copyfile)
+    report = store.dedupe(paths, folder, mode=store.REFLINK)
+    assert (report.linked, report.errors) == (2, [])
+    assert not any(name.endswith('.vsh-dedupe') for name in os.listdir(os.path.dirname(files[1])))
+    for path in files:
+        with open(path) as stream:
+            assert stream.read() == 'x' * 5000
+
+    # The stored copy is a clone, never a hard link to an environment's file
+    stored = [path for _, path in store._iter_store(folder)]
+    assert len(stored) == 1 and stored[0].endswith(store.CLONE)
+    assert os.stat(stored[0]).st_nlink == 1
+    assert not any(os.path.samefile(stored[0], path) for path in files)
+
+    # Kept by prune while cloned files use it, and cloned files aren't cloned again
+    assert store.prune(folder) == 0
+    assert store.dedupe(paths, folder, mode=store.REFLINK).linked == 0
+    for path in paths:
+        shutil.rmtree(path)
+    assert store.prune(folder) > 0
+    assert list(store._iter_store(folder)) == []
+
+    # Without reflinks, nothing is stored or replaced
+    def unsupported(source, destination):
+        raise OSError(errno.EOPNOTSUPP, os.strerror(errno.EOPNOTSUPP))
+
+    make_env(paths[0], {'pkg/data': 'x' * 5000})
+    make_env(paths[1], {'pkg/data': 'x' * 5000})
+    monkeypatch.setattr(store, '_clone', unsupported)
+    with pytest.raises(ReflinkUnsupportedError):
+        store.dedupe(paths[:2], folder, mode=store.REFLINK)
+    assert list(store._iter_store(folder)) == []
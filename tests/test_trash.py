@@ -0,0 +1,157 @@
+import os
+
+import pytest
+
+
+def make_tree(path, files=10):
+    os.makedirs(os.path.join(path, 'bin'))
+    for index in range(files):
+        with open(os.path.join(path, 'bin', f'file-{index}'), 'w') as stream:
+            stream.write('x')
+    os.symlink('bin', os.path.join(path, 'link'))
+
+
+@pytest.mark.unit
+def test_move_to_trash(tmpdir, monkeypatch):
+    from vsh import trash
+
+    path = str(tmpdir.join('env'))
+    make_tree(path)
+    folder = trash.move_to_trash(path)
+
+    assert not os.path.exists(path)
+    assert folder == str(tmpdir.join(trash.TRASH))
+    assert trash.trash_folders([str(tmpdir)]) == [folder]
+    assert trash.reap([folder]) == 1
+    assert trash.trash_folders([str(tmpdir)]) == []
+    # The emptied trash goes too, lock included
+    assert os.listdir(str(tmpdir)) == []
+
+    # A reaper removing the trash between its creation and the rename is retried
+    make_tree(path)
+    makedirs = os.makedirs
+    calls = []
+    monkeypatch.setattr(os, 'makedirs', lambda *args, **kwds: calls.append(args) if not calls else makedirs(*args, **kwds))
+    assert trash.move_to_trash(path) == folder
+    assert len(calls) == 1 and len(trash.leftovers([folder])) == 1
+
+
+@pytest.mark.unit
+def test_reap_locked(tmpdir):
+    import fcntl
+    from vsh import trash
+
+    path = str(tmpdir.join('env'))
+    make_tree(path)
+    folder = trash.move_to_trash(path)
+    with open(os.path.join(folder, '.lock'), 'a') as stream:
+        fcntl.flock(stream, fcntl.LOCK_EX)
+        # Another reaper owns the folder
+        assert trash.reap([folder]) == 0
+        assert os.path.exists(folder)
+    assert trash.reap([folder]) == 1
+    assert not os.path.exists(folder)
+
+
+@pytest.mark.unit
+def test_reap_stuck(tmpdir, monkeypatch):
+    from vsh import trash
+
+    for name in ['stuck', 'env']:
+        make_tree(str(tmpdir.join(name)))
+        folder = trash.move_to_trash(str(tmpdir.join(name)))
+    stuck = [path for path in trash.leftovers([folder]) if os.path.basename(path).startswith('stuck.')]
+    delete = trash._delete
+    # An entry which never goes away, e.g. an NFS silly rename, ends reaping instead of spinning
+    monkeypatch.setattr(trash, '_delete', lambda path: None if path in stuck else delete(path))
+    assert trash.reap([folder], wait=True) == 1
+    assert trash.leftovers([folder]) == stuck
+
+
+@pytest.mark.unit
+def test_reap_later(tmpdir):
+    from vsh import trash
+
+    folders = []
+    for name in ['a', 'b']:
+        path = str(tmpdir.join(name))
+        make_tree(path)
+        folders.append(trash.move_to_trash(path))
+    assert trash.reap_later([]) is None
+
+    process = trash.reap_later(sorted(set(folders)))
+    assert process.wait(timeout=60) == 0
+    assert not os.path.exists(folders[0])
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("fd_calls", [True, False])
+def test_rmtree(tmpdir, monkeypatch, fd_calls):
+    from vsh import trash
+
+    monkeypatch.setattr(trash, '_supports_fd_calls', lambda: fd_calls)
+    outside = str(tmpdir.join('outside'))
+    make_tree(outside)
+    path = str(tmpdir.join('env'))
+    for folder in ['lib/python3.6/site-packages/foo', 'lib/python3.6/site-packages/bar/sub', 'include']:
+        make_tree(os.path.join(path, folder), files=3)
+    # Symlinks out of the tree are unlinked, never followed
+    os.symlink(outside, os.path.join(path, 'lib64'))
+    os.symlink(os.path.join(outside, 'bin', 'file-0'), os.path.join(path, 'python'))
+
+    trash.rmtree(path, workers=4)
+    assert not os.path.lexists(path)
+    assert sorted(os.listdir(os.path.join(outside, 'bin'))) == sorted(f'file-{index}' for index in range(10))
+
+    # Symlinks themselves and missing paths
+    os.symlink(outside, path)
+    trash.rmtree(path)
+    assert not os.path.lexists(path)
+    assert os.path.isdir(outside)
+    trash.rmtree(path)
+
+
+@pytest.mark.unit
+def test_rmtree_errors(tmpdir):
+    from vsh import trash
+
+    if os.geteuid() == 0:
+        pytest.skip('permissions are not enforced for root')
+    path = str(tmpdir.join('env'))
+    make_tree(os.path.join(path, 'locked'))
+    os.chmod(os.path.join(path, 'locked', 'bin'), 0o500)
+    try:
+        with pytest.raises(PermissionError):
+            trash.rmtree(path)
+        trash.rmtree(path, ignore_errors=True)
+        assert os.path.exists(os.path.join(path, 'locked', 'bin', 'file-0'))
+    finally:
+        os.chmod(os.path.join(path, 'locked', 'bin'), 0o700)
+
+
+@pytest.mark.stress
+@pytest.mark.parametrize("files", [50000])
+def test_rmtree_benchmark(tmpdir, files):
+    import shutil
+    import time
+    from vsh import trash
+
+    def synthetic_env(path):
+        # Roughly the shape of site-packages: many packages, a few levels deep, small files
+        per_folder = 25
+        for index in range(files // per_folder):
+            folder = os.path.join(path, 'lib', 'python3.11', 'site-packages', f'pkg{index // 20}', f'mod{index % 20}')
+            os.makedirs(folder)
+            for number in range(per_folder):
+                with open(os.path.join(folder, f'file{number}.py'), 'w') as stream:
+                    stream.write('x = 1\n')
+        return path
+
+    timings = {}
+    for name, delete in [('shutil.rmtree', shutil.rmtree), ('trash.rmtree', trash.rmtree)]:
+        path = synthetic_env(str(tmpdir.join(name)))
+        start = time.perf_counter()
+        delete(path)
+        timings[name] = time.perf_counter() - start
+        assert not os.path.exists(path)
+    print(', '.join(f'{name}: {seconds:.2f}s' for name, seconds in timings.items()))
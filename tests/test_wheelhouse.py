@@ -0,0 +1,130 @@
+import io
+import os
+import tarfile
+
+import pytest
+
+
+def make_sdist(folder, name='vsh_demo', version='1.0'):
+    files = {
+        'pyproject.toml': (
+            '[build-system]\nrequires = ["setuptools"]\nbuild-backend = "setuptools.build_meta"\n\n'
+            f'[project]\nname = "{name}"\nversion = "{version}"\n\n[tool.setuptools]\npy-modules = ["{name}"]\n'
+            ),
+        f'{name}.py': 'VALUE = 42\n',
+        }
+    path = os.path.join(folder, f'{name}-{version}.tar.gz')
+    with tarfile.open(path, 'w:gz') as archive:
+        for filename, content in files.items():
+            data = content.encode('utf-8')
+            info = tarfile.TarInfo(f'{name}-{version}/{filename}')
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return path
+
+
+@pytest.mark.unit
+def test_read_requirements(tmpdir):
+    from vsh.wheelhouse import read_constraints, read_requirements
+
+    tmpdir.join('base.txt').write('requests==2.31.0  # pinned\n')
+    tmpdir.join('requirements.txt').write('\n'.join([
+        '# comment',
+        '--index-url https://example.com/simple',
+        '-r base.txt',
+        'numpy>=1.20',
+        '',
+        'attrs[tests] == 23.1.0',
+        '-c constraints.txt',
+        ]))
+    tmpdir.join('constraints.txt').write('urllib3==2.0.7\n')
+    assert read_requirements(str(tmpdir.join('requirements.txt'))) == ['requests==2.31.0', 'numpy>=1.20', 'attrs[tests] == 23.1.0']
+    assert read_constraints(str(tmpdir.join('requirements.txt'))) == ['urllib3==2.0.7']
+
+
+@pytest.mark.unit
+@pytest.mark.parametrize("requirement, found", [
+    ('six', True),
+    ('Six==1.17.0', True),
+    ('six==1.16.0', False),
+    ('six>=1.0', True),
+    ('zope.interface==6.0', True),
+    ('zope-interface', True),
+    ('numpy', False),
+    ])
+def test_missing(tmpdir, requirement, found):
+    from vsh import wheelhouse
+    from vsh.errors import WheelsMissingError
+
+    for name in ['six-1.17.0-py2.py3-none-any.whl', 'zope.interface-6.0-cp311-cp311-linux_x86_64.whl', 'numpy-1.26.0.tar.gz']:
+        tmpdir.join(name).write('')
+    assert wheelhouse.missing([requirement], str(tmpdir)) == ([] if found else [requirement])
+    assert wheelhouse.install_args(str(tmpdir), [requirement]) == ['--find-links', str(tmpdir)]
+    if found:
+        assert wheelhouse.install_args(str(tmpdir), [requirement], offline=True) == ['--no-index', '--find-links', str(tmpdir)]
+    else:
+        with pytest.raises(WheelsMissingError):
+            wheelhouse.install_args(str(tmpdir), [requirement], offline=True)
+
+
+@pytest.mark.unit
+def test_missing_dependencies(tmpdir, make_wheel):
+    from vsh import wheelhouse
+    from vsh.errors import WheelsMissingError
+
+    folder = str(tmpdir)
+    requires = ['idna>=2.5', 'urllib3<3', 'pysocks; extra == "socks"', 'colorama; sys_platform == "win32"']
+    make_wheel(folder, name='requests', version='2.31.0', requires=requires)
+    make_wheel(folder, name='idna', version='3.6')
+    make_wheel(folder, name='urllib3', version='2.1.0')
+    make_wheel(folder, name='pysocks', version='1.7.1')
+
+    # Dependencies of the wheels found are checked too, and those behind markers only for requested extras
+    assert wheelhouse.missing(['requests==2.31.0'], folder) == []
+    assert wheelhouse.missing(['requests[socks]'], folder) == []
+    os.unlink(os.path.join(folder, 'idna-3.6-py3-none-any.whl'))
+    assert wheelhouse.missing(['requests'], folder) == ['idna>=2.5 (from requests)']
+
+    # Constraints pin the version looked for
+    assert wheelhouse.missing(['urllib3'], folder, constraints=['urllib3==2.0.7']) == ['urllib3']
+    with pytest.raises(WheelsMissingError):
+        wheelhouse.install_args(folder, ['pysocks'], offline=True, constraints=['pysocks==1.7.0'])
+
+
+@pytest.mark.unit
+def test_build_and_install(tmpdir, make_wheel):
+    import subprocess
+    from vsh import api
+    from vsh.errors import WheelsMissingError
+    from vsh.session import Vsh
+
+    links = tmpdir.mkdir('links')
+    make_wheel(str(links))
+    requirements = str(tmpdir.join('requirements.txt'))
+    tmpdir.join('requirements.txt').write('vsh_demo==1.0\n')
+    session = Vsh(workon_home=str(tmpdir.join('envs')), cache_dir=str(tmpdir.join('cache')), offline=True)
+
+    # Offline creation fails before anything is created
+    with pytest.raises(WheelsMissingError):
+        api.create(str(tmpdir.join('envs', 'early')), requirements=requirements, session=session)
+    assert not os.path.exists(str(tmpdir.join('envs', 'early')))
+
+    added = api.build_wheelhouse(['vsh_demo==1.0'], pip_args=['--no-index', '--find-links', str(links)], session=session)
+    assert added == ['vsh_demo-1.0-py3-none-any.whl']
+
+    path = api.create(str(tmpdir.join('envs', 'offline')), requirements=requirements, session=session)
+    python = os.path.join(path, 'bin', 'python')
+    out = subprocess.run([python, '-c', 'import vsh_demo; print(vsh_demo.VALUE)'], stdout=subprocess.PIPE, universal_newlines=True).stdout
+    assert out.strip() == '42'
+
+
+@pytest.mark.unit
+def test_build_from_sdist(tmpdir):
+    pytest.importorskip('wheel')
+    from vsh import wheelhouse
+
+    links = tmpdir.mkdir('links')
+    make_sdist(str(links))
+    added = wheelhouse.build(['vsh_demo==1.0'], str(tmpdir.join('wheelhouse')), pip_args=['--no-index', '--find-links', str(links), '--no-build-isolation'])
+    assert [name.split('-')[:2] for name in added] == [['vsh_demo', '1.0']]
+    assert not wheelhouse.missing(['vsh_demo==1.0'], str(tmpdir.join('wheelhouse')))
@@ -0,0 +1,189 @@
+"""Asyncio counterparts of the vsh api
+
+Child processes are started with asyncio subprocesses and filesystem
+heavy steps run on an executor, so many environments can be created,
+entered and removed concurrently from a single event loop.  Every
+function accepts a timeout; on timeout or cancellation child processes
+are killed.  Filesystem work already handed to the executor runs to
+completion.
+"""
+import asyncio
+import functools
+import os
+import subprocess
+
+from . import api
+from .cli import support
+from .cli.click import api as click
+from .errors import InterpreterNotFound
+from .session import get_session
+
+__all__ = ('create', 'enter', 'remove', 'show_envs', 'validate_environment')
+
+
+async def create(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None, python=None, verbose=None, dry_run=None, timeout=None, executor=None, session=None):
+    """Creates a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+
+        site_packages (bool, optional): use system packages within environment [default: False]
+        overwrite (bool, optional): replace target folder [default: False]
+        symlinks (bool, optional): create symbolic link to Python executable [default: True]
+        upgrade (bool, optional): Upgrades existing environment with new Python executable [default: False]
+        include_pip (bool, optional): Includes pip within virtualenv [default: True]
+        prompt (str, optional): Modifies prompt
+        python (str, optional): Version of python, python executable or path to python
+
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): do not update system
+        timeout (float, optional): seconds before creation is abandoned
+        executor (concurrent.futures.Executor, optional): executor for filesystem work [default: loop default]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InterpreterNotFound: when python cannot be found
+        asyncio.TimeoutError: when timeout expires
+
+    Returns:
+        str: path to venv
+    """
+    return await asyncio.wait_for(_create(
+        path, site_packages=site_packages, overwrite=overwrite, symlinks=symlinks, upgrade=upgrade, include_pip=include_pip,
+        prompt=prompt, python=python, verbose=verbose, dry_run=dry_run, executor=executor, session=session), timeout)
+
+
+async def enter(path, command=None, verbose=None, capture=None, timeout=None, max_output=None, session=None):
+    """Runs a command within a virtual environment
+
+    Unlike api.enter, the command never gets an interactive shell; it
+    shares this process's stdout and stderr unless captured.
+
+    Args:
+        path (str): path to virtual environment
+        command (tuple|list|str, optional): command to run in virtual env [default: shell]
+        verbose (int, optional): Adds more information to stdout
+        capture (str|Callable, optional): inherit, capture or a callable receiving (stream name, line);
+            the callable may be a coroutine function [default: inherit]
+        timeout (float, optional): seconds before the command is killed
+        max_output (int, optional): characters of output kept per stream; the tail is kept
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        CommandResult: return code, duration and any captured output
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    capture = capture or api.INHERIT
+    if capture not in [api.INHERIT, api.CAPTURE] and not callable(capture):
+        raise ValueError(f'Unknown capture mode: {capture!r}')
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    if capture == api.INHERIT:
+        result = await api._run(path, command, on_line=None, timeout=timeout, session=session)
+    else:
+        on_line, finish = api._output_handler(capture, max_output)
+        result = finish(await api._run(path, command, on_line=on_line, timeout=timeout, session=session))
+    await _in_executor(None, functools.partial(api._record_use, path, session=session))
+    rc_color = 'green' if result.returncode == 0 else 'red'
+    rc = click.style(str(result.returncode), fg=rc_color)
+    support.echo(click.style('Command return code: ', fg='blue') + rc, verbose=verbose)
+    return result
+
+
+async def remove(path, verbose=None, dry_run=None, check=None, timeout=None, executor=None, session=None):
+    """Removes a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): do not update system
+        check (bool, optional): Raises PathNotFoundError if True and path isn't found [default: False]
+        timeout (float, optional): seconds before waiting on removal is abandoned
+        executor (concurrent.futures.Executor, optional): executor for filesystem work [default: loop default]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        str: folder path removed
+    """
+    func = functools.partial(api.remove, path, verbose=verbose, dry_run=dry_run, check=check, session=session)
+    return await asyncio.wait_for(_in_executor(executor, func), timeout)
+
+
+async def show_envs(path=None, timeout=None, executor=None, session=None):
+    """Shows virtual environments found under path
+
+    Args:
+        path (str, optional): path to search [default: WORKON_HOME]
+        timeout (float, optional): seconds before the search is abandoned
+        executor (concurrent.futures.Executor, optional): executor for filesystem work [default: loop default]
+        session (Vsh, optional): session settings [default: get_session()]
+    """
+    func = functools.partial(api.show_envs, path=path, session=session)
+    return await asyncio.wait_for(_in_executor(executor, func), timeout)
+
+
+async def validate_environment(path, check=None, timeout=None, executor=None, session=None):
+    """Validates if path is a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+        check (bool, optional): Raise an error if path isn't valid
+        timeout (float, optional): seconds before validation is abandoned
+        executor (concurrent.futures.Executor, optional): executor for filesystem work [default: loop default]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InvalidEnvironmentError: when environment is not valid
+
+    Returns:
+        bool: True if valid virtual environment path
+    """
+    func = functools.partial(api.validate_environment, path, check=check, session=session)
+    return await asyncio.wait_for(_in_executor(executor, func), timeout)
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+async def _check_output(*cmd):
+    """Runs cmd, killing it if cancelled, and raises on failure"""
+    process = await asyncio.create_subprocess_exec(
+        *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        output, _ = await process.communicate()
+    except asyncio.CancelledError:
+        api._kill(process)
+        raise
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, output=output)
+    return output
+
+
+async def _create(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None, python=None, verbose=None, dry_run=None, executor=None, session=None):
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    name = os.path.basename(path)
+    builder = api._get_builder(path=path, site_packages=site_packages, overwrite=overwrite, symlinks=symlinks, upgrade=upgrade, include_pip=include_pip, prompt=prompt)
+    if not dry_run:
+        executable = await _in_executor(executor, functools.partial(api._get_interpreter, python, session=session))
+        if not executable:
+            raise InterpreterNotFound(version=python)
+        # pip is installed here rather than by the builder so that
+        #  ensurepip runs as an asyncio subprocess
+        with_pip, builder.with_pip = builder.with_pip, False
+        true_system_site_packages, builder.system_site_packages = builder.system_site_packages, False
+        context = await _in_executor(executor, functools.partial(builder.create, env_dir=path, executable=executable))
+        if with_pip:
+            await _check_output(*builder.pip_command(context))
+        if true_system_site_packages:
+            builder.system_site_packages = True
+            await _in_executor(executor, builder.create_configuration, context)
+        session.forget(os.path.dirname(path))
+        await _in_executor(executor, functools.partial(api._record_use, path, session=session))
+    support.echo('Created virtual environment "' + click.style(name, fg='yellow') + " under: " + click.style(path, fg='green'), verbose=verbose)
+    return path
+
+
+def _in_executor(executor, func, *args):
+    return asyncio.get_running_loop().run_in_executor(executor, func, *args)
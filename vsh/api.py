@@ -1,24 +1,161 @@
+import asyncio
+import collections
+import concurrent.futures
+import fnmatch
+import functools
+import hashlib
 import itertools
+import json
 import os
+import queue
 import re
 import shlex
-import shutil
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 import types
 import venv
 from pathlib import Path
 
+from . import bytecode, dists, doctor, imports, installer, launchers, packing, store, trash, wheelhouse
 from .__metadata__ import package_metadata
 from .cli import support
 from .cli.click import api as click
-from .errors import InterpreterNotFound, InvalidEnvironmentError, PathNotFoundError
+from .ephemeral import claim as claim_ephemeral
+from .ephemeral import reap_orphans_later
+from .ephemeral import release as release_ephemeral
+from .errors import BaseInUseError, BaseMismatchError, InterpreterNotFound, InvalidEnvironmentError, PathNotFoundError, UnpinnedRequirementError
+from .session import Vsh, get_session
 
-__all__ = ('create', 'enter', 'remove', 'show_envs', 'show_version')
+__all__ = (
+    'Vsh', 'build_wheelhouse', 'create', 'create_matrix', 'dedupe', 'diagnose_startup', 'diff', 'enter', 'enter_many', 'environment_details',
+    'find_environments', 'freeze', 'freeze_many', 'gc', 'get_session', 'inspect_environment', 'install', 'matrix_paths', 'optimize_launchers', 'pack',
+    'precompile', 'purge', 'reclaim', 'remove', 'resolve_environment', 'set_bytecode_policy', 'set_module_index', 'show_diff', 'show_envs',
+    'show_results', 'show_startup', 'show_version', 'stream', 'sync', 'unpack', 'validate_environment',
+    )
+
+# Capture modes for enter
+INHERIT = 'inherit'
+CAPTURE = 'capture'
+
+# Default bound, in characters, on captured output per stream
+MAX_OUTPUT = 2 ** 24
+
+
+EnvironmentStatus = collections.namedtuple('EnvironmentStatus', 'path valid version reason base', defaults=(None, ))
+
+EnvironmentDetails = collections.namedtuple('EnvironmentDetails', 'name path version size packages last_used base', defaults=(None, ))
+
+SyncDelta = collections.namedtuple('SyncDelta', 'add change remove')
+
+EnvironmentDiff = collections.namedtuple('EnvironmentDiff', 'added removed changed modified')
+
+# Installed files which differ between environments holding the same distribution
+DIFF_IGNORE = re.compile(r'^\.\./|(^|/)__pycache__/|\.pyc$|\.dist-info/(RECORD|INSTALLER|REQUESTED|direct_url\.json)$')
+
+# Folder in an environment holding the content hash of the last file synced
+SYNC_MARKER = '.vsh-sync'
+
+# Distributions sync never removes and freeze leaves out
+PACKAGING_TOOLS = ('pip', 'setuptools', 'wheel')
+
+# Requirement file lines sync can't apply exactly
+SYNC_UNSUPPORTED = ('-r', '-c', '-e', '--requirement', '--constraint', '--editable')
+
+# Chains a layered environment's site-packages to its base
+BASE_PTH = '_vsh_base.pth'
+
+# Sort orders for show_envs
+SORT_KEYS = {
+    'name': lambda details: details.name,
+    'size': lambda details: -details.size,
+    'age': lambda details: details.last_used or 0,
+    }
+
+
+class CommandResult(subprocess.CompletedProcess):
+    """The result of a command run within a virtual environment"""
+
+    def __init__(self, path, args, returncode, stdout=None, stderr=None, duration=None, timed_out=None, truncated=None):
+        super().__init__(args=args, returncode=returncode, stdout=stdout, stderr=stderr)
+        self.path = path
+        self.name = os.path.basename(path)
+        self.duration = duration
+        self.timed_out = bool(timed_out)
+        self.truncated = bool(truncated)
+
+
+class OutputStream:
+    """Asynchronously iterates over (stream name, line) for a command
+    run within a virtual environment.
+
+    Lines are queued with a bound so a slow consumer applies back
+    pressure to the command instead of buffering its output.  Once
+    exhausted, the CommandResult is available as `result`.
+
+    Args:
+        path (str): path to virtual environment
+        command (tuple|list|str): command to run in virtual env
+        timeout (float, optional): seconds before the command is killed
+        max_lines (int, optional): lines queued before reading pauses [default: 1024]
+        session (Vsh, optional): session settings [default: get_session()]
+    """
+
+    def __init__(self, path, command, timeout=None, max_lines=None, session=None):
+        self.path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+        self.command = command
+        self.timeout = timeout
+        self.session = session
+        self.result = None
+        self._queue = asyncio.Queue(maxsize=max_lines or 1024)
+        self._task = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        item = await self._queue.get()
+        if item is None:
+            self.result = await self._task
+            raise StopAsyncIteration
+        return item
+
+    async def _run(self):
+        try:
+            result = await _run(self.path, self.command, on_line=lambda *item: self._queue.put(item), timeout=self.timeout, session=self.session)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            await self._queue.put(None)
+            raise
+        await self._queue.put(None)
+        return result
+
+    async def aclose(self):
+        """Stops the command if it is still running"""
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
 
 
 class VenvBuilder(venv.EnvBuilder):
 
+    def __init__(self, *args, precompile=None, **kwds):
+        """
+        Args:
+            precompile (str, optional): compile site-packages after setup with this invalidation mode; see vsh.bytecode
+        """
+        super().__init__(*args, **kwds)
+        self.precompile = precompile
+
     def create(self, env_dir, executable=None):
         """
         Create a virtual environment in a directory.
@@ -26,6 +163,9 @@ class VenvBuilder(venv.EnvBuilder):
         Args:
             env_dir (str): The target directory to create an environment in.
             executable (str, optional): path to python interpreter executable [default: sys.executable]
+
+        Returns:
+            types.SimpleNamespace: context
         """
         env_dir = os.path.abspath(env_dir)
         context = self.ensure_directories(env_dir=env_dir, executable=executable)
@@ -45,6 +185,10 @@ class VenvBuilder(venv.EnvBuilder):
             # restore it and rewrite the configuration
             self.system_site_packages = True
         self.create_configuration(context)
+        context.compiled = None
+        if self.precompile:
+            context.compiled = bytecode.precompile(context.env_exe, _site_packages(env_dir), mode=self.precompile)
+        return context
 
     def ensure_directories(self, env_dir, executable=None):
         """
@@ -107,13 +251,17 @@ class VenvBuilder(venv.EnvBuilder):
 
     def _setup_pip(self, context):
         """Installs or upgrades pip in a virtual environment"""
+        subprocess.check_output(self.pip_command(context), stderr=subprocess.STDOUT)
+
+    @staticmethod
+    def pip_command(context):
+        """Returns the command which installs pip in a virtual environment"""
         # We run ensurepip in isolated mode to avoid side effects from
         # environment vars, the current directory and anything else
         # intended for the global Python environment
         # Originally -Im, but -Esm works on both python2 and python3
-        cmd = [context.env_exe, '-Esm', 'ensurepip', '--upgrade',
-                                                     '--default-pip']
-        subprocess.check_output(cmd, stderr=subprocess.STDOUT)
+        return [context.env_exe, '-Esm', 'ensurepip', '--upgrade',
+                                                      '--default-pip']
 
 
 def build_vsh_config_file(venv_path, startup_path=None):
@@ -137,7 +285,40 @@ def build_vsh_config_file(venv_path, startup_path=None):
             support.echo(f'To edit, update: {click.style(str(vsh_venv_config_path), fg="yellow")}')
 
 
-def create(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None, python=None, verbose=None, interactive=None, dry_run=None):
+def build_wheelhouse(requirements, python=None, workers=None, pip_args=None, verbose=None, session=None):
+    """Builds wheels for requirements, and their dependencies, into the wheelhouse
+
+    Args:
+        requirements (str|Iterable[str]): requirements file or requirement lines
+        python (str, optional): Version of python, python executable or path to python the wheels are for
+        workers (int, optional): wheels built at once [default: os.cpu_count()]
+        pip_args (List[str], optional): extra options for pip, e.g. an index url
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InterpreterNotFound: when python cannot be found
+        subprocess.CalledProcessError: when pip fails to download or build
+
+    Returns:
+        List[str]: names of the wheels added
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    constraints = None
+    if isinstance(requirements, str):
+        requirements, constraints = wheelhouse.read_requirements(requirements), wheelhouse.read_constraints(requirements)
+    executable = _get_interpreter(python, session=session)
+    if not executable:
+        raise InterpreterNotFound(version=python)
+    added = wheelhouse.build(requirements, session.wheelhouse, python=executable, workers=workers, pip_args=pip_args, constraints=constraints)
+    support.echo(click.style('Added ', fg='blue') + f'{len(added)} wheels to: ' + click.style(session.wheelhouse, fg='green'), verbose=verbose)
+    return added
+
+
+def create(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None, python=None, base=None, ephemeral=None,
+           link=None, requirements=None, lock=None, offline=None, precompile=None, bytecode_policy=None, verbose=None, interactive=None, dry_run=None,
+           session=None):
     """Creates a virtual environment
 
     Notes: Wraps venv
@@ -152,83 +333,424 @@ def create(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None
         include_pip (bool, optional): Includes pip within virtualenv [default: True]
         prompt (str, optional): Modifies prompt
         python (str, optional): Version of python, python executable or path to python
+        base (str, optional): path to an environment whose packages are layered beneath this one's
+        ephemeral (bool, optional): owned by this process; reclaimed if it exits without removing it [default: False]
+        link (str, optional): link installed files to the store, as hardlink or reflink; see dedupe
+        requirements (str, optional): requirements file installed after creation; see install
+        lock (str, optional): lock file whose wheels are unpacked without pip after creation; see install
+        offline (bool, optional): install only from the wheelhouse [default: session.offline]
+        precompile (str, optional): compile site-packages, once installed, with this invalidation mode [default: session.precompile]
+        bytecode_policy (str, optional): bytecode policy, one of vsh.bytecode.POLICIES; see set_bytecode_policy
 
         verbose (int, optional): more output [default: 0]
         interactive (bool, optional): ask before updating system [default: False]
         dry_run (bool, optional): do not update system
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InterpreterNotFound: when python cannot be found
+        InvalidEnvironmentError: when base is not a valid environment
+        BaseMismatchError: when base uses another python version
+        WheelsMissingError: when offline and the wheelhouse lacks a requirement
+        HashMismatchError: when a locked wheel doesn't match its hashes
 
     Returns:
         str: path to venv
     """
+    session = session or get_session()
     verbose = max(int(verbose or 0), 0)
     path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
     name = os.path.basename(path)
-    builder = _get_builder(path=path, site_packages=site_packages, overwrite=overwrite, symlinks=symlinks, upgrade=upgrade, include_pip=include_pip, prompt=prompt)
+    if base:
+        base = os.path.expanduser(base) if base.startswith('~') else os.path.abspath(base)
+        if base == path or not validate_environment(base, session=session):
+            raise InvalidEnvironmentError(path=base)
+    if requirements or lock:
+        # Fails fast, before anything is created, when offline and a wheel is missing
+        offline = session.offline if offline is None else offline
+        needed = [line for filename in [requirements, lock] if filename for line in wheelhouse.read_requirements(filename)]
+        constraints = [line for filename in [requirements, lock] if filename for line in wheelhouse.read_constraints(filename)]
+        wheelhouse.install_args(session.wheelhouse, needed, offline=offline, constraints=constraints)
+    precompile = _precompile_mode(session.precompile if precompile is None else precompile)
+    if bytecode_policy and bytecode_policy not in bytecode.POLICIES:
+        raise ValueError(f'Unknown bytecode policy: {bytecode_policy}')
+    # Compiling once everything is installed and the policy is set, rather than twice
+    builder = _get_builder(path=path, site_packages=site_packages, overwrite=overwrite, symlinks=symlinks, upgrade=upgrade, include_pip=include_pip, prompt=prompt,
+                           precompile=None if requirements or lock or bytecode_policy else precompile)
     prompt = f'Create virtual environment "{name}" under: {path}?'
     run_command = click.confirm(prompt) if interactive else True
     if run_command:
         if not dry_run:
-            executable = _get_interpreter(python)
+            executable = _get_interpreter(python, session=session)
             if not executable:
                 raise InterpreterNotFound(version=python)
-            builder.create(env_dir=path, executable=executable)
+            context = builder.create(env_dir=path, executable=executable)
+            if context.compiled:
+                _show_compiled(path, context.compiled, verbose)
+            if base:
+                _layer(path, base, session=session)
+            if bytecode_policy:
+                bytecode.write_policy(path, bytecode_policy)
+            if ephemeral:
+                claim_ephemeral(path, session.cache_dir)
+            if requirements or lock:
+                install(path, requirements, lock=lock, offline=offline, precompile=precompile, verbose=verbose, session=session)
+            elif bytecode_policy and _precompile_mode(precompile, path):
+                _precompile(path, _precompile_mode(precompile, path), verbose=verbose, session=session)
+            if link:
+                dedupe([path], mode=link, verbose=max(verbose - 1, 0), session=session)
+            session.forget(os.path.dirname(path))
+            _record_use(path, session=session)
         support.echo('Created virtual environment "' + click.style(name, fg='yellow') + " under: " + click.style(path, fg='green'), verbose=verbose)
     return path
 
 
-def enter(path, command=None, verbose=None):
+def create_matrix(path, pythons, workers=None, site_packages=None, overwrite=None, symlinks=None, include_pip=None, ephemeral=None, verbose=None, dry_run=None,
+                  session=None):
+    """Creates or reuses one virtual environment per interpreter
+
+    Environments are named after path with an interpreter suffix, e.g.
+    ``NAME-py311``.  Interpreters are resolved before anything is
+    created and missing environments are created concurrently.
+
+    Args:
+        path (str): path to virtual environment, used as the base name
+        pythons (Iterable[str]): versions of python, python executables or paths to python
+        workers (int, optional): maximum number of concurrent creates [default: os.cpu_count()]
+
+        site_packages (bool, optional): use system packages within environment [default: False]
+        overwrite (bool, optional): replace target folders [default: False]
+        symlinks (bool, optional): create symbolic link to Python executable [default: True]
+        include_pip (bool, optional): Includes pip within virtualenv [default: True]
+        ephemeral (bool, optional): created environments are owned by this process [default: False]
+
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): do not update system
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InterpreterNotFound: when any interpreter cannot be found
+
+    Returns:
+        List[str]: paths to venvs, in the order of pythons
+    """
+    session = session or get_session()
+    workers = max(int(workers or os.cpu_count() or 1), 1)
+    pythons = list(pythons)
+    for python in pythons:
+        if not _get_interpreter(python, session=session):
+            raise InterpreterNotFound(version=python)
+    paths = matrix_paths(path, pythons)
+    missing = {
+        env_path: python
+        for python, env_path in zip(pythons, paths)
+        if overwrite or not validate_environment(env_path, session=session)
+        }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(create, env_path, site_packages=site_packages, overwrite=overwrite, symlinks=symlinks,
+                            include_pip=include_pip, python=python, ephemeral=ephemeral, verbose=verbose, dry_run=dry_run, session=session)
+            for env_path, python in missing.items()
+            ]
+        for future in concurrent.futures.as_completed(futures):
+            future.result()
+    return list(dict.fromkeys(paths))
+
+
+def dedupe(paths=None, mode=None, workers=None, verbose=None, dry_run=None, session=None):
+    """Links identical installed files across virtual environments to one copy
+
+    Files in site-packages are hashed on a process pool and duplicates
+    are replaced by hard links (or reflinks) to a copy in the .vsh-store
+    folder of their root.  Stored copies no longer used by any
+    environment are deleted first.
+
+    Args:
+        paths (Iterable[str], optional): paths to virtual environments [default: all found]
+        mode (str, optional): hardlink or reflink [default: hardlink]
+        workers (int, optional): processes hashing files [default: os.cpu_count()]
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): only report what would be reclaimed
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        ValueError: when mode is unknown
+        ReflinkUnsupportedError: when mode is reflink and a store's filesystem can't clone files
+
+    Returns:
+        store.DedupeReport: totals across all stores
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    if paths is None:
+        paths = [path for _, path in find_environment_folders(session=session)]
+    by_store = collections.defaultdict(list)
+    for path in paths:
+        path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+        by_store[os.path.join(session.index(path).root, store.NAME)].append(path)
+    totals = store.DedupeReport(0, 0, 0, 0, [])
+    for folder, group in by_store.items():
+        freed = 0 if dry_run else store.prune(folder)
+        report = store.dedupe(group, folder, mode=mode, workers=workers, dry_run=dry_run)
+        totals = store.DedupeReport(totals.files + report.files, totals.hashed + report.hashed, totals.linked + report.linked,
+                                    totals.reclaimed + report.reclaimed + freed, totals.errors + report.errors)
+    for path, error in totals.errors:
+        support.echo(click.style(f'Could not link {path}: {error}', fg='red'), verbose=verbose)
+    verb = 'Would link' if dry_run else 'Linked'
+    reclaimed = click.style(('would reclaim ' if dry_run else 'reclaimed ') + _format_size(totals.reclaimed), fg='green')
+    support.echo(click.style(f'{verb} ', fg='blue') + f'{totals.linked} of {totals.files} files ({totals.hashed} hashed), {reclaimed}')
+    return totals
+
+
+def diagnose_startup(path, runs=None, session=None):
+    """Measures what the interpreter of a virtual environment spends starting up
+
+    The interpreter runs with the environment entered, bytecode policy
+    included, so the report matches what commands run with vsh see.
+
+    Args:
+        path (str): path to virtual environment
+        runs (int, optional): runs measured [default: 5]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InvalidEnvironmentError: when path is not a virtual environment
+
+    Returns:
+        vsh.doctor.StartupReport: median wall time, modules ranked by self time, .pth lines ranked by time and customize modules
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    if not validate_environment(path, session=session):
+        raise InvalidEnvironmentError(path=path)
+    python = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+    return doctor.startup(python, runs=runs, environ=_update_environment(path, session=session))
+
+
+def diff(a, b, workers=None):
+    """Compares the distributions and files of two virtual environments
+
+    Distributions are read from dist-info metadata.  For those at the
+    same version in both, the files listed in their RECORD are hashed on
+    a thread pool, skipping bytecode and scripts, which differ by
+    environment anyway.
+
+    Args:
+        a (str): path to virtual environment
+        b (str): path to virtual environment
+        workers (int, optional): files hashed at once [default: 4 per cpu, at most 32]
+
+    Returns:
+        EnvironmentDiff: name==version only in b (added) or only in a (removed),
+            (name, version in a, version in b) for changed versions and
+            (name==version, differing files) for modified files
+    """
+    a, b = (os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path) for path in [a, b])
+    installed_a = dists.installed(_site_packages(a))
+    installed_b = dists.installed(_site_packages(b))
+    added = sorted((f'{d.name}=={d.version}' for key, d in installed_b.items() if key not in installed_a), key=str.lower)
+    removed = sorted((f'{d.name}=={d.version}' for key, d in installed_a.items() if key not in installed_b), key=str.lower)
+    changed = sorted((d.name, d.version, installed_b[key].version) for key, d in installed_a.items()
+                     if key in installed_b and installed_b[key].version != d.version)
+    common = sorted(key for key, d in installed_a.items() if key in installed_b and installed_b[key].version == d.version)
+    checks = []
+    for key in common:
+        folders = [os.path.dirname(installed_a[key].path), os.path.dirname(installed_b[key].path)]
+        files = set(dists.read_record(installed_a[key].path)) | set(dists.read_record(installed_b[key].path))
+        checks.extend((key, name, folders) for name in sorted(files) if not DIFF_IGNORE.search(name))
+
+    def differs(check):
+        _, name, folders = check
+        return len({dists.file_hash(os.path.join(folder, name)) for folder in folders}) > 1
+
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    modified = collections.defaultdict(list)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        for check, different in zip(checks, executor.map(differs, checks)):
+            if different:
+                modified[check[0]].append(check[1])
+    modified = [(f'{installed_a[key].name}=={installed_a[key].version}', files) for key, files in sorted(modified.items())]
+    return EnvironmentDiff(added, removed, changed, modified)
+
+
+def enter(path, command=None, verbose=None, capture=None, timeout=None, max_output=None, session=None):
     """Enters a virtual environment
 
+    Capture modes:
+        inherit: the command shares this terminal [default]
+        capture: stdout and stderr are collected onto the result
+        callable: called with (stream name, line) as each line arrives
+
     Args:
         path (str): path to virtual environment
         command (tuple|list|str, optional): command to run in virtual env [default: shell]
         verbose (int, optional): Adds more information to stdout
+        capture (str|Callable, optional): capture mode [default: inherit]
+        timeout (float, optional): seconds before the command and its children are killed; an inherit
+            mode command then runs in a session of its own
+        max_output (int, optional): characters of output kept per stream; the tail is kept [default: 16 Mi]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        CommandResult: return code, duration and any captured output
     """
     verbose = max(int(verbose or 0), 0)
+    capture = capture or INHERIT
+    if capture not in [INHERIT, CAPTURE] and not callable(capture):
+        raise ValueError(f'Unknown capture mode: {capture!r}')
     path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
-    shell = os.getenv("SHELL")
-    command = command or shell
-    env = _update_environment(path)
     venv_name = click.style(Path(path).name, fg='green')
 
-    # Setup the environment scripts
-    vshell_config_commands = '; '.join(f'source {filepath}' for filepath in find_vsh_config_files(path))
-    if not isinstance(command, str):
-        command = " ".join(command)
-    if vshell_config_commands:
-        command = f'{vshell_config_commands}; {command}'
-    cmd_display = click.style(command, fg='green')
-    if Path(shell).name in ['bash', 'zsh']:
-        command = f'{shell} -i -c \"{command}\"'
-        cmd_display = f'{shell} -i -c \"{cmd_display}\"'
-
-    support.echo(click.style(f'Running command in "', fg='blue') + venv_name + click.style(f'": ', fg='blue') + cmd_display, verbose=max(verbose - 1, 0))
-
     # Activate and run
-    return_code = subprocess.run(command, shell=True, env=env, universal_newlines=True)
-    rc_color = 'green' if return_code == 0 else 'red'
-    rc = click.style(str(return_code), fg=rc_color)
+    if capture == INHERIT:
+        command, env, cmd_display = _build_command(path, command, session=session)
+        support.echo(click.style('Running command in "', fg='blue') + venv_name + click.style('": ', fg='blue') + cmd_display, verbose=max(verbose - 1, 0))
+        start = time.monotonic()
+        if timeout is None:
+            process = subprocess.run(command, shell=True, env=env, universal_newlines=True)
+            result = CommandResult(path, args=command, returncode=process.returncode, duration=time.monotonic() - start)
+        else:
+            # In its own process group, so a timeout kills the command's children too and not just the shell;
+            # not its own session, as interactive shells need the terminal
+            foreground = _foreground()
+            process = subprocess.Popen(
+                command, shell=True, env=env, universal_newlines=True, preexec_fn=None if sys.platform == 'win32' else _own_group)
+            timed_out = False
+            try:
+                process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                timed_out = True
+                _kill(process)
+                process.wait()
+            except BaseException:
+                _kill(process)
+                raise
+            finally:
+                if foreground:
+                    _set_foreground(os.getpgrp())
+            result = CommandResult(path, args=command, returncode=process.returncode, duration=time.monotonic() - start, timed_out=timed_out)
+    else:
+        on_line, finish = _output_handler(capture, max_output)
+        result = finish(asyncio.run(_run(path, command, on_line=on_line, timeout=timeout, session=session)))
+
+    _record_use(path, session=session)
+    rc_color = 'green' if result.returncode == 0 else 'red'
+    rc = click.style(str(result.returncode), fg=rc_color)
     support.echo(click.style('Command return code: ', fg='blue') + rc, verbose=verbose)
-    return return_code
+    return result
 
 
-def find_vsh_config_files(venv_path=None):
-    cmds = [
-        'git rev-parse --show-toplevel',
-        'hg root',
-        ]
-    top_of_current_repo_path = None
-    for cmd in cmds:
-        cmd = shlex.split(cmd)
-        try:
-            top_of_current_repo_path = Path(subprocess.run(cmd, stderr=subprocess.PIPE, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()) or None
-            if top_of_current_repo_path:
-                break
-        except Exception:
-            pass
+def enter_many(paths, command=None, workers=None, collect=None, timeout=None, verbose=None, session=None):
+    """Runs a command in several virtual environments concurrently
+
+    Output is line-prefixed with the environment name as it arrives
+    unless collect is set, in which case each environment's output is
+    printed as a block once its command finishes.
+
+    Args:
+        paths (Iterable[str]): paths to virtual environments
+        command (tuple|list|str): command to run in each virtual env
+        workers (int, optional): maximum number of concurrent commands [default: os.cpu_count()]
+        collect (bool, optional): group output per environment [default: False]
+        timeout (float, optional): seconds before each command is killed
+        verbose (int, optional): Adds more information to stdout
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        List[CommandResult]: one result per path, in the order given
+    """
+    verbose = max(int(verbose or 0), 0)
+    workers = max(int(workers or os.cpu_count() or 1), 1)
+    paths = [os.path.expanduser(p) if p.startswith('~') else os.path.abspath(p) for p in paths]
+    return asyncio.run(_enter_many(paths, command, workers=workers, collect=bool(collect), timeout=timeout, verbose=verbose, session=session))
+
+
+def environment_details(path, session=None):
+    """Returns the details of a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        EnvironmentDetails: name, path, interpreter version, installed package
+            count, bytes used on disk and time of last use (None if unknown)
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    details, _ = _environment_details(os.path.basename(path), path, session=session)
+    return details
+
+
+def find_environment_folders(path=None, max_depth=None, ignore=None, workers=None, timeout=None, session=None):
+    """Finds virtual environments under path, or under every root
+
+    Folders are scanned concurrently and results are yielded as they are
+    found, so their order is not stable.  Valid environments and folders
+    matching an ignore pattern are not descended into.  Roots are scanned
+    at the same time so a slow root doesn't hold up the others, and a
+    root which takes longer than timeout is skipped with a warning.
+
+    Args:
+        path (str, optional): path to search [default: session.roots]
+        max_depth (int, optional): deepest level below path to search [default: session.max_depth]
+        ignore (Iterable[str], optional): folder name globs to skip [default: session.ignore]
+        workers (int, optional): number of folders scanned at once [default: session.scan_workers]
+        timeout (float, optional): seconds to wait on each root [default: session.root_timeout]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Yields:
+        Tuple[str, str]: name and path of each environment
+    """
+    session = session or get_session()
+    max_depth = session.max_depth if max_depth is None else max_depth
+    ignore = tuple(session.ignore if ignore is None else ignore)
+    workers = workers or session.scan_workers
+    scan = functools.partial(_scan_environment_folders, max_depth=max_depth, ignore=ignore, workers=workers, session=session)
+    if path:
+        yield from session.environments(path, scan, key=(max_depth, ignore))
+        return
+    timeout = session.root_timeout if timeout is None else timeout
+    sources = {root: functools.partial(session.environments, root, scan, key=(max_depth, ignore)) for root in session.roots}
+    for root, item in _iter_concurrently(sources, timeout=timeout):
+        yield item
+
+
+def find_environments(pattern, path=None, session=None):
+    """Finds virtual environments with names matching pattern
+
+    Args:
+        pattern (str): comma separated names, globs or regular expressions
+        path (str, optional): path to search [default: WORKON_HOME]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Yields:
+        Tuple[str, str]: name and path of each matching environment
+    """
+    patterns = [p.strip() for p in pattern.split(',') if p.strip()]
+    for name, directory in find_environment_folders(path=path, session=session):
+        if any(_match_name(name, p) for p in patterns):
+            yield name, directory
+
+
+def find_existing_venv_names(venvs_home=None, timeout=None, session=None):
+    session = session or get_session()
+    roots = [venvs_home] if venvs_home else session.roots
+    timeout = session.root_timeout if timeout is None else timeout
+    sources = {root: functools.partial(_list_folder_names, root, ignore=session.ignore) for root in roots}
+    names = set()
+    for root, name in _iter_concurrently(sources, timeout=timeout):
+        if name not in names:
+            names.add(name)
+            yield name
+
+
+def find_vsh_config_files(venv_path=None, session=None):
+    session = session or get_session()
+    top_of_current_repo_path = session.repo_root()
     paths = [
         Path('/usr/local/etc/vsh'),
-        Path(os.getenv('HOME')),
+        Path(session.home),
         Path('.'),
         Path(venv_path),
         top_of_current_repo_path,
@@ -258,83 +780,705 @@ def find_vsh_config_files(venv_path=None):
                         yield filepath
 
 
-def find_environment_folders(path=None):
-    path = path or os.getenv('WORKON_HOME') or os.path.join(os.getenv('HOME'), '.virtualenvs')
-    for root, directories, files in os.walk(path):
-        found = []
-        for index, name in enumerate(directories):
-            directory = os.path.join(root, name)
-            if not validate_environment(directory):
-                continue
-            yield name, directory
-            found.append(name)
-        # This makes the search "fast" by skipping out on folders
-        #  that do not need to be searched because they have already
-        #  been identified as valid environments
-        directories[:] = [d for d in directories if d not in found]
+def freeze(path, include_all=None):
+    """Lists the distributions installed in a virtual environment, as pip freeze does
+
+    Reads dist-info metadata directly, without starting an interpreter.
+
+    Args:
+        path (str): path to virtual environment
+        include_all (bool, optional): include pip, setuptools and wheel [default: False]
+
+    Returns:
+        List[str]: name==version lines, sorted by name
+    """
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    installed = dists.installed(_site_packages(path))
+    return sorted((f'{d.name}=={d.version}' for key, d in installed.items() if include_all or key not in PACKAGING_TOOLS), key=str.lower)
+
+
+def freeze_many(paths, include_all=None, workers=None):
+    """Lists the distributions installed in many virtual environments on a thread pool
+
+    Args:
+        paths (Iterable[str]): paths to virtual environments
+        include_all (bool, optional): include pip, setuptools and wheel [default: False]
+        workers (int, optional): environments read at once [default: 4 per cpu, at most 32]
+
+    Returns:
+        Dict[str, List[str]]: name==version lines by path, in the order of paths
+    """
+    paths = list(paths)
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return dict(zip(paths, executor.map(functools.partial(freeze, include_all=include_all), paths)))
+
+
+def gc(max_age=None, quota=None, protect=None, path=None, workers=None, verbose=None, dry_run=None, session=None):
+    """Removes least recently used virtual environments
+
+    Environments unused for longer than max_age are removed, then the
+    least recently used of the rest are removed until the environments
+    fit within quota.  Environments never entered count from when they
+    were last modified.  The active environment ($VIRTUAL_ENV) is always
+    protected.
+
+    Args:
+        max_age (float|str, optional): seconds, or a duration such as 30d, 12h or 90m
+        quota (int|str, optional): bytes, or a size such as 500M or 20G
+        protect (Iterable[str], optional): name or path globs never removed
+        path (str, optional): path to search [default: roots of the session]
+        workers (int, optional): environments removed at once [default: session.scan_workers]
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): only show what would be removed
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        ValueError: when max_age or quota can't be parsed
+
+    Returns:
+        List[EnvironmentDetails]: environments removed, least recently used first
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    max_age = _parse_duration(max_age) if max_age is not None else None
+    quota = _parse_size(quota) if quota is not None else None
+    protect = list(protect or [])
+    active = session.environ.get('VIRTUAL_ENV')
+    if active:
+        protect.append(os.path.abspath(active))
+
+    details = _collect_details(path, workers=workers, session=session)
+    # Bases are kept while anything is layered on them
+    protect.extend(item.base for item in details if item.base)
+    now = time.time()
+    used = {item.path: _last_activity(item) for item in details}
+    total = sum(item.size for item in details)
+    evict = []
+    for item in sorted(details, key=lambda item: used[item.path]):
+        if any(fnmatch.fnmatchcase(item.name, pattern) or fnmatch.fnmatchcase(item.path, pattern) for pattern in protect):
+            continue
+        if (max_age is not None and now - used[item.path] > max_age) or (quota is not None and total > quota):
+            evict.append(item)
+            total -= item.size
+
+    verb = 'Would remove' if dry_run else 'Removing'
+    for item in evict:
+        summary = f' ({_format_size(item.size)}, last used {_format_age(used[item.path], now)}): {item.path}'
+        support.echo(click.style(f'{verb} ', fg='blue') + click.style(item.name, fg='yellow') + summary)
+    if not dry_run and evict:
+        # Layers are known from the details, so removes don't each rescan the roots
+        layers = collections.defaultdict(list)
+        for item in details:
+            if item.base:
+                layers[item.base].append(item.name)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or session.scan_workers) as executor:
+            list(executor.map(lambda item: remove(item.path, verbose=verbose, reap=False, dependents=layers[item.path], session=session), evict))
+        trash.reap_later(trash.trash_folders({os.path.dirname(item.path) for item in evict} | {bytecode.cache_root(session.cache_dir)}))
+    reclaimed = _format_size(sum(item.size for item in evict))
+    support.echo(click.style('Would reclaim ' if dry_run else 'Reclaimed ', fg='blue') + click.style(reclaimed, fg='green'))
+    return evict
+
+
+def inspect_environment(path, session=None):
+    """Inspects the structure of a virtual environment
+
+    The interpreter version is read from pyvenv.cfg and the layout is
+    checked with a handful of stat calls.  Results are cached by the
+    session until the mtime of the environment, its bin or its lib
+    folder changes.
+
+    Args:
+        path (str): path to virtual environment
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        EnvironmentStatus: valid flag, interpreter version and reason for failure
+    """
+    session = session or get_session()
+    path = os.path.abspath(str(path))
+    status = session.environment_status(path, _environment_stamp(path), _inspect_environment)
+    if status.valid and status.base:
+        base = session.environment_status(status.base, _environment_stamp(status.base), _inspect_environment)
+        if not base.valid:
+            status = status._replace(valid=False, reason=f'Base environment is not valid: {base.reason}')
+    return status
+
+
+def install(path, requirements=None, lock=None, offline=None, workers=None, precompile=None, verbose=None, session=None):
+    """Installs a requirements or lock file into a virtual environment, preferring the wheelhouse
+
+    Pins of a lock file whose wheel is in the wheelhouse are unpacked
+    directly, without pip; see vsh.installer.  The rest of the lock file
+    is handed to pip.
+
+    Args:
+        path (str): path to virtual environment
+        requirements (str, optional): requirements file
+        lock (str, optional): lock file, every requirement pinned with ==
+        offline (bool, optional): install only from the wheelhouse [default: session.offline]
+        workers (int, optional): wheels installed at once from a lock file
+        precompile (str, optional): compile site-packages afterwards with this invalidation mode [default: session.precompile]
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        WheelsMissingError: when offline and the wheelhouse lacks a requirement
+        HashMismatchError: when a locked wheel doesn't match its hashes
+        subprocess.CalledProcessError: when pip fails
+
+    Returns:
+        str: path to venv
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    offline = session.offline if offline is None else offline
+    precompile = _precompile_mode(session.precompile if precompile is None else precompile, path)
+    _unpack_before_install(path, verbose=verbose, session=session)
+    if requirements:
+        _pip_install(path, requirements, wheelhouse.read_requirements(requirements), offline, verbose, session, compile=not precompile,
+                     constraints=wheelhouse.read_constraints(requirements))
+    if lock:
+        _install_pins(path, *installer.read_lock(lock), offline=offline, workers=workers, verbose=verbose, session=session, compile=not precompile)
+    _forget_sync(path)
+    if precompile:
+        _precompile(path, precompile, verbose=verbose, session=session)
+    _refresh_module_index(path, verbose=verbose, session=session)
+    session.forget(os.path.dirname(path))
+    support.echo(click.style('Installed ', fg='blue') + (requirements or lock) + ' into: ' + click.style(path, fg='green'), verbose=verbose)
+    return path
 
 
-def find_existing_venv_names(venvs_home=None):
-    home = os.getenv('HOME')
-    workon_home = os.getenv('WORKON_HOME') or Path(f'{home}/.virtualenvs')
-    venvs_home = venvs_home or Path(workon_home) if workon_home and Path(workon_home).exists() else None
+def matrix_paths(path, pythons):
+    """Returns the virtual environment path used for each interpreter
 
-    if venvs_home and venvs_home.exists():
-        standard_path = ['include', 'lib', 'bin']
-        for path in os.scandir(venvs_home):
-            if Path(path).is_dir():
-                if Path(path).stem not in standard_path:
-                    yield Path(path).stem
+    Args:
+        path (str): path to virtual environment, used as the base name
+        pythons (Iterable[str]): versions of python, python executables or paths to python
 
+    Returns:
+        List[str]: paths to venvs, in the order of pythons
+    """
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    return [f'{path}-{_interpreter_suffix(python)}' for python in pythons]
+
+
+def optimize_launchers(path, revert=None, verbose=None, session=None):
+    """Rewrites the console scripts of a virtual environment as minimal shims, or puts the originals back
+
+    See vsh.launchers.  The shims are checked with the environment entered.
 
-def remove(path, verbose=None, interactive=None, dry_run=None, check=None):
+    Args:
+        path (str): path to virtual environment
+        revert (bool, optional): restore the original launchers instead [default: False]
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InvalidEnvironmentError: when path is not a virtual environment
+
+    Returns:
+        Union[vsh.launchers.Optimized, List[str]]: outcome of optimizing, or the launchers restored
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    if not validate_environment(path, session=session):
+        raise InvalidEnvironmentError(path=path)
+    name = click.style(os.path.basename(path), fg='yellow')
+    if revert:
+        restored = launchers.revert(path)
+        support.echo(click.style('Restored ', fg='blue') + f'{len(restored)} launchers in {name}', verbose=verbose)
+        return restored
+    optimized = launchers.optimize(path, _site_packages(path), environ=_update_environment(path, session=session))
+    support.echo(click.style('Optimized ', fg='blue') + f'{len(optimized.rewritten)} launchers in {name}, {len(optimized.unchanged)} already minimal',
+                 verbose=verbose)
+    for script in optimized.failed:
+        support.echo(click.style(f'Kept {script}', fg='red') + ': its entry point does not import', verbose=verbose)
+    return optimized
+
+
+def pack(path, verbose=None, session=None):
+    """Packs the pure python packages of a virtual environment into a zip per site-packages
+
+    See vsh.packing.  Installs and syncs through vsh unpack it first.
+
+    Args:
+        path (str): path to virtual environment
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InvalidEnvironmentError: when path is not a virtual environment
+
+    Returns:
+        vsh.packing.Packed: names packed, left extracted as they didn't import, and failing once packed
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    if not validate_environment(path, session=session):
+        raise InvalidEnvironmentError(path=path)
+    python = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+    environ = _update_environment(path, session=session)
+    packed = packing.Packed([], [], [])
+    for folder in _site_packages(path):
+        packed = packing.Packed(*(a + b for a, b in zip(packed, packing.pack(folder, python, environ=environ))))
+    name = click.style(os.path.basename(path), fg='yellow')
+    support.echo(click.style('Packed ', fg='blue') + f'{len(packed.packed)} packages in {name}, {len(packed.kept)} left extracted', verbose=verbose)
+    if packed.failed:
+        failed = ', '.join(packed.failed)
+        support.echo(click.style('Unpacked again', fg='red') + f': {failed} did not import from the zip', verbose=verbose)
+    _refresh_module_index(path, verbose=verbose, session=session)
+    return packed
+
+
+def precompile(path, mode=None, workers=None, verbose=None, session=None):
+    """Compiles the modules in a virtual environment's site-packages on a process pool
+
+    With the prefix bytecode policy the environment's bytecode cache is
+    filled instead, so even an environment on a network mount starts warm.
+
+    Args:
+        path (str): path to virtual environment
+        mode (str, optional): invalidation mode, one of vsh.bytecode.MODES [default: the bytecode policy's, or checked-hash]
+        workers (int, optional): compiling processes [default: os.cpu_count()]
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        ValueError: when mode is unknown
+
+    Returns:
+        vsh.bytecode.Compiled: mode, seconds taken and whether every module compiled
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    return _precompile(path, _precompile_mode(mode, path) or _precompile_mode(True), workers=workers, verbose=verbose, session=session)
+
+
+def purge(path=None, session=None):
+    """Deletes removed virtual environments still in the trash
+
+    Args:
+        path (str, optional): folder holding a .trash folder [default: roots of the session]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        int: number of removed environments deleted
+    """
+    session = session or get_session()
+    roots = [os.path.abspath(path)] if path else list(session.roots) + [bytecode.cache_root(session.cache_dir)]
+    folders = trash.trash_folders(roots)
+    count = trash.reap(folders, wait=True)
+    support.echo(click.style('Purged: ', fg='blue') + click.style(str(count), fg='green'))
+    for left in trash.leftovers(folders):
+        support.echo(click.style('Could not delete: ', fg='red') + left, file=sys.stderr)
+    return count
+
+
+def reclaim(session=None):
+    """Starts detached reapers for anything vsh left behind
+
+    Trash left by earlier removals is emptied, and ephemeral
+    environments whose owner was killed are removed (checked at most
+    once per ephemeral.ORPHAN_INTERVAL).  Both only cost a few stat
+    calls when there is nothing to do.
+
+    Args:
+        session (Vsh, optional): session settings [default: get_session()]
+    """
+    session = session or get_session()
+    trash.reap_later(trash.trash_folders(list(session.roots) + [bytecode.cache_root(session.cache_dir)]))
+    reap_orphans_later(session.cache_dir)
+
+
+def remove(path, verbose=None, interactive=None, dry_run=None, check=None, reap=None, dependents=None, session=None):
     """Remove a virtual environment
 
+    The environment is renamed into the .trash folder beside it, so it
+    disappears at once, and deleted by a detached reaper process.  Unless
+    dependents are given, the roots are scanned for environments layered
+    on it, once it is known to be a valid environment really removed.
+
     Args:
         path (str): path to virtual environment
         verbose (int, optional): more output [default: 0]
         interactive (bool, optional): ask before updating system [default: False]
         dry_run (bool, optional): do not update system
         check (bool, optional): Raises PathNotFoundError if True and path isn't found [default: False]
+        reap (bool, optional): start a background reaper for the trash [default: True]
+        dependents (Iterable[str], optional): names of environments layered on path, when already known
+        session (Vsh, optional): session settings [default: get_session()]
 
     Raises:
         PathNotFoundError:  when check is True and path is not found
+        BaseInUseError: when path is the base of other environments
 
     Returns:
         str: folder path removed
     """
+    session = session or get_session()
     verbose = max(int(verbose or 0), 0)
     check = False if check is None else check
     path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
-    if not validate_environment(path) and check is True:
+    valid = validate_environment(path, session=session)
+    if not valid and check is True:
         raise InvalidEnvironmentError(path=path)
+    if valid and not dry_run:
+        dependents = _dependents(path, session=session) if dependents is None else sorted(dependents)
+        if dependents:
+            raise BaseInUseError(path=path, dependents=', '.join(dependents))
     prompt = f'Remove {path}?'
     run_command = click.confirm(prompt) == 'y' if interactive else True
     if run_command and not dry_run:
         if os.path.exists(path):
-            shutil.rmtree(path)
+            try:
+                trash_folder = trash.move_to_trash(path)
+            except OSError:
+                # e.g. path is a mount point, so can't be renamed away
+                trash.rmtree(path, workers=session.scan_workers)
+            else:
+                if reap is None or reap:
+                    trash.reap_later([trash_folder])
+            _forget_pycache(path, reap=reap, session=session)
+            session.forget(os.path.dirname(path))
+            session.index(path).discard(path)
+            release_ephemeral(path, session.cache_dir)
         elif check is True:
             raise PathNotFoundError(path=path)
     support.echo(click.style('Removed: ', fg='blue') + click.style(path, fg='green'), verbose=(max(verbose - 1, 0) and path))
     return path
 
 
-def show_envs(path=None):
-    path = path or os.getenv('WORKON_HOME')
-    for name, path in find_environment_folders(path=path):
-        print(f'Found {click.style(name, fg="yellow")} under: {click.style(path, fg="yellow")}')
+def resolve_environment(name, timeout=None, session=None):
+    """Returns the path of the environment called name
+
+    Each root is checked at the same time and the environment in the
+    root with the highest precedence wins.  When no root holds a valid
+    environment called name, the path under the first root is returned.
+
+    Args:
+        name (str): name of the virtual environment
+        timeout (float, optional): seconds to wait on each root [default: session.root_timeout]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        str: path to virtual environment
+    """
+    session = session or get_session()
+    timeout = session.root_timeout if timeout is None else timeout
+    paths = [os.path.join(root, name) for root in session.roots]
+    if len(paths) > 1:
+        sources = {path: functools.partial(_valid_paths, path, session) for path in paths}
+        valid = {path for path, _ in _iter_concurrently(sources, timeout=timeout)}
+        for path in paths:
+            if path in valid:
+                return path
+    return paths[0]
+
+
+def set_bytecode_policy(path, policy=None, workers=None, verbose=None, session=None):
+    """Sets how bytecode is written and read in a virtual environment
+
+    The policy is kept in pyvenv.cfg and applied whenever the environment
+    is entered; see vsh.bytecode.  With prefix, bytecode goes to a local
+    cache keyed by the environment, which is filled straight away on a
+    process pool; with unchecked, site-packages is precompiled with
+    unchecked hashes; with none, no bytecode is written.
+
+    Args:
+        path (str): path to virtual environment
+        policy (str, optional): one of vsh.bytecode.POLICIES, or None for python's default
+        workers (int, optional): compiling processes [default: os.cpu_count()]
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        ValueError: when policy is unknown
+
+    Returns:
+        vsh.bytecode.Compiled: the precompile, or None when the policy needs none
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    previous = bytecode.read_policy(path)
+    bytecode.write_policy(path, policy)
+    if previous == bytecode.PREFIX and policy != bytecode.PREFIX:
+        trash.rmtree(bytecode.cache_prefix(path, session.cache_dir), ignore_errors=True)
+    support.echo(click.style('Bytecode policy ', fg='blue') + f'{policy or "default"} for: ' + click.style(path, fg='green'), verbose=verbose)
+    mode = bytecode.policy_mode(policy)
+    return _precompile(path, mode, workers=workers, verbose=verbose, session=session) if mode else None
+
+
+def set_module_index(path, enabled=True, verbose=None, session=None):
+    """Turns the module index of a virtual environment on, rebuilding it, or off
+
+    See vsh.imports.  Once on, installs and syncs through vsh rebuild it.
+
+    Args:
+        path (str): path to virtual environment
+        enabled (bool, optional): build the index, or remove it [default: True]
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        InvalidEnvironmentError: when path is not a virtual environment
+
+    Returns:
+        int: top level modules indexed, 0 when removed
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    if not validate_environment(path, session=session):
+        raise InvalidEnvironmentError(path=path)
+    if not enabled:
+        imports.remove(path, _site_packages(path))
+        support.echo(click.style('Removed module index ', fg='blue') + 'of: ' + click.style(path, fg='green'), verbose=verbose)
+        return 0
+    return _refresh_module_index(path, build=True, verbose=verbose, session=session)
+
+
+def show_diff(difference):
+    """Shows the differences between two environments
+
+    Args:
+        difference (EnvironmentDiff): result of diff
+    """
+    for line in difference.added:
+        support.echo(click.style(f'+ {line}', fg='green'))
+    for line in difference.removed:
+        support.echo(click.style(f'- {line}', fg='red'))
+    for name, version_a, version_b in difference.changed:
+        support.echo(click.style(f'~ {name} {version_a} -> {version_b}', fg='yellow'))
+    for line, files in difference.modified:
+        support.echo(click.style(f'! {line}', fg='magenta') + f': {len(files)} files differ')
+        for name in files:
+            support.echo(f'    {name}')
+
+
+def show_envs(path=None, long=None, sort=None, as_json=None, workers=None, session=None):
+    """Shows the virtual environments found
+
+    The long listing adds the interpreter version, installed package
+    count, disk usage and last use of each environment.  Sizes and
+    package counts are computed in a thread pool and kept in the
+    session's persistent index until the environment changes, so
+    repeated listings only stat each environment.
+
+    Args:
+        path (str, optional): path to search [default: roots of the session]
+        long (bool, optional): show details of each environment
+        sort (str, optional): name, size (largest first) or age (least recently used first)
+        as_json (bool, optional): print details as a json list
+        workers (int, optional): environments measured at once [default: session.scan_workers]
+        session (Vsh, optional): session settings [default: get_session()]
+    """
+    if sort is not None and sort not in SORT_KEYS:
+        raise ValueError(f'Unknown sort order: {sort!r}')
+    if not (long or sort or as_json):
+        for name, path in find_environment_folders(path=path, session=session):
+            base = inspect_environment(path, session=session).base
+            layered = f' (base: {click.style(os.path.basename(base), fg="yellow")})' if base else ''
+            print(f'Found {click.style(name, fg="yellow")} under: {click.style(path, fg="yellow")}{layered}')
+        return
+    details = _collect_details(path, workers=workers, session=session)
+    if sort:
+        details.sort(key=SORT_KEYS[sort])
+    if as_json:
+        print(json.dumps([item._asdict() for item in details], indent=2))
+        return
+    _show_details(details)
+
+
+def show_results(results):
+    """Shows a summary table of exit codes and durations
+
+    Args:
+        results (Iterable[CommandResult]): results from enter_many
+    """
+    results = list(results)
+    width = max([len(r.name) for r in results] + [len('Environment')])
+    support.echo(click.style(f'{"Environment":<{width}}  {"Status":<6}  {"Exit":>4}  {"Duration":>9}', fg='blue'))
+    for result in results:
+        rc_color = 'green' if result.returncode == 0 else 'red'
+        status = click.style(f'{"pass" if result.returncode == 0 else "fail":<6}', fg=rc_color)
+        rc = click.style(f'{result.returncode:>4}', fg=rc_color)
+        support.echo(f'{result.name:<{width}}  {status}  {rc}  {result.duration:>8.2f}s')
+
+
+def show_startup(report, as_json=None, limit=None):
+    """Shows a startup report, costliest first
+
+    Args:
+        report (vsh.doctor.StartupReport): result of diagnose_startup
+        as_json (bool, optional): show the whole report as json [default: False]
+        limit (int, optional): modules shown [default: 15]
+    """
+    if as_json:
+        data = {
+            'python': report.python,
+            'runs': report.runs,
+            'wall': report.wall,
+            'modules': [module._asdict() for module in report.modules],
+            'pth_lines': [dict(line._asdict(), expensive=line.seconds >= doctor.PTH_THRESHOLD) for line in report.pth_lines],
+            'customize': report.customize,
+            }
+        support.echo(json.dumps(data, indent=2))
+        return
+    support.echo(click.style('Startup ', fg='blue') + f'{report.wall * 1000:.1f}ms (median of {report.runs}): ' + click.style(report.python, fg='green'))
+    support.echo(click.style(f'{"Self ms":>9}  {"Total ms":>9}  Module', fg='blue'))
+    for module in report.modules[:limit or 15]:
+        support.echo(f'{module.self / 1000:>9.2f}  {module.cumulative / 1000:>9.2f}  {"  " * module.depth}{module.name}')
+    for line in report.pth_lines:
+        color = 'red' if line.seconds >= doctor.PTH_THRESHOLD else 'green'
+        support.echo(click.style(f'{line.seconds * 1000:>9.2f}ms', fg=color) + f'  {os.path.basename(line.file)}: {line.line}')
+    for name, found in sorted(report.customize.items()):
+        cumulative = '' if found['cumulative'] is None else f' ({found["cumulative"] / 1000:.2f}ms)'
+        support.echo(click.style(f'{name}', fg='yellow') + f'{cumulative}: {found["path"]}')
 
 
 def show_version():
     support.echo(f"{package_metadata['name']} {package_metadata['version']}")
 
 
-def validate_environment(path, check=None):
+def stream(path, command=None, timeout=None, max_lines=None, session=None):
+    """Streams the output of a command run within a virtual environment
+
+    Example:
+        async for stream_name, line in api.stream(path, 'pytest'):
+            ...
+
+    Args:
+        path (str): path to virtual environment
+        command (tuple|list|str): command to run in virtual env
+        timeout (float, optional): seconds before the command is killed
+        max_lines (int, optional): lines queued before reading pauses [default: 1024]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        OutputStream: async iterator of (stream name, line)
+    """
+    return OutputStream(path, command, timeout=timeout, max_lines=max_lines, session=session)
+
+
+def sync(path, requirements, offline=None, workers=None, precompile=None, verbose=None, dry_run=None, session=None):
+    """Makes a virtual environment hold exactly the pins of a requirements file
+
+    Installed distributions are read from their dist-info metadata,
+    without pip, and only the difference is applied: missing and changed
+    pins are installed (see install) and distributions not pinned are
+    removed.  Afterwards a marker named by the file's content hash makes
+    the next sync, when nothing changed, a single stat.  Installing with
+    vsh drops the marker; changes made with pip directly are not seen
+    until the file changes.
+
+    Args:
+        path (str): path to virtual environment
+        requirements (str): requirements or lock file, every requirement pinned with ==
+        offline (bool, optional): install only from the wheelhouse [default: session.offline]
+        workers (int, optional): wheels installed at once
+        precompile (str, optional): compile site-packages after changes with this invalidation mode [default: session.precompile]
+        verbose (int, optional): more output [default: 0]
+        dry_run (bool, optional): only show the difference
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Raises:
+        UnpinnedRequirementError: when a requirement isn't pinned with ==
+        WheelsMissingError: when offline and the wheelhouse lacks a requirement
+        HashMismatchError: when a locked wheel doesn't match its hashes
+        subprocess.CalledProcessError: when pip fails
+
+    Returns:
+        SyncDelta: names of the distributions added, changed and removed
+    """
+    session = session or get_session()
+    verbose = max(int(verbose or 0), 0)
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    name = os.path.basename(path)
+    offline = session.offline if offline is None else offline
+    with open(requirements, 'rb') as stream:
+        marker = os.path.join(path, SYNC_MARKER, hashlib.sha256(stream.read()).hexdigest())
+    if os.path.exists(marker):
+        support.echo(click.style('Up to date: ', fg='blue') + click.style(name, fg='yellow'), verbose=verbose)
+        return SyncDelta([], [], [])
+    pins, lines = installer.read_lock(requirements)
+    options = [line for line in lines if line.startswith('-') and not line.startswith(SYNC_UNSUPPORTED)]
+    # Pins with environment markers are left to pip, which evaluates them
+    marked = {}
+    unpinned = []
+    for line in lines:
+        if line in options:
+            continue
+        found = re.match(r'(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*==\s*(?P<version>[^\s;]+)\s*;', line)
+        if found:
+            marked[dists.normalize(found.group('name'))] = (found.group('version'), line)
+        else:
+            unpinned.append(line)
+    if unpinned:
+        raise UnpinnedRequirementError(requirements=', '.join(unpinned))
+    installed = dists.installed(_site_packages(path))
+    pinned = {pin.name for pin in pins}
+    add = [pin for pin in pins if pin.name not in installed]
+    change = [pin for pin in pins if pin.name in installed and installed[pin.name].version != pin.version]
+    marked_lines = [line for key, (version, line) in marked.items() if key not in installed or installed[key].version != version]
+    remove = sorted(key for key in installed if key not in pinned and key not in marked and key not in PACKAGING_TOOLS)
+    delta = SyncDelta(sorted(pin.name for pin in add), sorted(pin.name for pin in change), remove)
+    if dry_run:
+        for sign, color, names in [('+', 'green', delta.add), ('~', 'yellow', delta.change), ('-', 'red', delta.remove)]:
+            for key in names:
+                support.echo(click.style(f'{sign} {key}', fg=color))
+        return delta
+    if offline and (add or change or marked_lines):
+        # Fails before anything is removed
+        _check_wheels(path, add + change, options + marked_lines, session)
+    _unpack_before_install(path, verbose=verbose, session=session)
+    for key in remove:
+        installer.uninstall(installed[key].path, os.path.dirname(installed[key].path))
+    precompile = _precompile_mode(session.precompile if precompile is None else precompile, path)
+    if add or change or marked_lines:
+        _install_pins(path, add + change, options + marked_lines, offline=offline, workers=workers, verbose=verbose, session=session,
+                      compile=not precompile)
+        if precompile:
+            _precompile(path, precompile, verbose=verbose, session=session)
+    if add or change or remove or marked_lines:
+        _refresh_module_index(path, verbose=verbose, session=session)
+    _forget_sync(path)
+    os.makedirs(os.path.dirname(marker))
+    with open(marker, 'w'):
+        pass
+    session.forget(os.path.dirname(path))
+    summary = f'+{len(delta.add)} ~{len(delta.change)} -{len(delta.remove)}'
+    support.echo(click.style('Synced ', fg='blue') + click.style(name, fg='yellow') + f': {summary}', verbose=verbose)
+    return delta
+
+
+def unpack(path, verbose=None, session=None):
+    """Extracts the packages pack zipped back into a virtual environment's site-packages
+
+    Args:
+        path (str): path to virtual environment
+        verbose (int, optional): more output [default: 0]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        List[str]: names unpacked
+    """
+    session = session or get_session()
+    path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
+    names = [name for folder in _site_packages(path) for name in packing.unpack(folder)]
+    support.echo(click.style('Unpacked ', fg='blue') + f'{len(names)} packages in ' + click.style(os.path.basename(path), fg='yellow'), verbose=verbose)
+    if names:
+        _refresh_module_index(path, verbose=verbose, session=session)
+    return names
+
+
+def validate_environment(path, check=None, session=None):
     """Validates if path is a virtual environment
 
     Args:
         path (str): path to virtual environment
         check (bool, optional): Raise an error if path isn't valid
+        session (Vsh, optional): session settings [default: get_session()]
 
     Raises:
         InvalidEnvironmentError: when environment is not valid
@@ -342,59 +1486,316 @@ def validate_environment(path, check=None):
     Returns:
         bool: True if valid virtual environment path
     """
-    path = Path(path)
-    valid = None
-    win32 = sys.platform == 'win32'
-    # Expected structure
-    structure = {
-        'bin': 'Scripts' if win32 else 'bin',
-        'include': 'Include' if win32 else 'include',
-        'lib': os.path.join('Lib', 'site-packages') if win32 else os.path.join('lib', '*', 'site-packages'),
-        }
-    paths = {}
-    for identifier, expected_path in structure.items():
-        for p in path.glob(expected_path):
-            # There should only be one path that matches the glob
-            paths[identifier] = p
-            break
-    for identifier in structure:
-        if identifier not in paths:
-            valid = False
-            if check:
-                raise InvalidEnvironmentError(f'Could not find {structure[identifier]} under {path}.')
-
-    if valid is not False and win32:
-        # TODO: Add more validation for windows environments
-        valid = valid is not False and True
-    elif valid is not False:
-        # check for activation scripts
-        activation_scripts = list(paths['bin'].glob('activate.*'))
-        valid = valid is not False and len(activation_scripts) > 0
-        if check and valid is False:
-            raise InvalidEnvironmentError(f'Could not find activation scripts under {path}.')
-
-        # check for python binaries
-        python_name = paths['lib'].parent.name
-        python_ver_data = re.search('(?P<interpreter>python|pypy)\.?(?P<major>\d+)(\.?(?P<minor>\d+))', python_name)
-        if python_ver_data:
-            python_ver_data = python_ver_data.groupdict()
-            python_executable = paths['bin'].joinpath('python')
-            python_ver_executable = paths['bin'].joinpath(python_name)
-            if python_executable.exists():
-                valid = valid is not False and True
-            if check and valid is False:
-                raise InvalidEnvironmentError(f'Could not find python executable under {path}.')
-            if python_ver_executable.exists():
-                valid = valid is not False and True
-            if check and valid is False:
-                raise InvalidEnvironmentError(f'Could not find {python_name} executable under {path}.')
-
-    return valid
+    status = inspect_environment(path, session=session)
+    if check and not status.valid:
+        raise InvalidEnvironmentError(status.reason)
+    return status.valid
 
 
 # ----------------------------------------------------------------------
 # Support
 # ----------------------------------------------------------------------
+def _build_command(path, command=None, interactive=None, session=None):
+    """Builds the shell command and environment used to run within a venv
+
+    Args:
+        path (str): path to virtual environment
+        command (tuple|list|str, optional): command to run in virtual env [default: shell]
+        interactive (bool, optional): run bash and zsh as interactive shells [default: True]
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        Tuple[str, dict, str]: command, environment and displayable command
+    """
+    session = session or get_session()
+    interactive = True if interactive is None else interactive
+    shell = session.shell or '/bin/sh'
+    command = command or shell
+    env = _update_environment(path, session=session)
+
+    # Setup the environment scripts
+    vshell_config_commands = '; '.join(f'source {filepath}' for filepath in find_vsh_config_files(path, session=session))
+    if not isinstance(command, str):
+        command = " ".join(command)
+    if vshell_config_commands:
+        command = f'{vshell_config_commands}; {command}'
+    cmd_display = click.style(command, fg='green')
+    if Path(shell).name in ['bash', 'zsh']:
+        flags = '-i -c' if interactive else '-c'
+        command = f'{shell} {flags} {shlex.quote(command)}'
+        cmd_display = f'{shell} {flags} {shlex.quote(cmd_display)}'
+    return command, env, cmd_display
+
+
+async def _enter_many(paths, command, workers, collect, timeout, verbose, session=None):
+    semaphore = asyncio.Semaphore(workers)
+    width = max([len(os.path.basename(p)) for p in paths] or [0])
+    tasks = [
+        _run_in_environment(path, command, semaphore, width=width, collect=collect, timeout=timeout, verbose=verbose, session=session)
+        for path in paths
+        ]
+    return await asyncio.gather(*tasks)
+
+
+async def _iter_lines(stream, limit=None):
+    """Yields decoded lines from an asyncio stream without unbounded buffering"""
+    limit = limit or 2 ** 16
+    buffer = b''
+    while True:
+        chunk = await stream.read(limit)
+        if not chunk:
+            break
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8', errors='replace')
+        if len(buffer) >= limit:
+            # Overly long line; hand it back in pieces
+            yield buffer.decode('utf-8', errors='replace')
+            buffer = b''
+    if buffer:
+        yield buffer.decode('utf-8', errors='replace')
+
+
+def _foreground():
+    """Tells whether this process group has the terminal on stdin"""
+    try:
+        return sys.platform != 'win32' and os.tcgetpgrp(0) == os.getpgrp()
+    except OSError:
+        return False
+
+
+def _kill(process):
+    """Kills a process started in its own session or process group along with its children"""
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def _own_group():
+    """Moves a starting command to a process group of its own
+
+    Runs in the child before exec.  The group is handed the terminal
+    when the caller had it, so interactive shells keep job control.
+    """
+    foreground = _foreground()
+    os.setpgid(0, 0)
+    if foreground:
+        _set_foreground(os.getpgrp())
+
+
+def _set_foreground(group):
+    """Hands the terminal on stdin to a process group"""
+    # Blocked, SIGTTOU doesn't stop a background group taking the terminal back
+    blocked = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGTTOU])
+    try:
+        os.tcsetpgrp(0, group)
+    except OSError:
+        pass
+    finally:
+        signal.pthread_sigmask(signal.SIG_SETMASK, blocked)
+
+
+async def _run(path, command, on_line, timeout=None, session=None):
+    """Runs a command within a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+        command (tuple|list|str): command to run in virtual env
+        on_line (Callable): called with (stream name, line); may return an awaitable.  When
+            None, output is inherited
+        timeout (float, optional): seconds before the command is killed
+        session (Vsh, optional): session settings [default: get_session()]
+
+    Returns:
+        CommandResult: return code and duration
+    """
+    cmd, env, _ = _build_command(path, command, interactive=False, session=session)
+    pipe = None if on_line is None else subprocess.PIPE
+
+    async def pump(stream, stream_name):
+        if stream is None:
+            return
+        async for line in _iter_lines(stream):
+            pending = on_line(stream_name, line)
+            if pending is not None:
+                await pending
+
+    start = time.monotonic()
+    process = await asyncio.create_subprocess_shell(
+        cmd, env=env, stdin=subprocess.DEVNULL, stdout=pipe, stderr=pipe, start_new_session=True)
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.gather(pump(process.stdout, 'stdout'), pump(process.stderr, 'stderr'), process.wait()), timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+        _kill(process)
+        await process.wait()
+    except asyncio.CancelledError:
+        _kill(process)
+        raise
+    return CommandResult(path, args=cmd, returncode=process.returncode, duration=time.monotonic() - start, timed_out=timed_out)
+
+
+async def _run_in_environment(path, command, semaphore, width=None, collect=None, timeout=None, verbose=None, session=None):
+    name = os.path.basename(path)
+    prefix = click.style(f'[{name:<{width or len(name)}}]', fg='yellow')
+    buffers = {'stdout': _OutputBuffer(), 'stderr': _OutputBuffer()}
+    files = {'stdout': sys.stdout, 'stderr': sys.stderr}
+
+    def on_line(stream_name, line):
+        if collect:
+            buffers[stream_name].append(line)
+        else:
+            support.echo(f'{prefix} {line}', file=files[stream_name], flush=True)
+
+    async with semaphore:
+        support.echo(f'{prefix} ' + click.style('Running: ', fg='blue') + click.style(str(command), fg='green'), verbose=max(verbose - 1, 0))
+        result = await _run(path, command, on_line=on_line, timeout=timeout, session=session)
+
+    if collect:
+        result.stdout = buffers['stdout'].getvalue()
+        result.stderr = buffers['stderr'].getvalue()
+        result.truncated = any(b.truncated for b in buffers.values())
+        support.echo(click.style(f'==> {name} <==', fg='yellow'))
+        if result.stdout:
+            support.echo(result.stdout)
+        if result.stderr:
+            support.echo(result.stderr, file=sys.stderr)
+    return result
+
+
+class _OutputBuffer:
+    """Keeps the tail of a stream's output, bounded by size in characters"""
+
+    def __init__(self, limit=None):
+        self.limit = MAX_OUTPUT if limit is None else limit
+        self.lines = collections.deque()
+        self.size = 0
+        self.truncated = False
+
+    def append(self, line):
+        self.lines.append(line)
+        self.size += len(line) + 1
+        while self.size > self.limit and self.lines:
+            self.size -= len(self.lines.popleft()) + 1
+            self.truncated = True
+
+    def getvalue(self):
+        return '\n'.join(self.lines)
+
+
+def _collect_details(path=None, workers=None, session=None):
+    """Returns the details of every environment found, measuring stale
+    entries on a thread pool and saving them to each index at once"""
+    session = session or get_session()
+    found = list(find_environment_folders(path=path, session=session))
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or session.scan_workers) as executor:
+        details = list(executor.map(lambda item: _environment_details(*item, session=session, save=False), found))
+    updates = collections.defaultdict(dict)
+    for item, update in details:
+        if update:
+            updates[session.index(item.path)][item.path] = update
+    for index, entries in updates.items():
+        try:
+            index.update_many(entries)
+        except OSError:
+            pass
+    return [item for item, _ in details]
+
+
+def _environment_details(name, path, session=None, save=True):
+    """Returns the details of an environment and any fields measured
+    afresh because the index was missing or stale"""
+    session = session or get_session()
+    index = session.index(path)
+    entry = index.get(path)
+    status = inspect_environment(path, session=session)
+    stamp = _details_stamp(path)
+    update = None
+    if entry.get('stamp') != stamp or 'size' not in entry:
+        update = {'stamp': stamp, 'size': _disk_usage(path), 'packages': _count_packages(path)}
+        entry.update(update)
+        if save:
+            try:
+                index.update(path, **update)
+            except OSError:
+                pass
+    details = EnvironmentDetails(name, path, status.version, entry['size'], entry['packages'], entry.get('last_used'), status.base)
+    return details, update
+
+
+def _dependents(path, session=None):
+    """Returns the names of environments layered on the environment at path"""
+    return sorted(
+        name for name, found in find_environment_folders(session=session)
+        if found != path and inspect_environment(found, session=session).base == path
+        )
+
+
+def _details_stamp(path):
+    """Returns the mtimes which invalidate indexed sizes and package counts"""
+    stamp = []
+    for folder in [path] + _site_packages(path):
+        try:
+            stamp.append(os.stat(folder).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return stamp
+
+
+def _disk_usage(path):
+    """Returns the bytes allocated to a folder tree, counting hard linked
+    files once and never following symlinks"""
+    total = 0
+    seen = set()
+    folders = [path]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    try:
+                        stat = entry.stat(follow_symlinks=False)
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                    except OSError:
+                        continue
+                    if stat.st_nlink > 1 and not entry.is_dir(follow_symlinks=False):
+                        if (stat.st_dev, stat.st_ino) in seen:
+                            continue
+                        seen.add((stat.st_dev, stat.st_ino))
+                    blocks = getattr(stat, 'st_blocks', None)
+                    total += blocks * 512 if blocks is not None else stat.st_size
+        except OSError:
+            continue
+    return total
+
+
+def _count_packages(path):
+    """Returns the number of distributions installed in an environment"""
+    count = 0
+    for folder in _site_packages(path):
+        try:
+            with os.scandir(folder) as entries:
+                count += sum(1 for entry in entries if entry.name.endswith(('.dist-info', '.egg-info')))
+        except OSError:
+            pass
+    return count
+
+
+def _environment_stamp(path):
+    """Returns the mtimes which invalidate a cached EnvironmentStatus, pyvenv.cfg's included as layering appends to it"""
+    win32 = sys.platform == 'win32'
+    stamp = []
+    for folder in ['', 'Scripts' if win32 else 'bin', 'Lib' if win32 else 'lib', 'pyvenv.cfg']:
+        try:
+            stamp.append(os.stat(os.path.join(path, folder)).st_mtime_ns)
+        except OSError:
+            stamp.append(None)
+    return tuple(stamp)
+
+
 def _escape_zero_length_codes(prompt=None):
     # This is necessary because bash does something funky with PS1 and
     #  doesn't correctly calculate the length of the command-line.  When
@@ -407,7 +1808,7 @@ def _escape_zero_length_codes(prompt=None):
     replacement = r'\[\1\]'
 
     eng = re.compile(pattern)
-    prompt = prompt or os.getenv('PS1') or os.getenv('PROMPT')
+    prompt = prompt or get_session().prompt
     if prompt:
         prompt = eng.sub(replacement, prompt)
     else:
@@ -415,7 +1816,26 @@ def _escape_zero_length_codes(prompt=None):
     return prompt
 
 
-def _get_builder(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None):
+def _forget_pycache(path, reap=None, session=None):
+    """Moves the bytecode cache of a removed prefix environment to the trash"""
+    prefix = bytecode.cache_prefix(path, session.cache_dir)
+    if not os.path.isdir(prefix):
+        return
+    try:
+        trash_folder = trash.move_to_trash(prefix)
+    except OSError:
+        trash.rmtree(prefix, ignore_errors=True)
+    else:
+        if reap is None or reap:
+            trash.reap_later([trash_folder])
+
+
+def _forget_sync(path):
+    """Drops the marker of the last sync; see sync"""
+    trash.rmtree(os.path.join(path, SYNC_MARKER), ignore_errors=True)
+
+
+def _get_builder(path, site_packages=None, overwrite=None, symlinks=None, upgrade=None, include_pip=None, prompt=None, precompile=None):
     path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
     name = os.path.basename(path)
     builder = VenvBuilder(
@@ -425,11 +1845,12 @@ def _get_builder(path, site_packages=None, overwrite=None, symlinks=None, upgrad
         upgrade=False if upgrade is None else upgrade,
         with_pip=True if include_pip is None else include_pip,
         prompt=f'({name})' if prompt is None else prompt,
+        precompile=precompile,
         )
     return builder
 
 
-def _get_interpreter(python=None):
+def _get_interpreter(python=None, session=None):
     """Returns the interpreter given the string"""
     if python is None:
         return sys.executable
@@ -438,8 +1859,13 @@ def _get_interpreter(python=None):
     if Path(python).exists():
         return python
 
-    # Guess path
-    paths = [Path(path) for path in os.getenv('PATH').split(':')]
+    session = session or get_session()
+    return session.interpreter(python, _find_interpreter)
+
+
+def _find_interpreter(python, search_path):
+    """Searches for python on search_path"""
+    paths = [Path(path) for path in search_path if path]
 
     # Assume that python is a version if it doesn't start with p
     python = f'python{python}' if not python.startswith('p') else python
@@ -453,16 +1879,462 @@ def _get_interpreter(python=None):
             return path
 
 
-def _update_environment(path):
+def _inspect_environment(path):
+    """Checks the fixed layout of a virtual environment; see inspect_environment"""
+    win32 = sys.platform == 'win32'
+    bin_path = os.path.join(path, 'Scripts' if win32 else 'bin')
+    include_path = os.path.join(path, 'Include' if win32 else 'include')
+    lib_path = os.path.join(path, 'Lib' if win32 else 'lib')
+
+    base = None
+
+    def invalid(reason, version=None):
+        return EnvironmentStatus(path, False, version, reason, base)
+
+    if not os.path.isdir(path):
+        return invalid(f'Could not find {path}.')
+    config = _read_pyvenv_cfg(path)
+    version = config.get('version') or config.get('version_info')
+    base = config.get('vsh-base')
+    try:
+        bin_names = set(os.listdir(bin_path))
+    except OSError:
+        return invalid(f'Could not find {os.path.basename(bin_path)} under {path}.', version)
+    if not os.path.isdir(include_path):
+        return invalid(f'Could not find {os.path.basename(include_path)} under {path}.', version)
+
+    if win32:
+        # TODO: Add more validation for windows environments
+        if not os.path.isdir(os.path.join(lib_path, 'site-packages')):
+            return invalid(f'Could not find {os.path.join("Lib", "site-packages")} under {path}.', version)
+        return EnvironmentStatus(path, True, version, None, base)
+
+    # Find lib/<python>/site-packages; pyvenv.cfg names it directly
+    lib_names = []
+    if version:
+        lib_names.append('python' + '.'.join(version.split('.')[:2]))
+    site_packages = None
+    for lib_name in lib_names:
+        if os.path.isdir(os.path.join(lib_path, lib_name, 'site-packages')):
+            site_packages = lib_name
+            break
+    else:
+        try:
+            with os.scandir(lib_path) as entries:
+                for entry in entries:
+                    if entry.is_dir() and os.path.isdir(os.path.join(entry.path, 'site-packages')):
+                        site_packages = entry.name
+                        break
+        except OSError:
+            pass
+    if site_packages is None:
+        return invalid(f'Could not find {os.path.join("lib", "*", "site-packages")} under {path}.', version)
+    if not version:
+        found = re.fullmatch(r'(python|pypy)(?P<version>\d+(\.\d+)*)', site_packages)
+        version = found.group('version') if found else None
+
+    # check for activation scripts
+    if not any(name.startswith('activate.') for name in bin_names):
+        return invalid(f'Could not find activation scripts under {path}.', version)
+
+    # check for python binaries
+    if 'python' not in bin_names:
+        return invalid(f'Could not find python executable under {path}.', version)
+
+    return EnvironmentStatus(path, True, version, None, base)
+
+
+def _interpreter_suffix(python):
+    """Returns an environment name suffix for an interpreter, e.g. 3.11 -> py311"""
+    name = Path(python).name
+    found = re.fullmatch(r'(?P<impl>python|pypy|py)?(?P<version>\d+(\.\d+)*)', name)
+    if not found:
+        return re.sub(r'[^\w.-]+', '-', name)
+    impl = 'pypy' if found.group('impl') == 'pypy' else 'py'
+    return impl + found.group('version').replace('.', '')
+
+
+def _match_name(name, pattern):
+    """Matches name against a glob, falling back to a regular expression"""
+    if fnmatch.fnmatchcase(name, pattern):
+        return True
+    try:
+        return re.fullmatch(pattern, name) is not None
+    except re.error:
+        return False
+
+
+def _output_handler(capture, max_output=None):
+    """Returns the line handler for a capture mode and a function which
+    stores any captured output on the CommandResult"""
+    buffers = {'stdout': _OutputBuffer(max_output), 'stderr': _OutputBuffer(max_output)}
+
+    def on_line(stream_name, line):
+        if capture == CAPTURE:
+            buffers[stream_name].append(line)
+        else:
+            return capture(stream_name, line)
+
+    def finish(result):
+        if capture == CAPTURE:
+            result.stdout = buffers['stdout'].getvalue()
+            result.stderr = buffers['stderr'].getvalue()
+            result.truncated = any(b.truncated for b in buffers.values())
+        return result
+
+    return on_line, finish
+
+
+def _record_use(path, session=None):
+    """Records the time an environment was last used in the session's index"""
+    session = session or get_session()
+    try:
+        session.index(path).append(path, last_used=time.time())
+    except OSError:
+        pass
+
+
+def _read_pyvenv_cfg(path):
+    """Reads the key = value pairs of an environment's pyvenv.cfg"""
+    config = {}
+    try:
+        with open(os.path.join(path, 'pyvenv.cfg')) as stream:
+            for line in stream:
+                key, sep, value = line.partition('=')
+                if sep:
+                    config[key.strip().lower()] = value.strip()
+    except OSError:
+        pass
+    return config
+
+
+def _iter_concurrently(sources, timeout=None):
+    """Iterates several sources at once, each on its own daemon thread
+
+    Items are yielded as they arrive.  Sources still running when
+    timeout expires are abandoned with a warning; their threads are left
+    to finish in the background so a hung filesystem can't block exit.
+
+    Args:
+        sources (Dict[str, Callable]): label and a callable returning an iterable
+        timeout (float, optional): seconds to wait before abandoning sources
+
+    Yields:
+        Tuple[str, Any]: label and item
+    """
+    results = queue.Queue()
+    done = object()
+
+    def run(label, source):
+        try:
+            for item in source():
+                results.put((label, item))
+        except Exception as error:
+            support.echo(click.style(f'WARNING: {label}: {error}', fg='red'), file=sys.stderr)
+        finally:
+            results.put((label, done))
+
+    running = set(sources)
+    for label, source in sources.items():
+        threading.Thread(target=run, args=(label, source), daemon=True).start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while running:
+        remaining = None if deadline is None else max(deadline - time.monotonic(), 0)
+        try:
+            label, item = results.get(timeout=remaining)
+        except queue.Empty:
+            for label in sorted(running):
+                support.echo(click.style(f'WARNING: Timed out after {timeout}s searching: {label}', fg='red'), file=sys.stderr)
+            return
+        if item is done:
+            running.discard(label)
+        else:
+            yield label, item
+
+
+def _layer(path, base, session=None):
+    """Chains the site-packages of a new environment to those of base
+
+    The .pth runs site.addsitedir, so the base's own .pth files (and its
+    base, if layered) are processed too, while packages in the new
+    environment still take precedence.
+    """
+    version = inspect_environment(path, session=session).version or ''
+    base_version = inspect_environment(base, session=session).version or ''
+    if version.split('.')[:2] != base_version.split('.')[:2]:
+        trash.rmtree(path)
+        raise BaseMismatchError(path=base, base_version=base_version, version=version)
+    lines = [f'import site; site.addsitedir({folder!r})' for folder in _site_packages(base)]
+    if sys.platform == 'win32':
+        folder = os.path.join(path, 'Lib', 'site-packages')
+    else:
+        folder = os.path.join(path, 'lib', 'python' + '.'.join(version.split('.')[:2]), 'site-packages')
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, BASE_PTH), 'w') as stream:
+        stream.write('\n'.join(lines) + '\n')
+    with open(os.path.join(path, 'pyvenv.cfg'), 'a') as stream:
+        stream.write(f'vsh-base = {base}\n')
+
+
+def _list_folder_names(path, ignore=()):
+    """Yields the names of folders in path which could be environments, skipping hidden and ignored ones"""
+    standard_path = ['include', 'lib', 'bin']
+    try:
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if entry.name.startswith('.') or any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in ignore):
+                    continue
+                if entry.is_dir() and Path(entry.path).stem not in standard_path:
+                    yield Path(entry.path).stem
+    except OSError:
+        return
+
+
+def _valid_paths(path, session):
+    """Yields path when it is a valid environment"""
+    if validate_environment(path, session=session):
+        yield path
+
+
+def _scan_environment_folders(path, searched, max_depth=None, ignore=None, workers=None, session=None):
+    """Scans path for virtual environments, spreading folders across a
+    thread pool; see find_environment_folders.
+
+    Args:
+        path (str): path to search
+        searched (list): receives the folder and mtime of each folder searched
+
+    Yields:
+        Tuple[str, str]: name and path of each environment found
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {executor.submit(_scan_folder, path, ignore, session): 1}
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                depth = pending.pop(future)
+                folder, mtime, found, folders = future.result()
+                if mtime is None:
+                    continue
+                searched.append((folder, mtime))
+                yield from found
+                if max_depth is None or depth < max_depth:
+                    for subfolder in folders:
+                        pending[executor.submit(_scan_folder, subfolder, ignore, session)] = depth + 1
+
+
+def _scan_folder(folder, ignore, session):
+    """Lists one folder, validating each child folder as an environment
+
+    Returns:
+        Tuple[str, int, list, list]: folder, its mtime (None if unreadable),
+            environments found and folders to search next
+    """
+    found = []
+    folders = []
+    try:
+        mtime = os.stat(folder).st_mtime_ns
+        with os.scandir(folder) as iterator:
+            entries = list(iterator)
+    except OSError:
+        return folder, None, found, folders
+    for entry in entries:
+        try:
+            if not entry.is_dir():
+                continue
+        except OSError:
+            continue
+        if any(fnmatch.fnmatchcase(entry.name, pattern) for pattern in ignore):
+            continue
+        if validate_environment(entry.path, session=session):
+            found.append((entry.name, entry.path))
+        elif not entry.is_symlink():
+            folders.append(entry.path)
+    return folder, mtime, found, folders
+
+
+def _show_details(details):
+    """Prints a table of EnvironmentDetails"""
+    now = time.time()
+    rows = [
+        (d.name, d.version or '?', os.path.basename(d.base) if d.base else '-', str(d.packages), _format_size(d.size), _format_age(d.last_used, now), d.path)
+        for d in details
+        ]
+    header = ('Environment', 'Python', 'Base', 'Packages', 'Size', 'Last used', 'Path')
+    widths = [max(len(row[i]) for row in rows + [header]) for i in range(len(header))]
+    aligns = ['<', '<', '<', '>', '>', '>', '<']
+
+    def line(row):
+        return '  '.join(f'{cell:{align}{width}}' for cell, align, width in zip(row, aligns, widths)).rstrip()
+
+    support.echo(click.style(line(header), fg='blue'))
+    for row in rows:
+        support.echo(line(row))
+
+
+def _format_age(timestamp, now=None):
+    """Formats the time since timestamp, e.g. 3h ago"""
+    if not timestamp:
+        return 'never'
+    seconds = max((now or time.time()) - timestamp, 0)
+    for unit, size in [('d', 86400), ('h', 3600), ('m', 60)]:
+        if seconds >= size:
+            return f'{int(seconds // size)}{unit} ago'
+    return 'just now'
+
+
+def _last_activity(details):
+    """Returns when an environment was last used, or else last modified"""
+    if details.last_used:
+        return details.last_used
+    try:
+        return os.stat(details.path).st_mtime
+    except OSError:
+        return 0
+
+
+def _parse_duration(value):
+    """Parses seconds from a number or a duration such as 30d, 12h, 90m or 2w
+
+    A number without a unit is seconds, whether given as a number or a string.
+    """
+    if isinstance(value, (int, float)):
+        return float(value)
+    found = re.fullmatch(r'\s*(?P<number>\d+(\.\d*)?)\s*(?P<unit>[smhdw]?)\s*', str(value).lower())
+    if not found:
+        raise ValueError(f'Invalid duration: {value!r}')
+    seconds = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}[found.group('unit')]
+    return float(found.group('number')) * seconds
+
+
+def _parse_size(value):
+    """Parses bytes from a number or a size such as 500M or 20G"""
+    if isinstance(value, (int, float)):
+        return int(value)
+    found = re.fullmatch(r'\s*(?P<number>\d+(\.\d*)?)\s*(?P<unit>[bkmgt]?)i?b?\s*', str(value).lower())
+    if not found:
+        raise ValueError(f'Invalid size: {value!r}')
+    return int(float(found.group('number')) * 1024 ** 'bkmgt'.index(found.group('unit') or 'b'))
+
+
+def _format_size(size):
+    """Formats a byte count, e.g. 12.3M"""
+    if size < 1024:
+        return f'{size}B'
+    for unit in ['K', 'M', 'G', 'T']:
+        size /= 1024
+        if size < 1024 or unit == 'T':
+            return f'{size:.1f}{unit}'
+
+
+def _check_wheels(path, pins, lines, session):
+    """Raises WheelsMissingError unless the wheelhouse can install pins and lines offline"""
+    _, leftover = installer.plan(pins, session.wheelhouse, installer.environment_version(path) or '')
+    leftover = [pin.line for pin in leftover] + [line for line in lines if not line.startswith('-')]
+    wheelhouse.install_args(session.wheelhouse, leftover, offline=True)
+
+
+def _install_pins(path, pins, lines, offline, workers, verbose, session, compile=True):
+    """Unpacks pins whose wheel is in the wheelhouse and hands the rest, with lines, to pip"""
+    wheels, leftover = installer.plan(pins, session.wheelhouse, installer.environment_version(path) or '')
+    leftover = [pin.line for pin in leftover] + [line for line in lines if not line.startswith('-')]
+    options = [line for line in lines if line.startswith('-')]
+    if offline:
+        # Fails fast, before anything is installed
+        wheelhouse.install_args(session.wheelhouse, leftover, offline=offline)
+    start = time.monotonic()
+    installed = installer.install(wheels, path, workers=workers)
+    support.echo(click.style('Unpacked ', fg='blue') + f'{len(installed)} wheels in {time.monotonic() - start:.2f}s', verbose=max(verbose - 1, 0))
+    if leftover:
+        with tempfile.NamedTemporaryFile('w', prefix='vsh-lock-', suffix='.txt') as stream:
+            stream.write('\n'.join(options + leftover) + '\n')
+            stream.flush()
+            _pip_install(path, stream.name, leftover, offline, verbose, session, compile=compile)
+
+
+def _pip_install(path, requirements_file, requirements, offline, verbose, session, compile=True, constraints=None):
+    """Runs the environment's pip on a requirements file, preferring the wheelhouse"""
+    args = wheelhouse.install_args(session.wheelhouse, requirements, offline=offline, constraints=constraints)
+    python = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+    quiet = [] if verbose > 1 else ['--quiet']
+    # Left to a parallel precompile instead
+    no_compile = [] if compile else ['--no-compile']
+    subprocess.run([python, '-m', 'pip', 'install', '--disable-pip-version-check', *quiet, *no_compile, *args, '-r', requirements_file], check=True)
+
+
+def _precompile(path, mode, workers=None, verbose=None, session=None):
+    """Compiles the site-packages of an environment, into its bytecode cache with the prefix policy, and shows the time taken"""
+    session = session or get_session()
+    python = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+    policy_environ = bytecode.policy_environ(path, session.cache_dir)
+    environ = dict(session.environ, **policy_environ) if policy_environ else None
+    compiled = bytecode.precompile(python, _site_packages(path), mode=mode, workers=workers, environ=environ)
+    _show_compiled(path, compiled, verbose)
+    return compiled
+
+
+def _precompile_mode(precompile, path=None):
+    """Returns the invalidation mode for a precompile setting, or None when off
+
+    Without a setting, an environment's bytecode policy may still call for one.
+    """
+    if precompile is True:
+        return bytecode.MODES[1]
+    if not precompile and path:
+        return bytecode.policy_mode(bytecode.read_policy(path))
+    return precompile or None
+
+
+def _show_compiled(path, compiled, verbose=None):
+    errors = '' if compiled.ok else click.style(' with errors', fg='red')
+    message = click.style('Precompiled ', fg='blue') + click.style(os.path.basename(path), fg='yellow')
+    support.echo(message + f' in {compiled.duration:.2f}s ({compiled.mode}){errors}', verbose=max(int(verbose or 0), 0))
+
+
+def _refresh_module_index(path, build=None, verbose=None, session=None):
+    """Rebuilds the module index of an environment which has one, or builds it, and shows the modules indexed"""
+    if not (build or imports.enabled(path)):
+        return 0
+    session = session or get_session()
+    count = imports.build(path, environ=_update_environment(path, session=session))
+    support.echo(click.style('Indexed ', fg='blue') + f'{count} modules in ' + click.style(os.path.basename(path), fg='yellow'), verbose=verbose)
+    return count
+
+
+def _site_packages(path):
+    """Returns the site-packages folders of an environment"""
+    if sys.platform == 'win32':
+        folders = [os.path.join(path, 'Lib', 'site-packages')]
+    else:
+        lib_path = os.path.join(path, 'lib')
+        try:
+            with os.scandir(lib_path) as entries:
+                folders = sorted(os.path.join(entry.path, 'site-packages') for entry in entries if entry.name.startswith(('python', 'pypy')))
+        except OSError:
+            folders = []
+    return [folder for folder in folders if os.path.isdir(folder)]
+
+
+def _unpack_before_install(path, verbose=None, session=None):
+    """Unpacks a packed environment, so installs replace its packages in place rather than shadow them"""
+    if any(packing.is_packed(folder) for folder in _site_packages(path)):
+        unpack(path, verbose=verbose, session=session)
+
+
+def _update_environment(path, session=None):
     """Updates environment similar to activate from venv"""
+    session = session or get_session()
     path = os.path.expanduser(path) if path.startswith('~') else os.path.abspath(path)
     name = os.path.basename(path)
 
-    env = {k: v for k, v in os.environ.items()}
+    env = {k: v for k, v in session.environ.items()}
     env[package_metadata['name'].upper()] = name
 
     env['VIRTUAL_ENV'] = path
-    env['PATH'] = ':'.join([os.path.join(env.get('VIRTUAL_ENV'), 'bin')] + env['PATH'].split(':'))
+    env.update(bytecode.policy_environ(path, session.cache_dir))
+    env['PATH'] = ':'.join([os.path.join(env.get('VIRTUAL_ENV'), 'bin')] + list(session.search_path))
+    if session.shell:
+        env['SHELL'] = session.shell
 
     shell = Path(env.get('SHELL') or '/bin/sh').name
     disable_prompt = env.get('VIRTUAL_ENV_DISABLE_PROMPT') or None
@@ -472,7 +2344,7 @@ def _update_environment(path):
         'zsh': 'PROMPT'
         }
     shell_prompt_var = shell_prompt_mapping.get(shell)
-    prompt = env.get(shell_prompt_var) or click.style("\w", fg="blue") + "\$ "
+    prompt = session.prompt or click.style(r"\w", fg="blue") + r"\$ "
     prompt = _escape_zero_length_codes(prompt) if shell in ['bash', 'sh'] else prompt
     if shell_prompt_var and not disable_prompt:
         env[shell_prompt_var] = prompt
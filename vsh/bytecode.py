@@ -0,0 +1,153 @@
+"""Bytecode precompilation and policy for virtual environments
+
+The first import of a module compiles it and writes a ``.pyc`` beside
+it, so the first run in a fresh environment pays for compiling
+everything it imports, and concurrent first runs race to write the same
+files.  Compiling site-packages up front moves that cost to create or
+install time.  ``compileall`` runs under the environment's own python,
+since bytecode is specific to the interpreter version, with one worker
+per cpu.
+
+Where writing ``__pycache__`` beside the sources is slow or impossible
+(read-only or network mounts, short lived environments), an environment
+may instead carry a bytecode policy, kept as ``vsh-bytecode`` in its
+``pyvenv.cfg`` and applied when entering it:
+
+- ``prefix``: bytecode goes to a local cache keyed by environment,
+  through ``PYTHONPYCACHEPREFIX``
+- ``none``: no bytecode is written (``PYTHONDONTWRITEBYTECODE``)
+- ``unchecked``: site-packages is precompiled with unchecked hashes, so
+  sources are never even stat'ed for freshness
+"""
+import collections
+import hashlib
+import os
+import subprocess
+import time
+
+__all__ = ('MODES', 'POLICIES', 'Compiled', 'cache_prefix', 'cache_root', 'policy_environ', 'policy_mode', 'precompile', 'read_policy', 'write_policy')
+
+# Invalidation modes of compileall; see py_compile.PycInvalidationMode
+MODES = ('timestamp', 'checked-hash', 'unchecked-hash')
+
+# Bytecode policies of an environment
+PREFIX = 'prefix'
+NONE = 'none'
+UNCHECKED = 'unchecked'
+POLICIES = (PREFIX, NONE, UNCHECKED)
+
+# Key of the policy in pyvenv.cfg
+POLICY_KEY = 'vsh-bytecode'
+
+# Outcome of precompile
+Compiled = collections.namedtuple('Compiled', 'mode duration ok')
+
+
+def precompile(python, folders, mode=None, workers=None, environ=None):
+    """Compiles every module below folders
+
+    Args:
+        python (str): interpreter of the environment
+        folders (Iterable[str]): folders to compile, e.g. site-packages
+        mode (str, optional): invalidation mode, one of MODES [default: checked-hash]
+        workers (int, optional): compiling processes [default: os.cpu_count()]
+        environ (dict, optional): environment for compileall, e.g. with PYTHONPYCACHEPREFIX
+
+    Raises:
+        ValueError: when mode is unknown
+
+    Returns:
+        Compiled: mode, seconds taken and whether every module compiled
+    """
+    mode = mode or 'checked-hash'
+    if mode not in MODES:
+        raise ValueError(f'Unknown invalidation mode: {mode}')
+    folders = [folder for folder in folders if os.path.isdir(folder)]
+    workers = workers or os.cpu_count() or 1
+    start = time.monotonic()
+    ok = True
+    if folders:
+        command = [python, '-m', 'compileall', '-q', '-j', str(workers), '--invalidation-mode', mode] + folders
+        # Modules which don't compile (e.g. python 2 only tests shipped in a wheel) are reported, not raised
+        result = subprocess.run(command, env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        ok = result.returncode == 0
+    return Compiled(mode, time.monotonic() - start, ok)
+
+
+def cache_root(cache_dir):
+    """Returns the folder holding the bytecode caches of prefix environments"""
+    return os.path.join(cache_dir, 'pycache')
+
+
+def cache_prefix(path, cache_dir):
+    """Returns the bytecode cache of an environment with the prefix policy
+
+    Args:
+        path (str): path to virtual environment
+        cache_dir (str): folder for vsh caches
+
+    Returns:
+        str: folder used as PYTHONPYCACHEPREFIX
+    """
+    digest = hashlib.sha1(os.path.abspath(path).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_root(cache_dir), digest)
+
+
+def read_policy(path):
+    """Returns the bytecode policy of an environment, or None for python's default"""
+    try:
+        with open(os.path.join(path, 'pyvenv.cfg')) as stream:
+            for line in stream:
+                key, _, value = line.partition('=')
+                if key.strip() == POLICY_KEY:
+                    return value.strip() or None
+    except OSError:
+        pass
+    return None
+
+
+def write_policy(path, policy=None):
+    """Sets the bytecode policy of an environment
+
+    Args:
+        path (str): path to virtual environment
+        policy (str, optional): one of POLICIES, or None for python's default
+
+    Raises:
+        ValueError: when policy is unknown
+    """
+    if policy is not None and policy not in POLICIES:
+        raise ValueError(f'Unknown bytecode policy: {policy}')
+    config = os.path.join(path, 'pyvenv.cfg')
+    with open(config) as stream:
+        lines = [line for line in stream if line.partition('=')[0].strip() != POLICY_KEY]
+    if policy:
+        lines.append(f'{POLICY_KEY} = {policy}\n')
+    temporary = f'{config}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as stream:
+        stream.writelines(lines)
+    os.replace(temporary, config)
+
+
+def policy_environ(path, cache_dir, policy=None):
+    """Returns the environment variables which apply a bytecode policy
+
+    Args:
+        path (str): path to virtual environment
+        cache_dir (str): folder for vsh caches
+        policy (str, optional): bytecode policy [default: read_policy(path)]
+
+    Returns:
+        Dict[str, str]: variables to set
+    """
+    policy = policy or read_policy(path)
+    if policy == PREFIX:
+        return {'PYTHONPYCACHEPREFIX': cache_prefix(path, cache_dir)}
+    if policy == NONE:
+        return {'PYTHONDONTWRITEBYTECODE': '1'}
+    return {}
+
+
+def policy_mode(policy):
+    """Returns the invalidation mode a policy precompiles with, or None when it doesn't"""
+    return {PREFIX: 'checked-hash', UNCHECKED: 'unchecked-hash'}.get(policy)
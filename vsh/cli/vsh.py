@@ -1,4 +1,6 @@
+import json
 import os
+import re
 import subprocess
 import sys
 from pathlib import Path
@@ -17,25 +19,56 @@ Available Virtual Environments:
 
 
 @click.command(help=default_help, context_settings={'ignore_unknown_options': True, 'allow_interspersed_args': False})
+@click.option('--base', metavar='BASE', help='Layer a new environment over the packages of environment BASE')
+@click.option('--bytecode', type=click.Choice(['default', 'prefix', 'none', 'unchecked']),
+              help='Bytecode policy: prefix caches .pyc files locally, none writes none, unchecked precompiles trusted .pyc files')
 @click.option('-c', '--copy', is_flag=True, help='Do not create symlinks for python')
+@click.option('--collect', is_flag=True, help='Group output per environment with --each')
 @click.option('-C', '--create-only', is_flag=True, help='Only create venv, do not enter')
+@click.option('--dedupe', is_flag=True, help='Link identical installed files across environments, or in the created environment, to one copy')
+@click.option('--diff', is_flag=True, help='Compare the packages and files of two environments: --diff A B')
+@click.option('--doctor', type=click.Choice(['startup']), help='startup: rank the import time, .pth lines and sitecustomize of an environment, with --json')
 @click.option('-d', '--dry-run', is_flag=True, help='Do not make changes to the system')
 @click.option('-e', '--ephemeral', is_flag=True, help='Create and remove')
+@click.option('--each', metavar='PATTERN', help='Run command in every environment matching glob, regex or comma separated names')
+@click.option('--freeze', is_flag=True, help='List installed packages without starting python; every match of --each with it')
+@click.option('--gc', is_flag=True, help='Remove least recently used environments per --max-age and --quota')
 @click.option('-i', '--interactive', is_flag=True, help='Run interactively')
+@click.option('-j', '--jobs', type=int, metavar='N', help='Maximum number of concurrent commands [default: cpu count]')
+@click.option('--json', 'as_json', is_flag=True, help='Show environments as json; implies --long')
 @click.option('-l', '--ls', is_flag=True, help='Show available virtual environments')
+@click.option('--lock', metavar='FILE', help='Install a fully pinned lock file, unpacking wheelhouse wheels without pip')
+@click.option('--long', is_flag=True, help='Show python version, packages, size and last use with --ls')
+@click.option('--max-age', metavar='AGE', help='Remove environments unused for AGE with --gc, e.g. 30d or 12h; seconds without a unit')
+@click.option('--module-index', type=click.Choice(['on', 'off']), help='on: resolve imports from an index of installed modules, rebuilt by installs')
 @click.option('--no-pip', is_flag=True, help='Do not include pip')
+@click.option('--offline', is_flag=True, help='Install only from the wheelhouse [default: $VSH_OFFLINE]')
+@click.option('--optimize-launchers', is_flag=True, help='Rewrite console scripts in bin/ as minimal shims, keeping the originals')
 @click.option('-o', '--overwrite', is_flag=True, help='Recreate venv')
+@click.option('--pack', is_flag=True, help='Zip the pure python packages of site-packages, for environments on network mounts')
 @click.option('--path', metavar='PATH', help='Path to virtual environment')
-@click.option('-p', '--python', metavar='VERSION', help='Python version to use')
+@click.option('--precompile', type=click.Choice(['timestamp', 'checked-hash', 'unchecked-hash']),
+              help='Compile site-packages in parallel after create, -R, --lock or --sync, or now [default: $VSH_PRECOMPILE]')
+@click.option('--protect', metavar='PATTERN', multiple=True, help='Never remove environments matching glob with --gc')
+@click.option('-p', '--python', metavar='VERSION', help='Python version to use; comma separated versions run a matrix, given before or after VENV_NAME')
+@click.option('--purge', is_flag=True, help='Delete removed environments still in the trash and exit')
+@click.option('--quota', metavar='SIZE', help='Remove least recently used environments until under SIZE with --gc, e.g. 20G')
+@click.option('-R', '--requirements', metavar='FILE', help='Install requirements file, preferring wheels in the wheelhouse')
+@click.option('--reflink', is_flag=True, help='Use copy-on-write clones instead of hard links with --dedupe')
+@click.option('--revert-launchers', is_flag=True, help='Restore the console scripts --optimize-launchers replaced')
 @click.option('-r', '--remove', is_flag=True, help='Remove virtual enironment')
+@click.option('--sort', type=click.Choice(['name', 'size', 'age']), help='Order of environments shown with --ls')
+@click.option('--sync', metavar='FILE', help='Install and remove only what differs from a pinned requirements file')
+@click.option('--unpack', is_flag=True, help='Extract the packages --pack zipped')
 @click.option('-u', '--upgrade', is_flag=True, help='Upgrades to latest python version')
 @click.option('-v', '--verbose', count=True, help='More output')
 @click.option('-V', '--version', is_flag=True, help='Show version and exit')
+@click.option('--wheelhouse', type=click.Choice(['build']), help='build: add wheels for a requirements file (-R or VENV_NAME) to the wheelhouse')
 @click.option('--shell-completion', is_flag=True, help='Show shell completion code')
 @click.argument('name', metavar='VENV_NAME', type=click.OptionalChoice(api.find_existing_venv_names()), nargs=1, required=False)
 @click.argument('command', required=False, nargs=-1)
 @click.pass_context
-def vsh(ctx, copy, create_only, dry_run, ephemeral, interactive, shell_completion, ls, no_pip, overwrite, path, python, remove, upgrade, verbose, version, name, command):
+def vsh(ctx, base, bytecode, copy, collect, create_only, dedupe, diff, doctor, dry_run, each, ephemeral, freeze, gc, interactive, jobs, as_json, shell_completion, ls, lock, long, max_age, module_index, no_pip, offline, optimize_launchers, overwrite, pack, path, precompile, protect, purge, python, quota, requirements, reflink, remove, revert_launchers, sort, sync, unpack, upgrade, verbose, version, wheelhouse, name, command):
     if shell_completion:
         subprocess.run('_VSH_COMPLETE=source vsh', shell=True)
         sys.exit(0)
@@ -46,10 +79,106 @@ def vsh(ctx, copy, create_only, dry_run, ephemeral, interactive, shell_completio
         api.show_version()
         sys.exit(0)
 
-    if ls:
-        api.show_envs()
+    if purge:
+        api.purge()
         sys.exit(0)
 
+    # Finish removals cut short, including ephemeral environments whose vsh was killed
+    api.reclaim()
+
+    if ls or long or sort or (as_json and not (freeze or doctor)):
+        api.show_envs(long=long, sort=sort, as_json=as_json)
+        sys.exit(0)
+
+    if gc:
+        if max_age is None and quota is None:
+            support.echo(click.style('--gc needs --max-age and/or --quota', fg='red'), file=sys.stderr)
+            sys.exit(2)
+        try:
+            api.gc(max_age=max_age, quota=quota, protect=protect, workers=jobs, verbose=verbose, dry_run=dry_run)
+        except ValueError as error:
+            support.echo(click.style(str(error), fg='red'), file=sys.stderr)
+            sys.exit(2)
+        sys.exit(0)
+
+    if wheelhouse == 'build':
+        requirements = requirements or name
+        if not requirements:
+            click.echo('ERROR: A requirements file must be provided with --wheelhouse build.')
+            sys.tracebacklimit = 0
+            sys.exit(1)
+        api.build_wheelhouse(requirements, python=python, workers=jobs, verbose=verbose + 1)
+        sys.exit(0)
+
+    link = ('reflink' if reflink else 'hardlink') if dedupe else None
+    bytecode_policy = None if bytecode == 'default' else bytecode
+    if dedupe and not (path or name):
+        api.dedupe(mode=link, workers=jobs, verbose=verbose, dry_run=dry_run)
+        sys.exit(0)
+
+    # Versions may follow the venv name too, e.g. vsh NAME -p 3.9,3.10 -- pytest
+    found = re.fullmatch(r'-p=?(?P<short>.+)|--python=(?P<long>.+)|-p|--python', command[0]) if command and not python else None
+    if found and (found.group('short') or found.group('long')):
+        python, command = found.group('short') or found.group('long'), command[1:]
+    elif found and len(command) > 1:
+        python, command = command[1], command[2:]
+
+    if command and command[0] == '--':
+        # Separator between the venv name and the command
+        command = command[1:]
+
+    if diff:
+        names = ([name] if name else []) + list(command)
+        if len(names) != 2:
+            click.echo('ERROR: Two environments must be provided with --diff.')
+            sys.tracebacklimit = 0
+            sys.exit(1)
+        difference = api.diff(*[_resolve_path(n) for n in names], workers=jobs)
+        api.show_diff(difference)
+        sys.tracebacklimit = 0
+        sys.exit(1 if any(difference) else 0)
+
+    if freeze and (each or not (path or name)):
+        paths = dict((p, n) for n, p in api.find_environments(each or '*'))
+        frozen = api.freeze_many(paths, workers=jobs)
+        if as_json:
+            support.echo(json.dumps({paths[p]: lines for p, lines in frozen.items()}, indent=2))
+        else:
+            for p, lines in frozen.items():
+                for line in lines:
+                    support.echo(click.style(paths[p], fg='yellow') + f'  {line}')
+        sys.exit(0)
+
+    if freeze:
+        for line in api.freeze(path or api.resolve_environment(name)):
+            support.echo(line)
+        sys.exit(0)
+
+    if doctor == 'startup':
+        if not (path or name):
+            click.echo('ERROR: A name or path must be provided with --doctor.')
+            sys.tracebacklimit = 0
+            sys.exit(1)
+        api.show_startup(api.diagnose_startup(path or api.resolve_environment(name)), as_json=as_json)
+        sys.exit(0)
+
+    if each:
+        command = ([name] if name else []) + list(command)
+        if not command:
+            click.echo('ERROR: A command must be provided with --each.')
+            sys.tracebacklimit = 0
+            sys.exit(1)
+        paths = [path for _, path in api.find_environments(each)]
+        if not paths:
+            click.echo(f'ERROR: No virtual environments match: {each}')
+            sys.tracebacklimit = 0
+            sys.exit(1)
+        results = api.enter_many(paths, command, workers=jobs, collect=collect, verbose=verbose)
+        api.show_results(results)
+        return_code = next((r.returncode for r in results if r.returncode), 0)
+        sys.tracebacklimit = 0
+        sys.exit(return_code)
+
     if path and name:
         # favor path over name
         command = [name] + list(command)
@@ -62,15 +191,31 @@ def vsh(ctx, copy, create_only, dry_run, ephemeral, interactive, shell_completio
         sys.exit(1)
 
     if not path:
-        home = os.getenv('HOME')
-        workon_home = os.getenv('WORKON_HOME') or os.path.join(home, '.virtualenvs')
-        path = os.path.join(workon_home, name)
+        path = api.resolve_environment(name)
+
+    pythons = [p.strip() for p in (python or '').split(',') if p.strip()]
+    if len(pythons) > 1:
+        paths = api.matrix_paths(path, pythons)
+        existing = [p for p in paths if api.validate_environment(p)]
+        if not remove:
+            paths = api.create_matrix(path, pythons, workers=jobs, include_pip=not no_pip, overwrite=overwrite, symlinks=not copy, ephemeral=ephemeral,
+                                      verbose=verbose)
+        if command and not create_only and not remove:
+            results = api.enter_many(paths, command, workers=jobs, collect=collect, verbose=verbose)
+            api.show_results(results)
+            return_code = next((r.returncode for r in results if r.returncode), 0)
+        if remove or ephemeral:
+            for matrix_path in paths:
+                if remove or matrix_path not in existing:
+                    api.remove(matrix_path, verbose=verbose, interactive=interactive, dry_run=dry_run)
+        sys.tracebacklimit = 0
+        sys.exit(return_code)
 
     # Determine if an environment already exists
     exists = api.validate_environment(path)
 
     if not command and not remove:
-        command = os.getenv('SHELL')
+        command = api.get_session().shell
 
     if exists and upgrade:
         # TODO: Add this
@@ -80,12 +225,43 @@ def vsh(ctx, copy, create_only, dry_run, ephemeral, interactive, shell_completio
         pass
 
     elif not exists and not remove:
-        api.create(path, include_pip=not no_pip, overwrite=overwrite, symlinks=not copy, python=python, verbose=verbose)
+        api.create(path, include_pip=not no_pip, overwrite=overwrite, symlinks=not copy, python=python, base=base and _resolve_path(base),
+                   ephemeral=ephemeral, link=link, requirements=requirements, lock=lock, offline=offline or None, precompile=precompile,
+                   bytecode_policy=bytecode_policy, verbose=verbose)
+        if sync:
+            api.sync(path, sync, offline=offline or None, workers=jobs, precompile=precompile, verbose=verbose, dry_run=dry_run)
         if ephemeral:
             remove = True
 
+    if exists and (requirements or lock) and not remove:
+        api.install(path, requirements, lock=lock, offline=offline or None, workers=jobs, precompile=precompile, verbose=verbose)
+
+    if exists and sync and not remove:
+        api.sync(path, sync, offline=offline or None, workers=jobs, precompile=precompile, verbose=verbose, dry_run=dry_run)
+
+    if exists and bytecode and not remove:
+        api.set_bytecode_policy(path, bytecode_policy, workers=jobs, verbose=verbose)
+
+    if exists and precompile and not (requirements or lock or sync or remove):
+        api.precompile(path, mode=precompile, workers=jobs, verbose=verbose)
+
+    if pack and not remove:
+        api.pack(path, verbose=verbose + 1)
+
+    if unpack and not remove:
+        api.unpack(path, verbose=verbose + 1)
+
+    if module_index and not remove:
+        api.set_module_index(path, enabled=module_index == 'on', verbose=verbose + 1)
+
+    if (optimize_launchers or revert_launchers) and not remove:
+        api.optimize_launchers(path, revert=revert_launchers, verbose=verbose + 1)
+
+    if exists and dedupe and not remove:
+        api.dedupe([path], mode=link, workers=jobs, verbose=verbose, dry_run=dry_run)
+
     if command and not create_only:
-        return_code = api.enter(path, command, verbose=max(verbose - 1, 0))
+        return_code = api.enter(path, command, verbose=max(verbose - 1, 0)).returncode
 
     if ephemeral and not remove:
         quoted_name = '"{name}"'.format(name=click.style(name, fg="yellow"))
@@ -97,3 +273,10 @@ def vsh(ctx, copy, create_only, dry_run, ephemeral, interactive, shell_completio
 
     sys.tracebacklimit = 0
     sys.exit(return_code)
+
+
+def _resolve_path(name):
+    """Returns the path of an environment given by name or path"""
+    if os.sep in name or name.startswith(('.', '~')):
+        return name
+    return api.resolve_environment(name)
@@ -0,0 +1,140 @@
+"""Installed distributions, read straight from their metadata
+
+Asking pip what is installed costs a subprocess, an interpreter start
+and pip's own imports.  The same answer is in the ``*.dist-info``
+folders of site-packages: the folder name gives name and version, and
+only the headers of ``METADATA`` are read to get the name as published.
+"""
+import base64
+import collections
+import contextlib
+import csv
+import hashlib
+import os
+import re
+
+__all__ = ('SCRIPT_GROUPS', 'Distribution', 'EntryPoint', 'file_hash', 'installed', 'normalize', 'parse_entry_points', 'read_entry_points', 'read_metadata',
+           'read_record')
+
+# Entry point groups installed as launchers in bin/
+SCRIPT_GROUPS = ('console_scripts', 'gui_scripts')
+
+# An installed distribution; path is its dist-info folder
+Distribution = collections.namedtuple('Distribution', 'name version path')
+
+# An entry point; value is module:attribute, possibly followed by [extras]
+EntryPoint = collections.namedtuple('EntryPoint', 'group name value')
+
+
+def normalize(name):
+    """Returns the normalized form of a distribution name, as in wheel and dist-info names"""
+    return re.sub(r'[-_.]+', '_', name).lower()
+
+
+def installed(site_packages):
+    """Returns the distributions installed in site-packages folders
+
+    Args:
+        site_packages (Iterable[str]): site-packages folders, earliest taking precedence
+
+    Returns:
+        Dict[str, Distribution]: distributions by normalized name
+    """
+    found = {}
+    for folder in site_packages:
+        with contextlib.suppress(OSError), os.scandir(folder) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.dist-info') or not entry.is_dir():
+                    continue
+                headers = read_metadata(entry.path)
+                name, _, version = entry.name[:-len('.dist-info')].partition('-')
+                name = headers.get('Name') or name
+                found.setdefault(normalize(name), Distribution(name, headers.get('Version') or version, entry.path))
+    return found
+
+
+def read_metadata(dist_info):
+    """Reads the headers of a distribution's METADATA, skipping its description
+
+    Args:
+        dist_info (str): dist-info folder
+
+    Returns:
+        Dict[str, str]: the first value of each header; empty when unreadable
+    """
+    headers = {}
+    try:
+        with open(os.path.join(dist_info, 'METADATA'), encoding='utf-8', errors='replace') as stream:
+            for line in stream:
+                if not line.strip():
+                    break
+                if line[0] in ' \t':
+                    continue
+                key, _, value = line.partition(':')
+                headers.setdefault(key.strip(), value.strip())
+    except OSError:
+        pass
+    return headers
+
+
+def parse_entry_points(text):
+    """Parses the content of an entry_points.txt
+
+    Args:
+        text (str): content of entry_points.txt
+
+    Returns:
+        List[EntryPoint]: entry points, in the order written
+    """
+    entry_points = []
+    group = None
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith(('#', ';')):
+            continue
+        if line.startswith('['):
+            group = line.strip('[]').strip()
+            continue
+        name, _, value = line.partition('=')
+        if group and value.strip():
+            entry_points.append(EntryPoint(group, name.strip(), value.strip()))
+    return entry_points
+
+
+def read_entry_points(dist_info):
+    """Reads the entry points of an installed distribution; empty when it has none"""
+    try:
+        with open(os.path.join(dist_info, 'entry_points.txt'), encoding='utf-8') as stream:
+            return parse_entry_points(stream.read())
+    except OSError:
+        return []
+
+
+def read_record(dist_info):
+    """Reads the files of a distribution from its RECORD
+
+    Args:
+        dist_info (str): dist-info folder
+
+    Returns:
+        Dict[str, str]: RECORD hash (e.g. sha256=...) of each file, by path
+            relative to site-packages; empty when unreadable
+    """
+    files = {}
+    with contextlib.suppress(OSError), open(os.path.join(dist_info, 'RECORD'), newline='', encoding='utf-8') as stream:
+        for row in csv.reader(stream):
+            if row:
+                files[row[0]] = row[1] if len(row) > 1 else ''
+    return files
+
+
+def file_hash(path, algorithm='sha256'):
+    """Returns the hash of a file as written in RECORD, or None when unreadable"""
+    digest = hashlib.new(algorithm)
+    try:
+        with open(path, 'rb') as stream:
+            for block in iter(lambda: stream.read(2 ** 20), b''):
+                digest.update(block)
+    except OSError:
+        return None
+    return f'{algorithm}=' + base64.urlsafe_b64encode(digest.digest()).rstrip(b'=').decode('ascii')
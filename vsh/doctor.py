@@ -0,0 +1,127 @@
+"""Startup cost analysis of virtual environments
+
+``python -c pass`` in a busy environment can take a second or more,
+mostly spent in ``.pth`` files, ``sitecustomize`` and the imports they
+trigger.  ``startup`` runs the environment's interpreter with
+``-X importtime`` several times and takes the median self and cumulative
+time of each module, then times every executable ``.pth`` line on its
+own, in site's order, so the costly ones can be found and fixed.
+"""
+import collections
+import json
+import statistics
+import subprocess
+import time
+
+__all__ = ('PTH_THRESHOLD', 'ModuleTime', 'PthLine', 'StartupReport', 'parse_importtime', 'startup')
+
+# Seconds above which a .pth line is flagged as expensive
+PTH_THRESHOLD = 0.001
+
+# Median import time of a module, in microseconds; depth 0 is imported by startup itself
+ModuleTime = collections.namedtuple('ModuleTime', 'name self cumulative depth')
+
+# An executable .pth line and the seconds it took
+PthLine = collections.namedtuple('PthLine', 'file line seconds')
+
+StartupReport = collections.namedtuple('StartupReport', 'python runs wall modules pth_lines customize')
+
+# Times each import line of the .pth files in site's order, run with -S so site doesn't run them first
+_PTH_PROBE = '''
+import importlib.util, json, os, site, sys, time
+# Without site, sys.prefix is still the base interpreter's until site.venv reads pyvenv.cfg
+site.venv(set())
+folders = [folder for folder in site.getsitepackages() if os.path.isdir(folder)]
+sys.path.extend(folders)
+lines = []
+for folder in folders:
+    for name in sorted(os.listdir(folder)):
+        if not name.endswith('.pth'):
+            continue
+        with open(os.path.join(folder, name)) as stream:
+            for line in stream:
+                line = line.rstrip()
+                if line.startswith(('import ', 'import\\t')):
+                    start = time.perf_counter()
+                    try:
+                        exec(line)
+                    except Exception:
+                        pass
+                    lines.append([os.path.join(folder, name), line, time.perf_counter() - start])
+customize = {}
+for module in ['sitecustomize', 'usercustomize']:
+    spec = importlib.util.find_spec(module)
+    if spec and spec.origin:
+        customize[module] = spec.origin
+print(json.dumps({'pth_lines': lines, 'customize': customize}))
+'''
+
+
+def parse_importtime(text):
+    """Parses the output of python -X importtime
+
+    Args:
+        text (str): stderr of the interpreter
+
+    Returns:
+        List[Tuple[str, int, int, int]]: name, self and cumulative microseconds, and depth of each import
+    """
+    imports = []
+    for line in text.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        imports.append((name.strip(), int(fields[0]), int(fields[1]), max(depth, 0)))
+    return imports
+
+
+def startup(python, runs=None, environ=None):
+    """Measures the startup of an interpreter
+
+    One extra, discarded, run first warms the bytecode caches.  The .pth
+    files are those of the site-packages folders the interpreter itself
+    reports.
+
+    Args:
+        python (str): interpreter of the environment
+        runs (int, optional): runs measured [default: 5]
+        environ (dict, optional): environment the interpreter runs with
+
+    Raises:
+        subprocess.CalledProcessError: when the interpreter fails to start
+
+    Returns:
+        StartupReport: median wall seconds, modules ranked by self time,
+            .pth lines ranked by seconds and the sitecustomize and
+            usercustomize modules found, by name, with their origin and
+            cumulative microseconds
+    """
+    runs = max(int(runs or 5), 1)
+    walls = []
+    samples = collections.defaultdict(list)
+    for run in range(runs + 1):
+        start = time.perf_counter()
+        result = subprocess.run([python, '-X', 'importtime', '-c', 'pass'], env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                stderr=subprocess.PIPE, universal_newlines=True, check=True)
+        wall = time.perf_counter() - start
+        if not run:
+            continue
+        walls.append(wall)
+        for name, self_time, cumulative, depth in parse_importtime(result.stderr):
+            samples[(name, depth)].append((self_time, cumulative))
+    modules = [
+        ModuleTime(name, statistics.median(s for s, _ in times), statistics.median(c for _, c in times), depth)
+        for (name, depth), times in samples.items()
+        ]
+    modules.sort(key=lambda module: (-module.self, module.name))
+    probe = subprocess.run([python, '-S', '-c', _PTH_PROBE], env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                           stderr=subprocess.DEVNULL, universal_newlines=True, check=True)
+    found = json.loads(probe.stdout)
+    pth_lines = sorted((PthLine(*line) for line in found['pth_lines']), key=lambda line: -line.seconds)
+    cumulative = {module.name: module.cumulative for module in modules if module.depth == 0}
+    customize = {name: {'path': origin, 'cumulative': cumulative.get(name)} for name, origin in found['customize'].items()}
+    return StartupReport(python, runs, statistics.median(walls), modules, pth_lines, customize)
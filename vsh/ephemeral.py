@@ -0,0 +1,206 @@
+"""Ownership of ephemeral virtual environments
+
+An ephemeral environment (``vsh -e``) is removed by the process that
+created it once its command finishes.  When that process is killed
+first, the environment would be left behind, so each one carries an
+owner marker (host, pid, boot id and process start time) and is listed
+in a registry under the cache folder.  Any vsh invocation may then
+reclaim environments whose owner is dead; the check runs at most once
+per ORPHAN_INTERVAL and in a detached process.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import socket
+import sys
+import time
+
+from . import trash
+
+__all__ = ('OWNER', 'ORPHAN_INTERVAL', 'claim', 'find_orphans', 'owner_alive', 'reap_orphans', 'reap_orphans_later', 'release')
+
+# Marker file naming the owner of an ephemeral environment
+OWNER = '.vsh-owner'
+
+# Seconds between checks for orphaned environments
+ORPHAN_INTERVAL = 300
+
+
+def claim(path, cache_dir, pid=None):
+    """Marks path as an ephemeral environment owned by a process
+
+    Args:
+        path (str): path to virtual environment
+        cache_dir (str): folder for vsh caches
+        pid (int, optional): owning process [default: this process]
+
+    Returns:
+        dict: owner marker
+    """
+    path = os.path.abspath(path)
+    pid = pid or os.getpid()
+    owner = {'path': path, 'host': socket.gethostname(), 'pid': pid, 'boot_id': _boot_id(), 'start_time': _start_time(pid)}
+    _write_json(os.path.join(path, OWNER), owner)
+    _write_json(_registry_path(path, cache_dir), owner)
+    return owner
+
+
+def release(path, cache_dir):
+    """Drops path from the registry of ephemeral environments"""
+    with contextlib.suppress(OSError):
+        os.unlink(_registry_path(os.path.abspath(path), cache_dir))
+
+
+def owner_alive(owner):
+    """Checks if the owner of an ephemeral environment is still running
+
+    Owners on other hosts are always assumed alive.
+
+    Args:
+        owner (dict): owner marker
+
+    Returns:
+        bool: False when the owner has certainly exited
+    """
+    if owner.get('host') != socket.gethostname():
+        return True
+    boot_id = _boot_id()
+    if boot_id and owner.get('boot_id') and boot_id != owner['boot_id']:
+        return False
+    try:
+        os.kill(owner['pid'], 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    # The pid may since have been reused by another process
+    start_time = _start_time(owner['pid'])
+    return not (start_time and owner.get('start_time') and start_time != owner['start_time'])
+
+
+def find_orphans(cache_dir):
+    """Finds ephemeral environments whose owner is dead
+
+    Registry entries for environments which are gone, or no longer carry
+    the same marker, are dropped.
+
+    Args:
+        cache_dir (str): folder for vsh caches
+
+    Returns:
+        List[str]: paths to orphaned environments
+    """
+    orphans = []
+    folder = os.path.join(cache_dir, 'ephemeral')
+    try:
+        with os.scandir(folder) as entries:
+            registry = [entry.path for entry in entries if entry.name.endswith('.json')]
+    except OSError:
+        return orphans
+    for entry in registry:
+        owner = _read_json(entry)
+        marker = _read_json(os.path.join(owner['path'], OWNER)) if owner else None
+        if not owner or marker != owner:
+            with contextlib.suppress(OSError):
+                os.unlink(entry)
+        elif not owner_alive(owner):
+            orphans.append(owner['path'])
+    return orphans
+
+
+def reap_orphans(cache_dir):
+    """Removes ephemeral environments whose owner is dead
+
+    Args:
+        cache_dir (str): folder for vsh caches
+
+    Returns:
+        List[str]: paths removed
+    """
+    removed = []
+    for path in find_orphans(cache_dir):
+        try:
+            folder = trash.move_to_trash(path)
+        except OSError:
+            trash.rmtree(path, ignore_errors=True)
+        else:
+            trash.reap([folder])
+        release(path, cache_dir)
+        removed.append(path)
+    return removed
+
+
+def reap_orphans_later(cache_dir, interval=None):
+    """Reaps orphaned environments from a detached process, at most once per interval
+
+    Args:
+        cache_dir (str): folder for vsh caches
+        interval (float, optional): seconds between checks [default: ORPHAN_INTERVAL]
+
+    Returns:
+        subprocess.Popen: the reaper, or None when not due or nothing is registered
+    """
+    interval = ORPHAN_INTERVAL if interval is None else interval
+    folder = os.path.join(cache_dir, 'ephemeral')
+    stamp = os.path.join(cache_dir, 'ephemeral.stamp')
+    try:
+        if time.time() - os.stat(stamp).st_mtime < interval:
+            return None
+    except OSError:
+        pass
+    try:
+        with os.scandir(folder) as entries:
+            if not any(entry.name.endswith('.json') for entry in entries):
+                return None
+        with open(stamp, 'a'):
+            os.utime(stamp)
+    except OSError:
+        return None
+    return trash.run_detached('vsh.ephemeral', [cache_dir])
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _boot_id():
+    try:
+        with open('/proc/sys/kernel/random/boot_id') as stream:
+            return stream.read().strip()
+    except OSError:
+        return None
+
+
+def _start_time(pid):
+    """Returns when a process started, in clock ticks after boot"""
+    try:
+        with open(f'/proc/{pid}/stat') as stream:
+            # The command name may hold spaces, so split after it
+            return int(stream.read().rpartition(')')[2].split()[19])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def _read_json(path):
+    try:
+        with open(path) as stream:
+            return json.load(stream)
+    except (OSError, ValueError):
+        return None
+
+
+def _registry_path(path, cache_dir):
+    digest = hashlib.sha1(path.encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, 'ephemeral', f'{digest}.json')
+
+
+def _write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as stream:
+        json.dump(data, stream, sort_keys=True)
+    os.replace(temporary, path)
+
+
+if __name__ == '__main__':
+    reap_orphans(sys.argv[1])
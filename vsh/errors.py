@@ -18,6 +18,18 @@ class BaseError(Exception):
         return self.__msg__
 
 
+class BaseInUseError(BaseError):
+    """ERROR: {path} is the base of: {dependents}"""
+
+
+class BaseMismatchError(BaseError):
+    """ERROR: Base environment {path} uses python {base_version}, not {version}"""
+
+
+class HashMismatchError(BaseError):
+    """ERROR: Hash does not match the lock file or wheel RECORD: {path}"""
+
+
 class InterpreterNotFound(BaseError):
     """ERROR: Could not find interpreter for: {version}"""
 
@@ -26,5 +38,21 @@ class InvalidEnvironmentError(BaseError):
     """ERROR: Path is not a valid environment: {path}"""
 
 
+class InvalidWheelError(BaseError):
+    """ERROR: Invalid wheel {path}: {reason}"""
+
+
 class PathNotFoundError(BaseError):
     """ERROR: Could not find path: {path}"""
+
+
+class ReflinkUnsupportedError(BaseError):
+    """ERROR: Reflinks are not supported where the store is, use hardlinks instead: {path} ({reason})"""
+
+
+class UnpinnedRequirementError(BaseError):
+    """ERROR: Every requirement must be pinned with == to sync: {requirements}"""
+
+
+class WheelsMissingError(BaseError):
+    """ERROR: Offline and no wheel in {wheelhouse} for: {requirements}"""
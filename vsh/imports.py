@@ -0,0 +1,180 @@
+"""Module index of virtual environments
+
+Each top level import looks through every ``sys.path`` entry in turn, and
+each entry costs a stat (for a changed folder) even when its listing is
+cached; a namespace package, or a module that isn't installed, costs one
+for every entry.  With editable installs and layered environments adding
+entries, and site-packages on NFS, that adds up.
+
+``build`` indexes the top level modules of site-packages and the entries
+after it, as the environment's python sees them, into
+``.vsh-modules`` of the environment (a marshal of name -> location).  A
+small meta path finder, ``_vsh_finder.py`` loaded by ``_vsh_finder.pth``
+in site-packages, then answers imports of indexed modules from the
+index.  Entries before site-packages (the script's folder, PYTHONPATH,
+the standard library) are still searched first, so nothing installed
+shadows them, and the finder steps aside as soon as an indexed folder
+changes, e.g. after a plain ``pip install``.
+"""
+import os
+import subprocess
+import sys
+
+__all__ = ('FINDER', 'INDEX', 'PTH', 'build', 'enabled', 'remove')
+
+# File of an environment holding its index
+INDEX = '.vsh-modules'
+
+# Finder module and the .pth loading it, in site-packages
+FINDER = '_vsh_finder.py'
+PTH = '_vsh_finder.pth'
+
+# The finder, run by every interpreter of the environment; stdlib only and cheap to import
+_FINDER_SOURCE = '''"""Resolves top level imports from the module index vsh built for this environment"""
+import marshal
+import os
+import sys
+from importlib.machinery import ModuleSpec, PathFinder
+from importlib.util import spec_from_file_location
+
+
+class IndexFinder:
+    def __init__(self, folders, modules):
+        self.folders = folders
+        self.modules = modules
+
+    def find_spec(self, name, path=None, target=None):
+        if path is not None or name not in self.modules:
+            return None
+        # Entries before the indexed ones come first, as they would without the index
+        first = next((i for i, entry in enumerate(sys.path) if entry in self.folders), None)
+        if first is None:
+            return None
+        spec = PathFinder.find_spec(name, sys.path[:first]) if first else None
+        if spec is not None and spec.loader is not None:
+            return spec
+        kind, location = self.modules[name]
+        if kind == 'namespace':
+            spec = ModuleSpec(name, None, is_package=True)
+            spec.submodule_search_locations = list(location)
+            return spec
+        if kind == 'package':
+            return spec_from_file_location(name, location, submodule_search_locations=[os.path.dirname(location)])
+        return spec_from_file_location(name, location)
+
+    def invalidate_caches(self):
+        pass
+
+
+def install():
+    try:
+        with open(os.path.join(sys.prefix, {index!r}), 'rb') as stream:
+            folders, modules = marshal.load(stream)
+        # Anything installed or removed since the index was built turns it off
+        if any(os.stat(folder).st_mtime_ns != mtime for folder, mtime in folders):
+            return
+    except (OSError, EOFError, ValueError, TypeError):
+        return
+    # Just ahead of PathFinder, so builtin, frozen and other meta path finders keep their turn
+    position = next((i for i, finder in enumerate(sys.meta_path) if finder is PathFinder), len(sys.meta_path))
+    sys.meta_path.insert(position, IndexFinder(set(folder for folder, _ in folders), modules))
+
+
+install()
+'''
+
+# Installs the finder into site-packages and indexes sys.path from there on, in the environment's python
+_BUILD = '''
+import marshal, os, py_compile, site, sys
+from importlib.machinery import BYTECODE_SUFFIXES, EXTENSION_SUFFIXES, SOURCE_SUFFIXES
+index, finder, source, pth = sys.argv[1:]
+site_packages = site.getsitepackages()[0]
+os.makedirs(site_packages, exist_ok=True)
+if site_packages not in sys.path:
+    sys.path.append(site_packages)
+for name, content in [(finder, source), (pth, 'import _vsh_finder\\n')]:
+    target = os.path.join(site_packages, name)
+    if not os.path.exists(target) or open(target).read() != content:
+        with open(target, 'w') as stream:
+            stream.write(content)
+# Compiling the finder now keeps a new __pycache__ from changing site-packages once indexed
+if not sys.dont_write_bytecode:
+    py_compile.compile(os.path.join(site_packages, finder), doraise=False, quiet=2)
+# Module files in the order FileFinder tries them
+suffixes = EXTENSION_SUFFIXES + SOURCE_SUFFIXES + BYTECODE_SUFFIXES
+start = sys.path.index(site_packages) if site_packages in sys.path else len(sys.path)
+folders = []
+modules = {}
+for entry in sys.path[start:]:
+    if not os.path.isdir(entry):
+        if os.path.exists(entry):
+            # A zip may hold anything, so the entries after it can't be indexed in order
+            break
+        continue
+    if entry in dict(folders):
+        continue
+    folders.append((entry, os.stat(entry).st_mtime_ns))
+    names = sorted(os.listdir(entry))
+    found = {}
+    for name in names:
+        path = os.path.join(entry, name)
+        if name.isidentifier() and os.path.isdir(path):
+            init = next((os.path.join(path, '__init__' + suffix) for suffix in suffixes if os.path.isfile(os.path.join(path, '__init__' + suffix))), None)
+            found[name] = ('package', init) if init else ('namespace', [path])
+    for suffix in reversed(suffixes):
+        for name in names:
+            module = name[:-len(suffix)]
+            if name.endswith(suffix) and module.isidentifier() and found.get(module, ('namespace', ))[0] != 'package':
+                found[module] = ('module', os.path.join(entry, name))
+    for name, (kind, location) in found.items():
+        if name == '_vsh_finder':
+            continue
+        if name not in modules:
+            modules[name] = (kind, location)
+        elif modules[name][0] == 'namespace':
+            # A regular package anywhere wins over namespace portions, which otherwise add up
+            modules[name] = (kind, modules[name][1] + location) if kind == 'namespace' else (kind, location)
+with open(os.path.join(sys.prefix, index + '.tmp'), 'wb') as stream:
+    marshal.dump((folders, modules), stream)
+os.replace(os.path.join(sys.prefix, index + '.tmp'), os.path.join(sys.prefix, index))
+print(len(modules))
+'''
+
+
+def build(path, environ=None):
+    """Indexes the modules of a virtual environment and installs the finder using the index
+
+    Args:
+        path (str): path to virtual environment
+        environ (dict, optional): environment of the environment's python
+
+    Raises:
+        subprocess.CalledProcessError: when indexing fails
+
+    Returns:
+        int: top level modules indexed
+    """
+    python = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin', 'python')
+    command = [python, '-c', _BUILD, INDEX, FINDER, _FINDER_SOURCE.format(index=INDEX), PTH]
+    result = subprocess.run(command, env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, universal_newlines=True, check=True)
+    return int(result.stdout.strip() or 0)
+
+
+def enabled(path):
+    """Returns True when a virtual environment has a module index"""
+    return os.path.exists(os.path.join(path, INDEX))
+
+
+def remove(path, site_packages):
+    """Removes the module index and finder of a virtual environment
+
+    Args:
+        path (str): path to virtual environment
+        site_packages (Iterable[str]): site-packages folders of the environment
+    """
+    targets = [os.path.join(path, INDEX)] + [os.path.join(folder, name) for folder in site_packages for name in [PTH, FINDER]]
+    for target in targets:
+        try:
+            os.unlink(target)
+        except FileNotFoundError:
+            pass
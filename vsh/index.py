@@ -0,0 +1,199 @@
+"""Persistent index of virtual environment details
+
+Each root of environments gets its own index, a small json file under
+the session's cache folder, so nothing is written inside the roots
+themselves (which may be read-only or shared).  Entries are keyed by
+environment path.  Updates re-read the file under a lock and write it
+atomically, so concurrent vsh processes merge rather than clobber each
+other's changes.
+
+Frequent small changes, such as the time an environment was last used,
+are appended as json lines to a log beside the file instead, and merged
+over it on read.  The log is folded into the file by the next update, or
+once it grows past LOG_LIMIT bytes.
+"""
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ('LOG_LIMIT', 'EnvironmentIndex')
+
+# Bytes of appended changes after which the log is folded into the index
+LOG_LIMIT = 64 * 1024
+
+
+class EnvironmentIndex:
+    """Details of the environments under one root
+
+    Args:
+        root (str): folder holding virtual environments
+        cache_dir (str): folder for vsh caches
+    """
+
+    def __init__(self, root, cache_dir):
+        self.root = root
+        digest = hashlib.sha1(root.encode('utf-8')).hexdigest()[:16]
+        self.path = os.path.join(cache_dir, 'index', f'{digest}.json')
+        self.log_path = os.path.join(cache_dir, 'index', f'{digest}.log')
+        self._lock = threading.Lock()
+        self._entries = None
+        self._mtime = None
+        self._log = None
+
+    def __repr__(self):
+        cname = type(self).__name__
+        return f'<{cname} {self.root}>'
+
+    def entries(self):
+        """Returns every entry, reading the file only when it has changed
+
+        Returns:
+            Dict[str, dict]: details by environment path
+        """
+        with self._lock:
+            return dict(self._load())
+
+    def get(self, path):
+        """Returns the entry for path
+
+        Args:
+            path (str): path to virtual environment
+
+        Returns:
+            dict: details, empty when path isn't indexed
+        """
+        with self._lock:
+            return dict(self._load().get(path) or {})
+
+    def append(self, path, **fields):
+        """Merges fields into the entry for path by appending them to the log
+
+        Costs one short write however large the index is, rather than
+        rewriting it as update does.
+
+        Args:
+            path (str): path to virtual environment
+            fields: details to store
+        """
+        line = json.dumps(dict(fields, path=path), sort_keys=True) + '\n'
+        with self._lock, self._file_lock():
+            with open(self.log_path, 'a') as stream:
+                stream.write(line)
+                size = stream.tell()
+            if size > LOG_LIMIT:
+                self._mtime = None
+                self._save(self._load())
+
+    def update(self, path, **fields):
+        """Merges fields into the entry for path and saves the index
+
+        Args:
+            path (str): path to virtual environment
+            fields: details to store
+        """
+        self.update_many({path: fields})
+
+    def update_many(self, updates):
+        """Merges several entries into the index and saves it once
+
+        Args:
+            updates (Dict[str, dict]): fields by environment path
+        """
+        with self._lock, self._file_lock():
+            self._mtime = None
+            entries = self._load()
+            for path, fields in updates.items():
+                entries.setdefault(path, {}).update(fields)
+            self._save(entries)
+
+    def discard(self, *paths):
+        """Drops entries for paths and saves the index"""
+        with self._lock, self._file_lock():
+            self._mtime = None
+            entries = self._load()
+            for path in paths:
+                entries.pop(path, None)
+            self._save(entries)
+
+    # ------------------------------------------------------------------
+    # Support
+    # ------------------------------------------------------------------
+    @contextlib.contextmanager
+    def _file_lock(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if fcntl is None:
+            yield
+            return
+        with open(f'{self.path}.lock', 'a') as stream:
+            fcntl.flock(stream, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(stream, fcntl.LOCK_UN)
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            mtime = None
+        log = self._log_stamp()
+        if self._entries is None or mtime != self._mtime or log != self._log:
+            entries = {}
+            if mtime is not None:
+                try:
+                    with open(self.path) as stream:
+                        entries = json.load(stream)
+                except (OSError, ValueError):
+                    entries = {}
+            for fields in self._read_log():
+                entries.setdefault(fields.pop('path'), {}).update(fields)
+            self._entries, self._mtime, self._log = entries, mtime, log
+        return self._entries
+
+    def _log_stamp(self):
+        try:
+            info = os.stat(self.log_path)
+        except OSError:
+            return None
+        return info.st_ino, info.st_size, info.st_mtime_ns
+
+    def _read_log(self):
+        """Yields the changes appended to the log, skipping torn lines"""
+        try:
+            with open(self.log_path) as stream:
+                lines = stream.readlines()
+        except OSError:
+            return
+        for line in lines:
+            try:
+                fields = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(fields, dict) and isinstance(fields.get('path'), str):
+                yield fields
+
+    def _save(self, entries):
+        folder = os.path.dirname(self.path)
+        descriptor, temporary = tempfile.mkstemp(dir=folder, prefix='.index-')
+        try:
+            with os.fdopen(descriptor, 'w') as stream:
+                json.dump(entries, stream, sort_keys=True)
+            os.replace(temporary, self.path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.unlink(temporary)
+            raise
+        # The log was merged into entries when they were loaded
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.log_path)
+        self._entries = entries
+        self._mtime = os.stat(self.path).st_mtime_ns
+        self._log = None
@@ -0,0 +1,435 @@
+"""Direct installer for locked wheels
+
+A lock file is a requirements file where every requirement is pinned
+with ``==``, usually with ``--hash`` options (e.g. from
+``pip-compile --generate-hashes``).  As the set is already resolved,
+there is nothing for pip to do but unpack: each wheel found in the
+wheelhouse is checked against its hashes and unzipped on a thread pool,
+writing RECORD, INSTALLER and console script launchers and spreading
+``.data`` folders as pip would.  Files are staged inside the environment
+and only moved into place once every wheel checked out.  No
+subprocess and no resolver are involved.
+
+Anything this can't install (markers, urls, ranges, wheels for another
+platform or an unknown wheel version) is left for pip.
+"""
+import base64
+import collections
+import concurrent.futures
+import contextlib
+import csv
+import glob
+import hashlib
+import io
+import os
+import re
+import shutil
+import stat
+import sys
+import sysconfig
+import tempfile
+import zipfile
+from email.parser import BytesParser
+
+from .dists import SCRIPT_GROUPS, normalize, parse_entry_points
+from .dists import installed as installed_distributions
+from .errors import HashMismatchError, InvalidWheelError
+
+__all__ = ('INSTALLER', 'Pin', 'environment_version', 'install', 'launcher', 'plan', 'read_lock', 'supported_tags', 'uninstall')
+
+# Written to the INSTALLER file of each distribution
+INSTALLER = 'vsh'
+
+# A pinned requirement from a lock file
+Pin = collections.namedtuple('Pin', 'name version hashes line')
+
+# Longest shebang the kernel accepts; longer ones go through /bin/sh
+MAX_SHEBANG = 127
+
+
+def read_lock(path):
+    """Reads a lock file
+
+    Args:
+        path (str): lock file
+
+    Returns:
+        Tuple[List[Pin], List[str]]: plain pins, and the remaining lines (options,
+            markers, urls or other specifiers) which only pip understands
+    """
+    pins = []
+    lines = []
+    with open(path) as stream:
+        text = stream.read().replace('\\\n', ' ')
+    for line in text.splitlines():
+        line = re.sub(r'(^|\s)#.*$', '', line).strip()
+        if not line:
+            continue
+        found = re.fullmatch(
+            r'(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)(\[[^\]]*\])?\s*==\s*(?P<version>[A-Za-z0-9.+!_-]+)(?P<options>(\s+--hash[=\s]\S+)*)',
+            line,
+            )
+        if not found:
+            lines.append(line)
+            continue
+        hashes = re.findall(r'--hash[=\s](\S+)', found.group('options'))
+        pins.append(Pin(normalize(found.group('name')), found.group('version'), tuple(hashes), line))
+    return pins, lines
+
+
+def supported_tags(version, platforms=None):
+    """Returns the wheel tags an interpreter on this machine can install
+
+    Args:
+        version (str): python version of the environment, e.g. 3.11.7
+        platforms (Iterable[str], optional): platform tags [default: this machine's]
+
+    Returns:
+        Set[Tuple[str, str, str]]: (python, abi, platform) tags
+    """
+    major, minor = (int(part) for part in version.split('.')[:2])
+    platforms = list(platforms or _platforms())
+    tags = set()
+    cpython = f'cp{major}{minor}'
+    for abi in [cpython, 'abi3', 'none']:
+        for platform in platforms:
+            tags.add((cpython, abi, platform))
+    for older in range(2, minor):
+        for platform in platforms:
+            tags.add((f'cp{major}{older}', 'abi3', platform))
+    for python in [cpython, f'py{major}{minor}', f'py{major}'] + [f'py{major}{older}' for older in range(minor)]:
+        tags.add((python, 'none', 'any'))
+    return tags
+
+
+def environment_version(path):
+    """Returns the python version of an environment, from its pyvenv.cfg"""
+    with open(os.path.join(path, 'pyvenv.cfg')) as stream:
+        for line in stream:
+            key, _, value = line.partition('=')
+            if key.strip() in ['version', 'version_info']:
+                return value.strip()
+    return None
+
+
+def launcher(entry_point, python):
+    """Returns a console or gui script launcher
+
+    The launcher is a minimal shim importing only its entry point, with
+    no pkg_resources or importlib.metadata lookup at startup.
+
+    Args:
+        entry_point (str): module:attribute, or module to run as __main__
+        python (str): interpreter of the environment
+
+    Returns:
+        bytes: content of the launcher
+    """
+    module, _, attribute = entry_point.split('[')[0].strip().partition(':')
+    attribute = attribute.strip() or None
+    if attribute:
+        body = (
+            f'import sys\nfrom {module.strip()} import {attribute.split(".")[0]}\n'
+            f"if __name__ == '__main__':\n"
+            f'    sys.exit({attribute}())\n'
+            )
+    else:
+        body = f'import runpy\nrunpy.run_module({module.strip()!r}, run_name="__main__", alter_sys=True)\n'
+    return _shebang(python) + b'# -*- coding: utf-8 -*-\n' + body.encode('utf-8')
+
+
+def plan(pins, wheelhouse, version):
+    """Finds the wheel to install for each pin
+
+    Args:
+        pins (Iterable[Pin]): pinned requirements
+        wheelhouse (str): folder of wheels
+        version (str): python version of the environment
+
+    Returns:
+        Tuple[List[Tuple[Pin, str]], List[Pin]]: pins with their wheel, and pins to leave to pip
+    """
+    tags = supported_tags(version)
+    wheels = collections.defaultdict(list)
+    with contextlib.suppress(OSError), os.scandir(wheelhouse) as entries:
+        for entry in entries:
+            parts = entry.name[:-len('.whl')].split('-') if entry.name.endswith('.whl') else []
+            if len(parts) in [5, 6]:
+                wheels[(normalize(parts[0]), parts[1])].append((entry.path, parts[-3:]))
+    found = []
+    leftover = []
+    for pin in pins:
+        candidates = [
+            wheel_path for wheel_path, (python, abi, platform) in wheels.get((pin.name, pin.version), [])
+            if any((p, a, pl) in tags for p in python.split('.') for a in abi.split('.') for pl in platform.split('.'))
+            ]
+        wheel_path = next((candidate for candidate in sorted(candidates) if _wheel_version(candidate) == 1), None)
+        if wheel_path:
+            found.append((pin, wheel_path))
+        else:
+            leftover.append(pin)
+    return found, leftover
+
+
+def install(wheels, path, workers=None):
+    """Installs wheels into an environment, without pip
+
+    A distribution already installed at the same version is skipped and
+    one at another version is uninstalled first.
+
+    Args:
+        wheels (Iterable[Tuple[Pin, str]]): pins and their wheel; see plan
+        path (str): path to virtual environment
+        workers (int, optional): wheels installed at once [default: 4 per cpu, at most 32]
+
+    Raises:
+        HashMismatchError: when a wheel doesn't match the hashes of its pin, or a
+            file doesn't match the wheel's RECORD
+        InvalidWheelError: when a wheel would write outside the environment
+
+    Returns:
+        List[str]: names of the distributions installed
+    """
+    wheels = list(wheels)
+    scheme = _Scheme(path)
+    installed = installed_distributions([scheme.purelib])
+    pending = [(pin, wheel_path) for pin, wheel_path in wheels if pin.name not in installed or installed[pin.name].version != pin.version]
+    for pin, wheel_path in pending:
+        _check_hashes(wheel_path, pin.hashes)
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    # Every wheel is unpacked and checked aside first, so a bad one leaves the environment untouched
+    staging = tempfile.mkdtemp(prefix='.vsh-install-', dir=path)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(_stage_wheel, wheel_path, scheme, os.path.join(staging, str(index))) for index, (_, wheel_path) in enumerate(pending)]
+            staged = [future.result() for future in futures]
+        # One at a time, as removing emptied folders would race other wheels creating them
+        for pin, _ in pending:
+            if pin.name in installed:
+                uninstall(installed[pin.name].path, scheme.purelib)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            for future in concurrent.futures.as_completed([executor.submit(_move_in, files) for files in staged]):
+                future.result()
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return [pin.name for pin, _ in pending]
+
+
+def uninstall(dist_info, site_packages):
+    """Deletes the files of an installed distribution, per its RECORD
+
+    Args:
+        dist_info (str): dist-info folder of the distribution
+        site_packages (str): site-packages folder holding it
+    """
+    folders = {dist_info}
+    with contextlib.suppress(OSError), open(os.path.join(dist_info, 'RECORD'), newline='') as stream:
+        for row in csv.reader(stream):
+            if not row:
+                continue
+            path = os.path.normpath(os.path.join(site_packages, row[0]))
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+            if path.endswith('.py'):
+                folder, module = os.path.split(path)
+                for cached in glob.glob(os.path.join(folder, '__pycache__', module[:-len('.py')] + '.*.pyc')):
+                    with contextlib.suppress(OSError):
+                        os.unlink(cached)
+                folders.add(os.path.join(folder, '__pycache__'))
+            folders.add(os.path.dirname(path))
+    shutil.rmtree(dist_info, ignore_errors=True)
+    # Deepest first, so emptied parents go too
+    for folder in sorted(folders, key=len, reverse=True):
+        while folder.startswith(site_packages + os.sep):
+            try:
+                os.rmdir(folder)
+            except OSError:
+                break
+            folder = os.path.dirname(folder)
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+class _Scheme:
+    """Install folders of an environment"""
+
+    def __init__(self, path):
+        self.path = path
+        self.version = environment_version(path) or '.'.join(str(part) for part in sys.version_info[:3])
+        short_version = '.'.join(self.version.split('.')[:2])
+        if sys.platform == 'win32':
+            self.purelib = os.path.join(path, 'Lib', 'site-packages')
+            self.scripts = os.path.join(path, 'Scripts')
+            self.include = os.path.join(path, 'Include', 'site')
+        else:
+            self.purelib = os.path.join(path, 'lib', f'python{short_version}', 'site-packages')
+            self.scripts = os.path.join(path, 'bin')
+            self.include = os.path.join(path, 'include', 'site', f'python{short_version}')
+        self.python = os.path.join(self.scripts, 'python')
+        os.makedirs(self.purelib, exist_ok=True)
+
+    def folder(self, key, distribution):
+        """Returns the folder of a .data subfolder"""
+        if key in ['purelib', 'platlib']:
+            return self.purelib
+        if key == 'scripts':
+            return self.scripts
+        if key == 'headers':
+            return os.path.join(self.include, distribution)
+        if key == 'data':
+            return self.path
+        return None
+
+
+def _check_hashes(wheel_path, hashes):
+    """Checks a wheel against the --hash options of its pin"""
+    if not hashes:
+        return
+    expected = {}
+    for value in hashes:
+        algorithm, _, digest = value.partition(':')
+        expected.setdefault(algorithm, set()).add(digest)
+    for algorithm, digests in expected.items():
+        with open(wheel_path, 'rb') as stream:
+            if _digest(stream, algorithm).hexdigest() in digests:
+                return
+    raise HashMismatchError(path=wheel_path)
+
+
+def _digest(stream, algorithm='sha256'):
+    digest = hashlib.new(algorithm)
+    for block in iter(lambda: stream.read(2 ** 20), b''):
+        digest.update(block)
+    return digest
+
+
+def _move_in(files):
+    """Moves the staged files of a wheel to their place in the environment"""
+    for staged, target in files:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        os.replace(staged, target)
+
+
+def _stage_wheel(wheel_path, scheme, staging):
+    """Unpacks a wheel into a staging folder, checking it against its RECORD
+
+    Returns:
+        List[Tuple[str, str]]: each staged file and where it is installed
+    """
+    files, records = [], []
+
+    def stage(target, content, executable=None):
+        staged = os.path.join(staging, str(len(files)))
+        _write(staged, content, executable)
+        files.append((staged, target))
+        records.append(_record_row(target, scheme.purelib, content))
+
+    with zipfile.ZipFile(wheel_path) as archive:
+        names = archive.namelist()
+        dist_info = next(name.split('/')[0] for name in names if re.fullmatch(r'[^/]+\.dist-info/WHEEL', name))
+        distribution = dist_info[:-len('.dist-info')].split('-')[0]
+        data = dist_info[:-len('.dist-info')] + '.data'
+        expected = _read_record(archive.read(f'{dist_info}/RECORD'))
+        for info in archive.infolist():
+            if info.is_dir() or info.filename in [f'{dist_info}/RECORD', f'{dist_info}/INSTALLER']:
+                continue
+            target = _target(info.filename, data, scheme, distribution)
+            if target is None:
+                continue
+            content = archive.read(info)
+            digest = expected.get(info.filename)
+            if digest and _record_hash(hashlib.new(digest[0], content)) != digest[1]:
+                raise HashMismatchError(path=f'{wheel_path}:{info.filename}')
+            executable = bool((info.external_attr >> 16) & stat.S_IXUSR)
+            if target.startswith(scheme.scripts + os.sep) and content.startswith(b'#!python'):
+                content = _shebang(scheme.python) + content.split(b'\n', 1)[-1]
+                executable = True
+            stage(target, content, executable)
+        try:
+            entry_points = archive.read(f'{dist_info}/entry_points.txt').decode('utf-8')
+        except KeyError:
+            entry_points = ''
+        for entry_point in parse_entry_points(entry_points):
+            if entry_point.group in SCRIPT_GROUPS:
+                stage(os.path.join(scheme.scripts, entry_point.name), launcher(entry_point.value, scheme.python), executable=True)
+    stage(os.path.join(scheme.purelib, dist_info, 'INSTALLER'), f'{INSTALLER}\n'.encode('utf-8'))
+    records.append((f'{dist_info}/RECORD', '', ''))
+    stream = io.StringIO()
+    csv.writer(stream, lineterminator='\n').writerows(records)
+    staged = os.path.join(staging, str(len(files)))
+    _write(staged, stream.getvalue().encode('utf-8'))
+    files.append((staged, os.path.join(scheme.purelib, dist_info, 'RECORD')))
+    return files
+
+
+def _platforms():
+    """Yields this machine's platform tags, most specific first"""
+    platform = re.sub(r'[-.]', '_', sysconfig.get_platform())
+    if platform.startswith('linux_'):
+        arch = platform[len('linux_'):]
+        libc = os.confstr('CS_GNU_LIBC_VERSION') if hasattr(os, 'confstr') else None
+        if libc and libc.startswith('glibc '):
+            glibc_major, glibc_minor = (int(part) for part in libc.split()[1].split('.')[:2])
+            for minor in range(glibc_minor, -1, -1):
+                yield f'manylinux_{glibc_major}_{minor}_{arch}'
+                legacy = {17: 'manylinux2014', 12: 'manylinux2010', 5: 'manylinux1'}.get(minor)
+                if legacy and glibc_major == 2:
+                    yield f'{legacy}_{arch}'
+    yield platform
+
+
+def _read_record(content):
+    """Returns the (algorithm, digest) of each file listed in a RECORD"""
+    expected = {}
+    for row in csv.reader(io.StringIO(content.decode('utf-8'))):
+        if len(row) > 1 and row[1]:
+            algorithm, _, digest = row[1].partition('=')
+            expected[row[0]] = (algorithm, digest)
+    return expected
+
+
+def _record_hash(digest):
+    return base64.urlsafe_b64encode(digest.digest()).rstrip(b'=').decode('ascii')
+
+
+def _record_row(target, site_packages, content):
+    relative = os.path.relpath(target, site_packages).replace(os.sep, '/')
+    return relative, 'sha256=' + _record_hash(hashlib.sha256(content)), len(content)
+
+
+def _shebang(python):
+    if len(python) + 3 <= MAX_SHEBANG and ' ' not in python:
+        return f'#!{python}\n'.encode('utf-8')
+    # Too long or quoted for the kernel; sh re-executes the launcher with python
+    return f"#!/bin/sh\n'''exec' \"{python}\" \"$0\" \"$@\"\n' '''\n".encode('utf-8')
+
+
+def _target(name, data, scheme, distribution):
+    """Returns where a file of the wheel is installed, or None to skip it"""
+    parts = name.split('/')
+    if '..' in parts or name.startswith('/') or ':' in parts[0]:
+        raise InvalidWheelError(path=distribution, reason=f'{name} is outside the environment')
+    if parts[0] != data:
+        return os.path.join(scheme.purelib, *parts)
+    folder = scheme.folder(parts[1], distribution) if len(parts) > 2 else None
+    return os.path.join(folder, *parts[2:]) if folder else None
+
+
+def _wheel_version(wheel_path):
+    """Returns the major Wheel-Version of a wheel, or None when unreadable"""
+    try:
+        with zipfile.ZipFile(wheel_path) as archive:
+            name = next(name for name in archive.namelist() if re.fullmatch(r'[^/]+\.dist-info/WHEEL', name))
+            headers = BytesParser().parsebytes(archive.read(name))
+        return int(headers['Wheel-Version'].split('.')[0])
+    except (OSError, StopIteration, ValueError, AttributeError, zipfile.BadZipFile):
+        return None
+
+
+def _write(path, content, executable=None):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as stream:
+        stream.write(content)
+    if executable:
+        os.chmod(path, 0o755)
@@ -0,0 +1,142 @@
+"""Console script launchers of virtual environments
+
+Launchers written by older pip and setuptools find their entry point
+through ``pkg_resources`` or ``importlib.metadata``, which scans every
+installed distribution on each run of pytest, flake8 and the like.
+``optimize`` rewrites them from the ``entry_points.txt`` of the installed
+distributions as the minimal shims ``vsh.installer`` writes, importing
+only the entry point itself.  The originals are kept in
+``.vsh-launchers`` of the environment; a shim whose entry point fails to
+import under the environment's python is put back at once, and
+``revert`` restores all of them.
+"""
+import collections
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+from . import dists, installer
+
+__all__ = ('BACKUP', 'Optimized', 'optimize', 'revert')
+
+# Folder of an environment holding the original launchers
+BACKUP = '.vsh-launchers'
+
+# Outcome of optimize, as launcher names
+Optimized = collections.namedtuple('Optimized', 'rewritten unchanged failed')
+
+# Runs each shim without calling its entry point, which sits behind __name__ == '__main__'
+_CHECK = '''
+import importlib.util, json, runpy, sys
+failed = []
+for path, entry_point in json.loads(sys.argv[1]):
+    try:
+        if ':' in entry_point.split('[')[0]:
+            runpy.run_path(path, run_name='__vsh_check__')
+        elif importlib.util.find_spec(entry_point.split('[')[0].strip()) is None:
+            raise ImportError(entry_point)
+    except BaseException:
+        failed.append(path)
+print(json.dumps(failed))
+'''
+
+
+def optimize(path, site_packages, environ=None):
+    """Rewrites the launchers of a virtual environment as minimal shims
+
+    Only launchers of installed distributions' console and gui scripts
+    which start with a python shebang are touched.  A launcher already
+    backed up keeps its first backup, so optimizing twice still reverts
+    to the original.
+
+    Args:
+        path (str): path to virtual environment
+        site_packages (Iterable[str]): site-packages folders of the environment
+        environ (dict, optional): environment the shims are checked with
+
+    Returns:
+        Optimized: launchers rewritten, already shims, and put back because their entry point didn't import
+    """
+    scripts = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin')
+    python = os.path.join(scripts, 'python')
+    backup = os.path.join(path, BACKUP)
+    shims = {}
+    for distribution in dists.installed(site_packages).values():
+        for entry_point in dists.read_entry_points(distribution.path):
+            target = os.path.join(scripts, entry_point.name)
+            if entry_point.group in dists.SCRIPT_GROUPS and entry_point.name not in shims and _is_python_script(target):
+                shims[entry_point.name] = (target, entry_point.value, installer.launcher(entry_point.value, python))
+    rewritten = []
+    unchanged = []
+    for name, (target, _, content) in sorted(shims.items()):
+        with open(target, 'rb') as stream:
+            if stream.read() == content:
+                unchanged.append(name)
+                continue
+        os.makedirs(backup, exist_ok=True)
+        if not os.path.exists(os.path.join(backup, name)):
+            shutil.copy2(target, os.path.join(backup, name))
+        _replace(target, content)
+        rewritten.append(name)
+    failed = []
+    if rewritten:
+        checks = [(shims[name][0], shims[name][1]) for name in rewritten]
+        result = subprocess.run([python, '-c', _CHECK, json.dumps(checks)], env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                                stderr=subprocess.DEVNULL, universal_newlines=True)
+        failed_paths = set(json.loads(result.stdout)) if result.returncode == 0 else {target for target, _ in checks}
+        failed = [name for name in rewritten if shims[name][0] in failed_paths]
+        for name in failed:
+            _restore(backup, name, scripts)
+        rewritten = [name for name in rewritten if name not in failed]
+    return Optimized(rewritten, unchanged, failed)
+
+
+def revert(path):
+    """Puts back the launchers optimize replaced
+
+    Args:
+        path (str): path to virtual environment
+
+    Returns:
+        List[str]: launchers restored
+    """
+    scripts = os.path.join(path, 'Scripts' if sys.platform == 'win32' else 'bin')
+    backup = os.path.join(path, BACKUP)
+    try:
+        names = sorted(os.listdir(backup))
+    except FileNotFoundError:
+        return []
+    for name in names:
+        _restore(backup, name, scripts)
+    os.rmdir(backup)
+    return names
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _is_python_script(path):
+    """Returns True when path is a file starting with a python shebang"""
+    try:
+        with open(path, 'rb') as stream:
+            first, second = stream.readline(), stream.readline()
+    except OSError:
+        return False
+    # Interpreters with long paths are started through a /bin/sh trampoline
+    return first.startswith(b'#!') and (b'python' in first or (first.startswith(b'#!/bin/sh') and second.startswith(b"'''exec'")))
+
+
+def _replace(target, content):
+    """Writes content over target, keeping its permissions"""
+    temporary = f'{target}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as stream:
+        stream.write(content)
+    shutil.copymode(target, temporary)
+    os.replace(temporary, target)
+
+
+def _restore(backup, name, scripts):
+    """Moves a launcher back from the backup folder"""
+    os.replace(os.path.join(backup, name), os.path.join(scripts, name))
@@ -0,0 +1,212 @@
+"""Zip packed site-packages
+
+On a shared network mount, importing from site-packages is dominated by
+per file metadata operations: a stat and an open for every module, and
+its bytecode.  ``pack`` moves the top level packages and modules made
+only of python sources into one zip beside them, ``_vsh_packed.zip``,
+put on ``sys.path`` by ``_vsh_packed.pth`` and read through
+``zipimport``: one large sequential read instead of thousands of small
+ones.  Each module is stored with its bytecode (unchecked hash based, as
+zipimport can't write any), compiled by the environment's python.
+
+Anything else stays extracted: C extensions, packages with data files
+(which are often read relative to ``__file__``), namespace packages and
+modules imported by ``.pth`` files, which may run before the zip is on
+``sys.path``.  Packed modules are imported under the environment's
+python before and after packing; if any of them no longer imports from
+the zip, everything is unpacked again.  ``unpack`` reverses a pack.
+"""
+import collections
+import contextlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import zipfile
+
+__all__ = ('ARCHIVE', 'PTH', 'Packed', 'candidates', 'is_packed', 'pack', 'unpack')
+
+# Zip of packed modules and the .pth putting it on sys.path, in site-packages
+ARCHIVE = '_vsh_packed.zip'
+PTH = '_vsh_packed.pth'
+
+# Outcome of pack, as top level names: packed, left extracted as they didn't import before, and failing from the zip
+Packed = collections.namedtuple('Packed', 'packed kept failed')
+
+# Files of a package which don't keep it out of the zip
+_PACKABLE = re.compile(r'\.pyc?$|^py\.typed$')
+
+# Imports each name, printing where each of those which imported came from
+_CHECK = '''
+import importlib, json, sys
+found = {}
+for name in json.loads(sys.argv[1]):
+    try:
+        found[name] = getattr(importlib.import_module(name), '__file__', None) or ''
+    except BaseException:
+        pass
+print(json.dumps(found))
+'''
+
+# Zips sources with their bytecode, compiled by the environment's python
+_PACK = '''
+import json, os, py_compile, sys, tempfile, zipfile
+archive, files = json.loads(sys.argv[1])
+with tempfile.TemporaryDirectory() as temporary, zipfile.ZipFile(archive + '.tmp', 'w', zipfile.ZIP_DEFLATED) as zipped:
+    compiled = os.path.join(temporary, 'module.pyc')
+    for name, source in files:
+        zipped.write(source, name)
+        if not name.endswith('.py'):
+            continue
+        mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+        # Sources which don't compile are left for zipimport to report when imported
+        if py_compile.compile(source, cfile=compiled, dfile=os.path.join(archive, name), quiet=2, invalidation_mode=mode):
+            zipped.write(compiled, name[:-len('.py')] + '.pyc')
+os.replace(archive + '.tmp', archive)
+'''
+
+
+def candidates(site_packages):
+    """Returns the top level packages and modules of site-packages which may be packed
+
+    Args:
+        site_packages (str): site-packages folder
+
+    Returns:
+        List[str]: names of packages made only of python sources, and of modules
+    """
+    names = []
+    reserved = set()
+    try:
+        entries = sorted(os.scandir(site_packages), key=lambda entry: entry.name)
+    except OSError:
+        return names
+    for entry in entries:
+        if entry.name.endswith('.pth') and entry.is_file():
+            with contextlib.suppress(OSError), open(entry.path, errors='replace') as stream:
+                reserved.update(word for line in stream if line.startswith(('import ', 'import\t')) for word in re.findall(r'\w+', line))
+    for entry in entries:
+        name, extension = os.path.splitext(entry.name)
+        if name.startswith('_vsh') or not name.isidentifier():
+            continue
+        if extension == '.py' and entry.is_file():
+            names.append(name)
+        elif not extension and entry.is_dir() and os.path.isfile(os.path.join(entry.path, '__init__.py')) and _only_sources(entry.path):
+            names.append(name)
+    return [name for name in names if name not in reserved]
+
+
+def is_packed(site_packages):
+    """Returns True when site-packages has packed modules"""
+    return os.path.exists(os.path.join(site_packages, ARCHIVE))
+
+
+def pack(site_packages, python, environ=None):
+    """Packs the pure python packages and modules of site-packages into a zip
+
+    A folder already packed is unpacked first, so newly installed
+    packages are packed too.
+
+    Args:
+        site_packages (str): site-packages folder, as python sees it
+        python (str): interpreter of the environment
+        environ (dict, optional): environment the imports are checked with
+
+    Returns:
+        Packed: names packed, left extracted because they didn't import before packing, and
+            failing to import once packed (in which case nothing is packed)
+    """
+    unpack(site_packages)
+    names = candidates(site_packages)
+    origins = _check(python, names, environ)
+    packable = [name for name in names if origins.get(name, '').startswith(site_packages + os.sep)]
+    kept = [name for name in names if name not in packable]
+    if not packable:
+        return Packed([], kept, [])
+    archive = os.path.join(site_packages, ARCHIVE)
+    files = []
+    for name in packable:
+        top = os.path.join(site_packages, name)
+        if not os.path.isdir(top):
+            files.append((f'{name}.py', f'{top}.py'))
+            continue
+        for folder, folders, filenames in os.walk(top):
+            folders[:] = sorted(child for child in folders if child != '__pycache__')
+            for filename in sorted(filenames):
+                if not filename.endswith('.pyc'):
+                    source = os.path.join(folder, filename)
+                    files.append((os.path.relpath(source, site_packages).replace(os.sep, '/'), source))
+    subprocess.run([python, '-c', _PACK, json.dumps([archive, files])], env=environ, stdin=subprocess.DEVNULL, check=True)
+    with open(os.path.join(site_packages, PTH), 'w') as stream:
+        stream.write(f'{ARCHIVE}\n')
+    for name in packable:
+        top = os.path.join(site_packages, name)
+        if os.path.isdir(top):
+            shutil.rmtree(top)
+        else:
+            os.unlink(f'{top}.py')
+            for cached in _cached(site_packages, name):
+                os.unlink(cached)
+    origins = _check(python, packable, environ)
+    failed = [name for name in packable if not origins.get(name, '').startswith(archive + os.sep)]
+    if failed:
+        unpack(site_packages)
+        return Packed([], kept, failed)
+    return Packed(packable, kept, [])
+
+
+def unpack(site_packages):
+    """Extracts the packed modules of site-packages back into it
+
+    Args:
+        site_packages (str): site-packages folder
+
+    Returns:
+        List[str]: names unpacked
+    """
+    archive = os.path.join(site_packages, ARCHIVE)
+    if not os.path.exists(archive):
+        return []
+    with zipfile.ZipFile(archive) as zipped:
+        # The bytecode was vsh's own; python writes its usual __pycache__ again
+        members = [member for member in zipped.namelist() if not member.endswith('.pyc')]
+        for member in members:
+            zipped.extract(member, site_packages)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(os.path.join(site_packages, PTH))
+    os.unlink(archive)
+    return sorted({re.sub(r'\.py$', '', member.split('/')[0]) for member in members})
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _cached(site_packages, name):
+    """Returns the bytecode files of a top level module"""
+    try:
+        entries = os.listdir(os.path.join(site_packages, '__pycache__'))
+    except OSError:
+        return []
+    return [os.path.join(site_packages, '__pycache__', entry) for entry in entries if entry.startswith(f'{name}.') and entry.endswith('.pyc')]
+
+
+def _check(python, names, environ=None):
+    """Imports names under python, returning where each of those which imported came from"""
+    if not names:
+        return {}
+    result = subprocess.run([python, '-c', _CHECK, json.dumps(names)], env=environ, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL, universal_newlines=True)
+    lines = result.stdout.splitlines()
+    return json.loads(lines[-1]) if result.returncode == 0 and lines else {}
+
+
+def _only_sources(folder):
+    """Returns True when every file below folder is python source or bytecode, in regular packages"""
+    for path, folders, filenames in os.walk(folder):
+        folders[:] = [name for name in folders if name != '__pycache__']
+        if not all(_PACKABLE.search(filename) for filename in filenames):
+            return False
+        if filenames and '__init__.py' not in filenames:
+            return False
+    return True
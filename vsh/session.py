@@ -0,0 +1,478 @@
+"""Explicitly configured vsh sessions
+
+A session holds the settings vsh would otherwise read from the
+environment on every call along with caches shared between calls.
+Settings given explicitly are fixed for the session's lifetime.  Those
+left as None, environ included, are read from os.environ whenever they
+are used, which is how the default session behaves.  Sessions may be
+shared between threads.
+"""
+import os
+import shlex
+import subprocess
+import threading
+from pathlib import Path
+
+__all__ = ('IGNORE', 'MAX_DEPTH', 'ROOT_TIMEOUT', 'Vsh', 'get_session', 'set_session')
+
+# Folders which never hold virtual environments
+IGNORE = (
+    '.cache', '.git', '.hg', '.mypy_cache', '.nox', '.pytest_cache', '.svn', '.tox', '.trash', '.vsh-store', '__pycache__',
+    '*.dist-info', '*.egg-info', 'node_modules', 'site-packages',
+    )
+
+# Deepest folder level below a root searched for environments
+MAX_DEPTH = 3
+
+# Seconds to wait on a root of environments before giving up on it
+ROOT_TIMEOUT = 10
+
+
+class Vsh:
+    """Settings and caches for vsh
+
+    Args:
+        workon_home (str, optional): path to virtual environments [default: first of roots]
+        roots (List[str], optional): paths to virtual environments, by precedence
+            [default: $VSH_PATH then $WORKON_HOME, each colon separated, or $HOME/.virtualenvs]
+        root_timeout (float, optional): seconds to wait on a root [default: $VSH_ROOT_TIMEOUT or 10]
+        home (str, optional): home folder [default: $HOME]
+        shell (str, optional): shell used to enter environments [default: $SHELL]
+        search_path (str|List[str], optional): interpreter search path [default: $PATH]
+        prompt (str, optional): shell prompt [default: $PS1 or $PROMPT]
+        cache_dir (str, optional): folder for vsh caches [default: $XDG_CACHE_HOME/vsh or $HOME/.cache/vsh]
+        environ (dict, optional): environment commands are run with, copied when given [default: os.environ, read when used]
+        max_depth (int, optional): deepest folder level searched for environments [default: $VSH_MAX_DEPTH or 3]
+        ignore (List[str], optional): folder name globs never searched [default: IGNORE plus $VSH_IGNORE]
+        scan_workers (int, optional): folders searched at once [default: 4 per cpu, at most 32]
+        wheelhouse (str, optional): folder of wheels installs prefer [default: $VSH_WHEELHOUSE or cache_dir/wheelhouse]
+        offline (bool, optional): install only from the wheelhouse [default: $VSH_OFFLINE]
+        precompile (str, optional): invalidation mode site-packages is compiled with after installs, or None for
+            none [default: $VSH_PRECOMPILE, where 1 means checked-hash]
+    """
+
+    def __init__(self, workon_home=None, roots=None, root_timeout=None, home=None, shell=None, search_path=None, prompt=None,
+                 cache_dir=None, environ=None, max_depth=None, ignore=None, scan_workers=None, wheelhouse=None, offline=None,
+                 precompile=None):
+        self._environ = dict(environ) if environ is not None else None
+        self._home = _normalize(home)
+        self._roots = _unique(_normalize(root) for root in ([workon_home] if workon_home else []) + list(roots or []))
+        self._root_timeout = root_timeout
+        self._shell = shell
+        if isinstance(search_path, str):
+            search_path = search_path.split(os.pathsep)
+        self._search_path = tuple(search_path) if search_path is not None else None
+        self._prompt = prompt
+        self._cache_dir = _normalize(cache_dir)
+        self._max_depth = max_depth
+        self._ignore = tuple(ignore) if ignore is not None else None
+        self._scan_workers = scan_workers
+        self._wheelhouse = _normalize(wheelhouse)
+        self._offline = offline
+        self._precompile = precompile
+
+        self._lock = threading.RLock()
+        self._interpreters = {}
+        self._repo_roots = {}
+        self._environments = {}
+        self._statuses = {}
+        self._indexes = {}
+
+    def __repr__(self):
+        cname = type(self).__name__
+        return f'<{cname} workon_home={self.workon_home!r}>'
+
+    # ------------------------------------------------------------------
+    # Settings
+    # ------------------------------------------------------------------
+    @property
+    def environ(self):
+        return os.environ if self._environ is None else self._environ
+
+    @property
+    def home(self):
+        return self._home or self.environ.get('HOME') or str(Path.home())
+
+    @property
+    def roots(self):
+        if self._roots:
+            return self._roots
+        roots = []
+        for variable in ['VSH_PATH', 'WORKON_HOME']:
+            roots.extend(_normalize(root) for root in (self.environ.get(variable) or '').split(os.pathsep) if root)
+        return _unique(roots) or (os.path.join(self.home, '.virtualenvs'), )
+
+    @property
+    def root_timeout(self):
+        if self._root_timeout is not None:
+            return self._root_timeout
+        return float(self.environ.get('VSH_ROOT_TIMEOUT') or ROOT_TIMEOUT)
+
+    @property
+    def workon_home(self):
+        return self.roots[0]
+
+    @property
+    def shell(self):
+        return self._shell or self.environ.get('SHELL')
+
+    @property
+    def search_path(self):
+        if self._search_path is not None:
+            return self._search_path
+        return tuple(self.environ.get('PATH', os.defpath).split(os.pathsep))
+
+    @property
+    def prompt(self):
+        return self._prompt or self.environ.get('PS1') or self.environ.get('PROMPT')
+
+    @property
+    def cache_dir(self):
+        if self._cache_dir:
+            return self._cache_dir
+        xdg_cache_home = self.environ.get('XDG_CACHE_HOME') or os.path.join(self.home, '.cache')
+        return os.path.join(xdg_cache_home, 'vsh')
+
+    @property
+    def max_depth(self):
+        if self._max_depth is not None:
+            return self._max_depth
+        return int(self.environ.get('VSH_MAX_DEPTH') or MAX_DEPTH)
+
+    @property
+    def ignore(self):
+        if self._ignore is not None:
+            return self._ignore
+        extra = [pattern for pattern in (self.environ.get('VSH_IGNORE') or '').split(os.pathsep) if pattern]
+        return IGNORE + tuple(extra)
+
+    @property
+    def scan_workers(self):
+        return self._scan_workers or min(32, 4 * (os.cpu_count() or 1))
+
+    @property
+    def wheelhouse(self):
+        return self._wheelhouse or _normalize(self.environ.get('VSH_WHEELHOUSE')) or os.path.join(self.cache_dir, 'wheelhouse')
+
+    @property
+    def offline(self):
+        if self._offline is not None:
+            return self._offline
+        return (self.environ.get('VSH_OFFLINE') or '').lower() in ['1', 'true', 'yes', 'on']
+
+    @property
+    def precompile(self):
+        if self._precompile is not None:
+            return self._precompile
+        value = (self.environ.get('VSH_PRECOMPILE') or '').lower()
+        if value in ['1', 'true', 'yes', 'on']:
+            return 'checked-hash'
+        return None if value in ['', '0', 'false', 'no', 'off'] else value
+
+    # ------------------------------------------------------------------
+    # Caches
+    # ------------------------------------------------------------------
+    def clear(self):
+        """Clears all caches"""
+        with self._lock:
+            self._interpreters.clear()
+            self._repo_roots.clear()
+            self._environments.clear()
+            self._statuses.clear()
+
+    def environment_status(self, path, stamp, inspect):
+        """Returns the status of the environment at path, inspecting it
+        again only when stamp has changed.
+
+        Args:
+            path (str): path to virtual environment
+            stamp (tuple): values which change whenever the environment does
+            inspect (Callable): returns the status for path
+
+        Returns:
+            EnvironmentStatus: status of the environment
+        """
+        with self._lock:
+            cached = self._statuses.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        status = inspect(path)
+        with self._lock:
+            self._statuses[path] = (stamp, status)
+        return status
+
+    def environments(self, root, scan, key=None):
+        """Yields the environments found under root, scanning again only
+        when a folder searched by the last complete scan has changed.
+
+        Args:
+            root (str): folder holding virtual environments
+            scan (Callable): yields (name, path) found under root, appending
+                (folder, mtime) for each folder searched to its second argument
+            key (Hashable, optional): scan options the results depend on
+
+        Yields:
+            Tuple[str, str]: name and path of each environment
+        """
+        with self._lock:
+            cached = self._environments.get((root, key))
+        if cached and _unchanged(cached[1]):
+            yield from cached[0]
+            return
+        found = []
+        searched = []
+        for item in scan(root, searched):
+            found.append(item)
+            yield item
+        with self._lock:
+            self._environments[(root, key)] = (found, searched)
+
+    def forget(self, root=None):
+        """Drops cached environments for root, or every root"""
+        with self._lock:
+            for cached_root, key in list(self._environments):
+                if root is None or cached_root == root:
+                    del self._environments[(cached_root, key)]
+
+    def index(self, path):
+        """Returns the persistent index for the root holding path
+
+        Args:
+            path (str): path to virtual environment
+
+        Returns:
+            EnvironmentIndex: index of the first root holding path, or of
+                the folder holding path when no root does
+        """
+        from .index import EnvironmentIndex
+        path = os.path.abspath(path)
+        root = next((root for root in self.roots if path.startswith(root.rstrip(os.sep) + os.sep)), None)
+        root = root or os.path.dirname(path)
+        with self._lock:
+            if root not in self._indexes:
+                self._indexes[root] = EnvironmentIndex(root, self.cache_dir)
+            return self._indexes[root]
+
+    def interpreter(self, python, find):
+        """Returns the interpreter for python, resolving it with find once
+        per search path.
+
+        Args:
+            python (str): version of python, python executable or path to python
+            find (Callable): returns the interpreter path for (python, search_path) or None
+
+        Returns:
+            str: path to interpreter or None if not found
+        """
+        key = (python, self.search_path)
+        with self._lock:
+            if key in self._interpreters:
+                return self._interpreters[key]
+        found = find(python, self.search_path)
+        if found:
+            with self._lock:
+                self._interpreters[key] = found
+        return found
+
+    def repo_root(self, cwd=None):
+        """Returns the top of the git or mercurial repository holding cwd
+
+        Args:
+            cwd (str, optional): folder within a repository [default: current folder]
+
+        Returns:
+            Path: top of repository or None
+        """
+        cwd = os.path.abspath(cwd or os.getcwd())
+        with self._lock:
+            if cwd in self._repo_roots:
+                return self._repo_roots[cwd]
+        cmds = [
+            'git rev-parse --show-toplevel',
+            'hg root',
+            ]
+        root = None
+        for cmd in cmds:
+            cmd = shlex.split(cmd)
+            try:
+                root = Path(subprocess.run(cmd, cwd=cwd, stderr=subprocess.PIPE, stdout=subprocess.PIPE).stdout.decode('utf-8').strip()) or None
+                # Path('') is Path('.')
+                root = None if str(root) == '.' else root
+                if root:
+                    break
+            except Exception:
+                pass
+        with self._lock:
+            self._repo_roots[cwd] = root
+        return root
+
+    # ------------------------------------------------------------------
+    # Api, every function working on environments run with this session
+    #  but precompile, which is a setting here
+    # ------------------------------------------------------------------
+    def build_wheelhouse(self, requirements, **kwds):
+        from . import api
+        return api.build_wheelhouse(requirements, session=self, **kwds)
+
+    def create(self, path, **kwds):
+        from . import api
+        return api.create(path, session=self, **kwds)
+
+    def create_matrix(self, path, pythons, **kwds):
+        from . import api
+        return api.create_matrix(path, pythons, session=self, **kwds)
+
+    def dedupe(self, paths=None, **kwds):
+        from . import api
+        return api.dedupe(paths, session=self, **kwds)
+
+    def diagnose_startup(self, path, **kwds):
+        from . import api
+        return api.diagnose_startup(path, session=self, **kwds)
+
+    def diff(self, a, b, **kwds):
+        from . import api
+        return api.diff(a, b, **kwds)
+
+    def enter(self, path, command=None, **kwds):
+        from . import api
+        return api.enter(path, command, session=self, **kwds)
+
+    def enter_many(self, paths, command=None, **kwds):
+        from . import api
+        return api.enter_many(paths, command, session=self, **kwds)
+
+    def environment_details(self, path, **kwds):
+        from . import api
+        return api.environment_details(path, session=self, **kwds)
+
+    def find_environment_folders(self, path=None, **kwds):
+        from . import api
+        return api.find_environment_folders(path=path, session=self, **kwds)
+
+    def find_environments(self, pattern, **kwds):
+        from . import api
+        return api.find_environments(pattern, session=self, **kwds)
+
+    def freeze(self, path, **kwds):
+        from . import api
+        return api.freeze(path, **kwds)
+
+    def freeze_many(self, paths, **kwds):
+        from . import api
+        return api.freeze_many(paths, **kwds)
+
+    def gc(self, **kwds):
+        from . import api
+        return api.gc(session=self, **kwds)
+
+    def inspect_environment(self, path, **kwds):
+        from . import api
+        return api.inspect_environment(path, session=self, **kwds)
+
+    def install(self, path, requirements=None, **kwds):
+        from . import api
+        return api.install(path, requirements, session=self, **kwds)
+
+    def optimize_launchers(self, path, **kwds):
+        from . import api
+        return api.optimize_launchers(path, session=self, **kwds)
+
+    def pack(self, path, **kwds):
+        from . import api
+        return api.pack(path, session=self, **kwds)
+
+    def purge(self, path=None, **kwds):
+        from . import api
+        return api.purge(path=path, session=self, **kwds)
+
+    def reclaim(self, **kwds):
+        from . import api
+        return api.reclaim(session=self, **kwds)
+
+    def remove(self, path, **kwds):
+        from . import api
+        return api.remove(path, session=self, **kwds)
+
+    def resolve_environment(self, name, **kwds):
+        from . import api
+        return api.resolve_environment(name, session=self, **kwds)
+
+    def set_bytecode_policy(self, path, **kwds):
+        from . import api
+        return api.set_bytecode_policy(path, session=self, **kwds)
+
+    def set_module_index(self, path, **kwds):
+        from . import api
+        return api.set_module_index(path, session=self, **kwds)
+
+    def show_envs(self, path=None, **kwds):
+        from . import api
+        return api.show_envs(path=path, session=self, **kwds)
+
+    def stream(self, path, command=None, **kwds):
+        from . import api
+        return api.stream(path, command, session=self, **kwds)
+
+    def sync(self, path, requirements, **kwds):
+        from . import api
+        return api.sync(path, requirements, session=self, **kwds)
+
+    def unpack(self, path, **kwds):
+        from . import api
+        return api.unpack(path, session=self, **kwds)
+
+    def validate_environment(self, path, **kwds):
+        from . import api
+        return api.validate_environment(path, session=self, **kwds)
+
+
+_default_session = None
+_default_session_lock = threading.Lock()
+
+
+def get_session():
+    """Returns the session used when none is given"""
+    global _default_session
+    if _default_session is None:
+        with _default_session_lock:
+            if _default_session is None:
+                _default_session = Vsh()
+    return _default_session
+
+
+def set_session(session):
+    """Replaces the session used when none is given
+
+    Args:
+        session (Vsh): new default session
+
+    Returns:
+        Vsh: the previous default session
+    """
+    global _default_session
+    previous, _default_session = _default_session, session
+    return previous
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _unchanged(folders):
+    for folder, mtime in folders:
+        try:
+            if os.stat(folder).st_mtime_ns != mtime:
+                return False
+        except OSError:
+            return False
+    return True
+
+
+def _unique(items):
+    return tuple(dict.fromkeys(item for item in items if item))
+
+
+def _normalize(path):
+    if not path:
+        return None
+    return os.path.abspath(os.path.expanduser(str(path)))
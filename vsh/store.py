@@ -0,0 +1,323 @@
+"""Deduplication of installed files across virtual environments
+
+Identical files in the site-packages of many environments are replaced
+by links to a single copy kept in a content-addressed store, named by
+sha256 and mode, beside the environments (hard links can't cross
+filesystems).  Files are first grouped by size, so only files which
+could have a duplicate are read, and hashing is spread over a process
+pool reading through mmap.
+
+Hard links share one inode, so a file edited in place changes in every
+environment linking it; pip always replaces files rather than editing
+them.  Reflinks (copy-on-write clones, btrfs and xfs) are safe but
+still count once per environment towards st_blocks.  In reflink mode the
+stored copy is itself a clone, named with a ``.clone`` suffix, and as no
+environment links to it, the files cloned from it are recorded in
+``clones.json`` of the store: a recorded file is not cloned again, and a
+stored clone is kept while any recorded file still uses it.
+"""
+import collections
+import concurrent.futures
+import contextlib
+import hashlib
+import json
+import mmap
+import os
+import stat
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+from .errors import ReflinkUnsupportedError
+
+__all__ = ('CLONE', 'HARDLINK', 'NAME', 'REFLINK', 'DedupeReport', 'dedupe', 'prune')
+
+# Name of the store kept beside environments
+NAME = '.vsh-store'
+
+# Link modes
+HARDLINK = 'hardlink'
+REFLINK = 'reflink'
+
+# ioctl request cloning one file's extents into another (linux/fs.h)
+FICLONE = 0x40049409
+
+# Suffix of stored copies made in reflink mode
+CLONE = '.clone'
+
+# Files of environments cloned from the store, by path: inode, mtime and stored name
+_CLONES = 'clones.json'
+
+DedupeReport = collections.namedtuple('DedupeReport', 'files hashed linked reclaimed errors')
+
+
+def dedupe(paths, store, mode=None, workers=None, dry_run=None):
+    """Links identical files in the site-packages of environments to one copy
+
+    Args:
+        paths (Iterable[str]): paths to virtual environments
+        store (str): content-addressed store on the same filesystem
+        mode (str, optional): hardlink or reflink [default: hardlink]
+        workers (int, optional): processes hashing files [default: os.cpu_count()]
+        dry_run (bool, optional): only report what would be reclaimed
+
+    Raises:
+        ValueError: when mode is unknown
+        ReflinkUnsupportedError: when the store's filesystem can't clone files
+
+    Returns:
+        DedupeReport: files seen, files hashed, files linked, bytes
+            reclaimed and files which couldn't be linked
+    """
+    mode = mode or HARDLINK
+    if mode not in [HARDLINK, REFLINK]:
+        raise ValueError(f'Unknown link mode: {mode!r}')
+    if mode == REFLINK and not dry_run:
+        _check_reflinks(store)
+    clones = _read_clones(store) if mode == REFLINK else {}
+    files = [item for path in paths for item in _iter_files(path)]
+    stored = _stored(store)
+
+    # Only a size shared by two inodes, or with an entry in the store, can be a duplicate
+    inodes = collections.defaultdict(set)
+    for path, info in files:
+        inodes[info.st_size].add((info.st_dev, info.st_ino))
+    stored_sizes = {size for size, _ in stored.values()}
+    candidates = [(path, info) for path, info in files if len(inodes[info.st_size]) > 1 or info.st_size in stored_sizes]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as executor:
+        digests = list(executor.map(_hash_file, [path for path, _ in candidates], chunksize=64))
+
+    linked = reclaimed = 0
+    errors = []
+    if not dry_run:
+        os.makedirs(store, exist_ok=True)
+    for (path, info), digest in zip(candidates, digests):
+        if digest is None:
+            continue
+        name = f'{digest}-{stat.S_IMODE(info.st_mode):o}' + ('' if mode == HARDLINK else CLONE)
+        if name not in stored:
+            # The first copy seen becomes the stored copy; a clone shares its extents
+            if not dry_run:
+                try:
+                    stored_info = _add_to_store(path, os.path.join(store, name[:2], name), mode)
+                except OSError as error:
+                    errors.append((path, error))
+                    continue
+                if mode == REFLINK:
+                    clones[path] = [info.st_ino, info.st_mtime_ns, name]
+            else:
+                stored_info = info
+            stored[name] = (info.st_size, (stored_info.st_dev, stored_info.st_ino))
+            continue
+        if stored[name][1] == (info.st_dev, info.st_ino) or clones.get(path) == [info.st_ino, info.st_mtime_ns, name]:
+            continue
+        if not dry_run:
+            try:
+                _replace(os.path.join(store, name[:2], name), path, mode)
+            except OSError as error:
+                errors.append((path, error))
+                continue
+            if mode == REFLINK:
+                cloned = os.lstat(path)
+                clones[path] = [cloned.st_ino, cloned.st_mtime_ns, name]
+        linked += 1
+        if info.st_nlink == 1:
+            reclaimed += _allocated(info)
+    if mode == REFLINK and not dry_run:
+        _write_clones(store, clones)
+    return DedupeReport(len(files), len(candidates), linked, reclaimed, errors)
+
+
+def prune(store):
+    """Deletes stored copies no longer used by any environment
+
+    A hard linked copy is used while anything else links to it, a clone
+    while a file recorded as cloned from it is unchanged.
+
+    Args:
+        store (str): content-addressed store
+
+    Returns:
+        int: bytes freed
+    """
+    clones = {}
+    for path, (inode, mtime, name) in _read_clones(store).items():
+        with contextlib.suppress(OSError):
+            info = os.lstat(path)
+            if (info.st_ino, info.st_mtime_ns) == (inode, mtime):
+                clones[path] = [inode, mtime, name]
+    used = {name for _, _, name in clones.values()}
+    freed = 0
+    for name, path in _iter_store(store):
+        try:
+            info = os.lstat(path)
+            if (name not in used) if name.endswith(CLONE) else info.st_nlink == 1:
+                os.unlink(path)
+                freed += _allocated(info)
+        except OSError:
+            continue
+    if os.path.exists(os.path.join(store, _CLONES)):
+        _write_clones(store, clones)
+    return freed
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _add_to_store(path, target, mode):
+    """Stores path as target, returning the stat of the stored copy
+
+    A hard link in hardlink mode; in reflink mode a clone, so editing path
+    in place never changes the stored copy.
+    """
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    if mode == HARDLINK:
+        with contextlib.suppress(FileExistsError):
+            os.link(path, target)
+        return os.lstat(target)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    try:
+        _clone(path, temporary)
+        os.chmod(temporary, stat.S_IMODE(os.stat(path).st_mode))
+        os.replace(temporary, target)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporary)
+        raise
+    return os.lstat(target)
+
+
+def _allocated(info):
+    blocks = getattr(info, 'st_blocks', None)
+    return blocks * 512 if blocks is not None else info.st_size
+
+
+def _check_reflinks(store):
+    """Raises ReflinkUnsupportedError unless files in store can be cloned"""
+    os.makedirs(store, exist_ok=True)
+    probe = os.path.join(store, f'.probe.{os.getpid()}')
+    try:
+        with open(probe, 'wb') as stream:
+            stream.write(b'vsh')
+        _clone(probe, f'{probe}{CLONE}')
+    except OSError as error:
+        raise ReflinkUnsupportedError(path=store, reason=error.strerror or error) from error
+    finally:
+        for path in [probe, f'{probe}{CLONE}']:
+            with contextlib.suppress(OSError):
+                os.unlink(path)
+
+
+def _clone(source, destination):
+    """Clones the extents of source into a new file, destination"""
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(source, 'rb') as src, open(destination, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _hash_file(path):
+    """Returns the sha256 of a file, read through mmap; None if unreadable"""
+    digest = hashlib.sha256()
+    try:
+        with open(path, 'rb') as stream:
+            size = os.fstat(stream.fileno()).st_size
+            if size:
+                with mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                    digest.update(data)
+    except (OSError, ValueError):
+        return None
+    return digest.hexdigest()
+
+
+def _iter_files(path):
+    """Yields (path, stat) for the non-empty regular files in an environment's site-packages"""
+    lib_path = os.path.join(path, 'Lib' if os.name == 'nt' else 'lib')
+    folders = []
+    try:
+        with os.scandir(lib_path) as entries:
+            folders = [os.path.join(entry.path, 'site-packages') for entry in entries if entry.is_dir(follow_symlinks=False)]
+    except OSError:
+        pass
+    folders.append(os.path.join(lib_path, 'site-packages'))
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            folders.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            info = entry.stat(follow_symlinks=False)
+                            if info.st_size:
+                                yield entry.path, info
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def _iter_store(store):
+    try:
+        with os.scandir(store) as prefixes:
+            for prefix in prefixes:
+                if not prefix.is_dir(follow_symlinks=False):
+                    continue
+                with os.scandir(prefix.path) as entries:
+                    for entry in entries:
+                        yield entry.name, entry.path
+    except OSError:
+        return
+
+
+def _read_clones(store):
+    """Returns the files recorded as cloned from the store"""
+    try:
+        with open(os.path.join(store, _CLONES)) as stream:
+            clones = json.load(stream)
+    except (OSError, ValueError):
+        return {}
+    return clones if isinstance(clones, dict) else {}
+
+
+def _replace(source, path, mode):
+    """Atomically replaces path with a link or clone of source"""
+    temporary = f'{path}.vsh-dedupe'
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(temporary)
+    try:
+        if mode == HARDLINK:
+            os.link(source, temporary)
+        else:
+            info = os.stat(path)
+            _clone(source, temporary)
+            os.chmod(temporary, stat.S_IMODE(info.st_mode))
+        os.replace(temporary, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.unlink(temporary)
+        raise
+
+
+def _stored(store):
+    """Returns (size, (dev, inode)) of each stored copy by name"""
+    stored = {}
+    for name, path in _iter_store(store):
+        try:
+            info = os.lstat(path)
+        except OSError:
+            continue
+        stored[name] = (info.st_size, (info.st_dev, info.st_ino))
+    return stored
+
+
+def _write_clones(store, clones):
+    """Saves the files recorded as cloned from the store"""
+    target = os.path.join(store, _CLONES)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    with open(temporary, 'w') as stream:
+        json.dump(clones, stream, sort_keys=True)
+    os.replace(temporary, target)
@@ -0,0 +1,370 @@
+"""Trash-and-reap removal of virtual environments
+
+Removing a large environment can take seconds, or much longer on a
+network filesystem.  Instead, an environment is renamed into a
+``.trash`` folder beside it, which is atomic and instant, and the trash
+is emptied later by a detached reaper process (``python -m vsh.trash``),
+by the next vsh invocation or synchronously with ``vsh --purge``.  An
+emptied trash folder is removed along with its lock.
+
+Trees are deleted by ``rmtree``, which opens every folder relative to
+the one above it without following symlinks and spreads the folders
+over a thread pool, as deleting many small files is bound by syscall
+latency rather than bandwidth.
+"""
+import concurrent.futures
+import contextlib
+import os
+import shutil
+import stat
+import subprocess
+import sys
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+__all__ = ('TRASH', 'leftovers', 'move_to_trash', 'reap', 'reap_later', 'rmtree', 'run_detached', 'trash_folders')
+
+# Name of the trash folder kept beside removed environments
+TRASH = '.trash'
+
+# Held by the reaper emptying a trash folder
+_LOCK = '.lock'
+
+
+def move_to_trash(path):
+    """Moves path into the trash folder beside it
+
+    Args:
+        path (str): folder to remove
+
+    Raises:
+        OSError: when path can't be renamed, e.g. it is a mount point
+
+    Returns:
+        str: trash folder holding path
+    """
+    path = os.path.abspath(path)
+    trash = os.path.join(os.path.dirname(path), TRASH)
+    target = os.path.join(trash, f'{os.path.basename(path)}.{time.time_ns()}.{os.getpid()}')
+    for attempt in range(3):
+        os.makedirs(trash, exist_ok=True)
+        try:
+            os.rename(path, target)
+            break
+        except FileNotFoundError:
+            # A reaper removed the emptied trash folder in between
+            if attempt == 2 or not os.path.lexists(path):
+                raise
+    return trash
+
+
+def rmtree(path, workers=None, ignore_errors=None):
+    """Deletes a folder tree
+
+    Every folder is opened relative to its parent with O_NOFOLLOW, so a
+    symlink anywhere in the tree (e.g. lib64 or bin/python) is unlinked
+    rather than followed, even if the tree changes during deletion.
+    Falls back to shutil.rmtree where fd-relative calls are missing.
+
+    Args:
+        path (str): folder to delete; a symlink is unlinked
+        workers (int, optional): folders emptied at once [default: 4 per cpu, at most 32]
+        ignore_errors (bool, optional): ignore failures to delete [default: False]
+
+    Raises:
+        OSError: when anything can't be deleted, unless ignore_errors is set
+    """
+    path = os.path.abspath(path)
+    workers = workers or min(32, 4 * (os.cpu_count() or 1))
+    try:
+        if not stat.S_ISDIR(os.lstat(path).st_mode):
+            os.unlink(path)
+            return
+        if not _supports_fd_calls():
+            shutil.rmtree(path, ignore_errors=bool(ignore_errors))
+            return
+        parent_fd = os.open(os.path.dirname(path), _DIRECTORY_FLAGS)
+        try:
+            name = os.path.basename(path)
+            root_fd = os.open(name, _DIRECTORY_FLAGS | os.O_NOFOLLOW, dir_fd=parent_fd)
+            try:
+                _empty_tree(root_fd, workers, ignore_errors)
+            finally:
+                os.close(root_fd)
+            os.rmdir(name, dir_fd=parent_fd)
+        finally:
+            os.close(parent_fd)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        if not ignore_errors:
+            raise
+
+
+def trash_folders(roots):
+    """Returns the trash folders of roots which hold anything to reap
+
+    Args:
+        roots (Iterable[str]): folders holding virtual environments
+
+    Returns:
+        List[str]: trash folders
+    """
+    folders = []
+    for root in roots:
+        trash = os.path.join(root, TRASH)
+        try:
+            with os.scandir(trash) as entries:
+                if any(entry.name != _LOCK for entry in entries):
+                    folders.append(trash)
+        except OSError:
+            continue
+    return folders
+
+
+def reap(folders, wait=None):
+    """Empties trash folders
+
+    A trash folder already being emptied by another reaper is skipped
+    unless wait is set.  Each pass deletes what the previous one listed,
+    catching environments trashed meanwhile; reaping stops after a pass
+    which deleted nothing, so entries which can't be deleted (EACCES,
+    EBUSY, NFS silly renames) are left for leftovers to report.
+
+    Args:
+        folders (Iterable[str]): trash folders
+        wait (bool, optional): wait for other reapers [default: False]
+
+    Returns:
+        int: number of removed environments deleted
+    """
+    count = 0
+    for folder in folders:
+        with _reaping(folder, wait) as owned:
+            if not owned:
+                continue
+            deleted = True
+            while deleted:
+                deleted = 0
+                for path in leftovers([folder]):
+                    _delete(path)
+                    if not os.path.lexists(path):
+                        deleted += 1
+                count += deleted
+            if not leftovers([folder]):
+                _remove_trash(folder)
+    return count
+
+
+def leftovers(folders):
+    """Returns what is in trash folders, e.g. what reap couldn't delete
+
+    Args:
+        folders (Iterable[str]): trash folders
+
+    Returns:
+        List[str]: paths in the trash folders
+    """
+    paths = []
+    for folder in folders:
+        try:
+            with os.scandir(folder) as entries:
+                paths.extend(entry.path for entry in entries if entry.name != _LOCK)
+        except OSError:
+            continue
+    return sorted(paths)
+
+
+def reap_later(folders):
+    """Empties trash folders from a detached background process
+
+    Args:
+        folders (Iterable[str]): trash folders
+
+    Returns:
+        subprocess.Popen: the reaper, or None if there was nothing to reap
+    """
+    folders = list(folders)
+    if not folders:
+        return None
+    return run_detached('vsh.trash', folders)
+
+
+def run_detached(module, args):
+    """Runs a vsh module in a detached process which outlives this one
+
+    Args:
+        module (str): module to run with python -m
+        args (List[str]): arguments
+
+    Returns:
+        subprocess.Popen: the process, or None if it couldn't be started
+    """
+    # The module must be importable even when vsh isn't installed
+    package_parent = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join(path for path in [package_parent, env.get('PYTHONPATH')] if path)
+    command = [sys.executable, '-m', module] + list(args)
+    try:
+        return subprocess.Popen(command, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                close_fds=True, start_new_session=True)
+    except OSError:
+        return None
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+_DIRECTORY_FLAGS = os.O_RDONLY | getattr(os, 'O_DIRECTORY', 0) | getattr(os, 'O_CLOEXEC', 0)
+
+
+def _delete(path):
+    """Deletes a removed environment"""
+    rmtree(path, ignore_errors=True)
+
+
+def _remove_trash(folder):
+    """Removes an emptied trash folder and its lock, unless trashed into meanwhile"""
+    with contextlib.suppress(OSError):
+        os.unlink(os.path.join(folder, _LOCK))
+    with contextlib.suppress(OSError):
+        os.rmdir(folder)
+
+
+class _Folder:
+    """A folder being emptied; removed by whichever task finishes it last"""
+    __slots__ = ('parent', 'name', 'parent_fd', 'pending')
+
+    def __init__(self, parent, name, parent_fd):
+        self.parent = parent
+        self.name = name
+        self.parent_fd = parent_fd
+        self.pending = 1
+
+
+def _empty_tree(root_fd, workers, ignore_errors, max_queued=64):
+    """Deletes everything below root_fd
+
+    A folder's subfolders are handed to the thread pool, each with an fd
+    opened relative to its parent, while fewer than max_queued are
+    waiting; past that they are emptied inline.  Each folder keeps an fd
+    to its parent and is removed once its last subfolder is.
+    """
+    lock = threading.Lock()
+    finished = threading.Event()
+    errors = []
+    queued = [0]
+
+    def fail(error):
+        if not ignore_errors:
+            errors.append(error)
+
+    def finish(folder):
+        while True:
+            with lock:
+                folder.pending -= 1
+                if folder.pending:
+                    return
+            if folder.parent is None:
+                finished.set()
+                return
+            try:
+                os.rmdir(folder.name, dir_fd=folder.parent_fd)
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                fail(error)
+            finally:
+                os.close(folder.parent_fd)
+            folder = folder.parent
+
+    def run(folder, fd):
+        with lock:
+            queued[0] -= 1
+        try:
+            empty(folder, fd)
+        except OSError as error:
+            fail(error)
+        finally:
+            if fd != root_fd:
+                os.close(fd)
+            finish(folder)
+
+    def empty(folder, fd):
+        with os.scandir(fd) as entries:
+            for entry in entries:
+                try:
+                    if not entry.is_dir(follow_symlinks=False):
+                        os.unlink(entry.name, dir_fd=fd)
+                        continue
+                    child_fd = os.open(entry.name, _DIRECTORY_FLAGS | os.O_NOFOLLOW, dir_fd=fd)
+                except FileNotFoundError:
+                    continue
+                except OSError as error:
+                    fail(error)
+                    continue
+                child = _Folder(folder, entry.name, os.dup(fd))
+                with lock:
+                    folder.pending += 1
+                    defer = queued[0] < max_queued
+                    if defer:
+                        queued[0] += 1
+                if defer:
+                    executor.submit(run, child, child_fd)
+                    continue
+                try:
+                    empty(child, child_fd)
+                except OSError as error:
+                    fail(error)
+                finally:
+                    os.close(child_fd)
+                    finish(child)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        queued[0] += 1
+        executor.submit(run, _Folder(None, None, None), root_fd)
+        finished.wait()
+    if errors:
+        raise errors[0]
+
+
+def _supports_fd_calls():
+    return ({os.open, os.rmdir, os.unlink} <= os.supports_dir_fd and os.scandir in os.supports_fd
+            and hasattr(os, 'O_NOFOLLOW') and hasattr(os, 'O_DIRECTORY'))
+
+
+@contextlib.contextmanager
+def _reaping(folder, wait=None):
+    """Yields True when this process owns the right to empty folder"""
+    if fcntl is None:
+        yield True
+        return
+    path = os.path.join(folder, _LOCK)
+    stream = None
+    while stream is None:
+        try:
+            stream = open(path, 'a')
+            fcntl.flock(stream, fcntl.LOCK_EX if wait else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # The reaper before may have removed the lock along with the emptied folder
+            if not os.path.samestat(os.fstat(stream.fileno()), os.stat(path)):
+                stream.close()
+                stream = None
+        except OSError:
+            if stream:
+                stream.close()
+            yield False
+            return
+    with stream:
+        try:
+            yield True
+        finally:
+            fcntl.flock(stream, fcntl.LOCK_UN)
+
+
+if __name__ == '__main__':
+    reap(sys.argv[1:])
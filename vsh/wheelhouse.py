@@ -0,0 +1,233 @@
+"""Local wheelhouse for fast and offline installs
+
+Requirements are resolved once with ``pip download``; wheels go straight
+into the wheelhouse and source distributions are built into wheels
+concurrently, each ``pip wheel`` in its own process.  Installs then point
+pip at the wheelhouse with ``--find-links``, and offline installs add
+``--no-index`` after checking up front that every requirement, and every
+dependency the matching wheels declare, has a wheel, so a missing wheel
+fails fast rather than deep inside pip.  Constraint files (``-c``) pin
+versions both when building and when checking.
+"""
+import collections
+import concurrent.futures
+import email.parser
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import zipfile
+
+from .dists import normalize
+from .errors import WheelsMissingError
+
+__all__ = ('build', 'install_args', 'missing', 'read_constraints', 'read_requirements')
+
+# Source distribution suffixes pip download may save
+SDISTS = ('.tar.gz', '.tar.bz2', '.tar.xz', '.tgz', '.zip')
+
+# Name, extras and any == pin of a requirement line
+_REQUIREMENT = re.compile(r'\s*(?P<name>[A-Za-z0-9][A-Za-z0-9._-]*)\s*(\[(?P<extras>[^\]]*)\])?\s*(==\s*(?P<version>[^\s,;)]+))?')
+
+
+def read_constraints(path):
+    """Reads the constraint lines of a requirements file, following -r and -c includes
+
+    Args:
+        path (str): requirements file
+
+    Returns:
+        List[str]: constraints of the -c files named, without comments and pip options
+    """
+    return _read(path)[1]
+
+
+def read_requirements(path):
+    """Reads requirement lines, following -r includes
+
+    Args:
+        path (str): requirements file
+
+    Returns:
+        List[str]: requirements, without comments, pip options or constraints
+    """
+    return _read(path)[0]
+
+
+def missing(requirements, wheelhouse, constraints=None):
+    """Returns the requirements, or dependencies of theirs, without a matching wheel
+
+    Names are matched, and versions where the requirement or a constraint
+    pins one with ==; anything else (urls, paths or other specifiers) is
+    matched on name alone.  The dependencies declared by the matching
+    wheels are then checked in turn, so the whole set pip will ask for is
+    covered.  Dependencies behind environment markers, other than those
+    of requested extras, are left to pip.
+
+    Args:
+        requirements (Iterable[str]): requirement lines
+        wheelhouse (str): folder of wheels
+        constraints (Iterable[str], optional): constraint lines
+
+    Returns:
+        List[str]: requirements with no wheel, and missing dependencies as "dependency (from requirement)"
+    """
+    wheels = collections.defaultdict(list)
+    try:
+        with os.scandir(wheelhouse) as entries:
+            for entry in entries:
+                if entry.name.endswith('.whl'):
+                    name, version = entry.name.split('-')[:2]
+                    wheels[normalize(name)].append((version, entry.path))
+    except OSError:
+        pass
+    pins = {}
+    for constraint in constraints or []:
+        found = _REQUIREMENT.match(constraint)
+        if found and found.group('version'):
+            pins[normalize(found.group('name'))] = found.group('version')
+    absent = []
+    seen = set()
+    pending = collections.deque((requirement, None) for requirement in requirements)
+    while pending:
+        requirement, parent = pending.popleft()
+        found = _REQUIREMENT.match(requirement)
+        if not found:
+            continue
+        name = normalize(found.group('name'))
+        version = found.group('version') or pins.get(name)
+        extras = frozenset(normalize(extra) for extra in re.findall(r'[^\s,]+', found.group('extras') or ''))
+        if (name, version, extras) in seen:
+            continue
+        seen.add((name, version, extras))
+        candidates = [path for wheel_version, path in wheels.get(name, []) if version in [None, wheel_version]]
+        if not candidates:
+            absent.append(requirement if parent is None else f'{requirement} (from {parent})')
+            continue
+        # Only dependencies every candidate declares are sure to be asked for, whichever pip picks
+        shared = set.intersection(*(set(_requires(path, extras)) for path in candidates))
+        pending.extend((dependency, requirement) for dependency in sorted(shared))
+    return absent
+
+
+def install_args(wheelhouse, requirements=None, offline=None, constraints=None):
+    """Returns the pip install options which use the wheelhouse
+
+    Args:
+        wheelhouse (str): folder of wheels
+        requirements (Iterable[str], optional): requirements to check when offline
+        offline (bool, optional): never use the package index
+        constraints (Iterable[str], optional): constraints the check pins versions with
+
+    Raises:
+        WheelsMissingError: when offline and a requirement has no wheel
+
+    Returns:
+        List[str]: pip install options
+    """
+    args = ['--find-links', wheelhouse]
+    if offline:
+        absent = missing(requirements or [], wheelhouse, constraints=constraints)
+        if absent:
+            raise WheelsMissingError(wheelhouse=wheelhouse, requirements=', '.join(absent))
+        args.insert(0, '--no-index')
+    return args
+
+
+def build(requirements, wheelhouse, python=None, workers=None, pip_args=None, constraints=None):
+    """Adds wheels for requirements and their dependencies to the wheelhouse
+
+    Args:
+        requirements (Iterable[str]): requirement lines
+        wheelhouse (str): folder of wheels
+        python (str, optional): interpreter the wheels are for [default: sys.executable]
+        workers (int, optional): wheels built at once [default: os.cpu_count()]
+        pip_args (List[str], optional): extra options for pip, e.g. an index url
+        constraints (Iterable[str], optional): constraint lines the resolve honours
+
+    Raises:
+        subprocess.CalledProcessError: when pip fails to download or build
+
+    Returns:
+        List[str]: names of the wheels added
+    """
+    python = python or sys.executable
+    pip_args = list(pip_args or [])
+    os.makedirs(wheelhouse, exist_ok=True)
+    before = set(os.listdir(wheelhouse))
+    with tempfile.TemporaryDirectory(prefix='vsh-wheelhouse-') as staging:
+        requirements_file = os.path.join(staging, 'requirements.txt')
+        with open(requirements_file, 'w') as stream:
+            stream.write('\n'.join(requirements) + '\n')
+        if constraints:
+            constraints_file = os.path.join(staging, 'constraints.txt')
+            with open(constraints_file, 'w') as stream:
+                stream.write('\n'.join(constraints) + '\n')
+            pip_args += ['-c', constraints_file]
+        downloads = os.path.join(staging, 'downloads')
+        # One resolve for the whole set; existing wheels are reused
+        _pip(python, 'download', '--dest', downloads, '--find-links', wheelhouse, *pip_args, '-r', requirements_file)
+        sdists = []
+        for name in sorted(os.listdir(downloads)):
+            source = os.path.join(downloads, name)
+            if name.endswith('.whl'):
+                if not os.path.exists(os.path.join(wheelhouse, name)):
+                    shutil.move(source, os.path.join(wheelhouse, name))
+            elif name.endswith(SDISTS):
+                sdists.append(source)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            futures = [
+                executor.submit(_pip, python, 'wheel', '--no-deps', '--wheel-dir', wheelhouse, '--find-links', wheelhouse, *pip_args, sdist)
+                for sdist in sdists
+                ]
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+    return sorted(set(os.listdir(wheelhouse)) - before)
+
+
+# ----------------------------------------------------------------------
+# Support
+# ----------------------------------------------------------------------
+def _read(path, constraint=False):
+    """Returns the requirement and constraint lines of a requirements file and those it includes"""
+    requirements = []
+    constraints = []
+    with open(path) as stream:
+        for line in stream:
+            line = re.sub(r'(^|\s)#.*$', '', line).strip()
+            if not line:
+                continue
+            include = re.fullmatch(r'(?P<option>-r|--requirement|-c|--constraint)[\s=]+(?P<path>\S+)', line)
+            if include:
+                nested = _read(os.path.join(os.path.dirname(path), include.group('path')), constraint or include.group('option') in ['-c', '--constraint'])
+                requirements.extend(nested[0])
+                constraints.extend(nested[1])
+            elif not line.startswith('-'):
+                (constraints if constraint else requirements).append(line)
+    return requirements, constraints
+
+
+def _requires(wheel_path, extras):
+    """Returns the dependencies a wheel declares, for extras, leaving those behind other markers to pip"""
+    try:
+        with zipfile.ZipFile(wheel_path) as archive:
+            metadata = next(name for name in archive.namelist() if name.count('/') == 1 and name.endswith('.dist-info/METADATA'))
+            headers = email.parser.BytesHeaderParser().parsebytes(archive.read(metadata))
+    except (OSError, StopIteration, zipfile.BadZipFile):
+        return []
+    requires = []
+    for value in headers.get_all('Requires-Dist') or []:
+        requirement, _, marker = value.partition(';')
+        marker = marker.strip()
+        if marker:
+            extra = re.fullmatch(r'extra\s*==\s*[\'"]([^\'"]+)[\'"]', marker)
+            if not extra or normalize(extra.group(1)) not in extras:
+                continue
+        requires.append(requirement.strip())
+    return requires
+
+
+def _pip(python, *args):
+    subprocess.run([python, '-m', 'pip', *args, '--disable-pip-version-check', '--quiet'], check=True, stdin=subprocess.DEVNULL)